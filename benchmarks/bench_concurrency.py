@@ -0,0 +1,130 @@
+# benchmarks/bench_concurrency.py
+"""
+Read throughput under a concurrent writer.
+
+Runs reader threads against a database while one writer thread keeps updating
+records (each update persisted by a full snapshot rewrite), and reports reads
+and writes per second plus tail read latency for increasing reader counts.
+Half of the reads are point reads and half are small key-range pages, so both
+the lock-free and the shared-lock read paths are exercised. The 'exclusive'
+engine reproduces the previous behaviour, where a single lock was held for
+reads, writes and the file rewrite, as a baseline.
+
+Usage: python benchmarks/bench_concurrency.py [--records N] [--duration S] [--output FILE]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from main import DatabaseEngine, SimpleNoSQLDB
+
+class ExclusiveLock:
+    """One reentrant lock used for both reads and writes."""
+    def __init__(self):
+        self._lock = threading.RLock()
+
+    def read_lock(self):
+        return self._lock
+
+    write_lock = read_lock
+
+    def __enter__(self):
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._lock.release()
+
+class ExclusiveEngine(DatabaseEngine):
+    """Engine that holds its only lock across persistence, like the original implementation."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = ExclusiveLock()
+
+    def persist(self, version):
+        with self.lock.write_lock():
+            super().persist(version)
+
+ENGINES = {'rwlock': DatabaseEngine, 'exclusive': ExclusiveEngine}
+
+def run_case(engine_cls, db_file, readers, duration, records):
+    db = SimpleNoSQLDB(db_file, engine=engine_cls(db_file))
+    stop = threading.Event()
+    read_counts = [0] * readers
+    latencies = [[] for _ in range(readers)]
+    write_count = [0]
+
+    def reader(slot):
+        i = 0
+        samples = latencies[slot]
+        while not stop.is_set():
+            start = time.perf_counter()
+            if i % 2:
+                db.read(f'key{i % records}')
+            else:
+                db.keys_page(after=f'key{i % records}', limit=10)
+            samples.append(time.perf_counter() - start)
+            i += 1
+        read_counts[slot] = i
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            db.update(f'key{i % records}', {'value': i, 'payload': 'x' * 32})
+            i += 1
+        write_count[0] = i
+
+    threads = [threading.Thread(target=reader, args=(slot,)) for slot in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    samples = sorted(sample for slot in latencies for sample in slot)
+    return {
+        'reads_per_sec': round(sum(read_counts) / duration),
+        'writes_per_sec': round(write_count[0] / duration, 1),
+        'read_p99_ms': round(samples[int(len(samples) * 0.99)] * 1000, 3),
+        'read_max_ms': round(samples[-1] * 1000, 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark read throughput with a concurrent writer')
+    parser.add_argument('--records', type=int, default=20000, help='Number of records in the database')
+    parser.add_argument('--duration', type=float, default=2.0, help='Seconds to run each case')
+    parser.add_argument('--readers', type=int, nargs='+', default=[1, 2, 4, 8], help='Reader thread counts')
+    parser.add_argument('--output', type=str, help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = os.path.join(tmp_dir, 'bench.json')
+        with open(db_file, 'w') as f:
+            json.dump({f'key{i}': {'value': i, 'payload': 'x' * 32} for i in range(args.records)}, f)
+        results = []
+        for name, engine_cls in ENGINES.items():
+            for readers in args.readers:
+                result = run_case(engine_cls, db_file, readers, args.duration, args.records)
+                result.update({'engine': name, 'readers': readers})
+                results.append(result)
+                print(f"{name:>9} readers={readers}: {result['reads_per_sec']} reads/s, "
+                      f"{result['writes_per_sec']} writes/s, read p99 {result['read_p99_ms']} ms, "
+                      f"max {result['read_max_ms']} ms", file=sys.stderr)
+
+    report = {'benchmark': 'concurrency', 'records': args.records, 'duration': args.duration, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# benchmarks/bench_storage_formats.py
+"""
+Load time, save time and file size of the storage formats.
+
+Writes the same synthetic database in the indented JSON format and in the
+binary format (with and without compression), then reports the time to save
+it, the time to load it back and the resulting file size, for increasing
+record counts. For binary files it also reports the cold cost of opening the
+file and reading a single key, loading everything versus memory-mapping it
+and decoding only that record (lazy).
+
+Usage: python benchmarks/bench_storage_formats.py [--records N ...] [--repeat R] [--output FILE]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from storage import JSONFormat, BinaryFormat
+
+FORMATS = {
+    'json': JSONFormat(),
+    'binary': BinaryFormat(),
+    'binary+zlib': BinaryFormat(compress=True),
+}
+
+def make_store(records):
+    return {
+        f'user:{i:08d}': {
+            'name': f'User {i}',
+            'age': 18 + i % 60,
+            'email': f'user{i}@example.com',
+            'tags': ['alpha', 'beta', 'gamma'][:1 + i % 3],
+            'bio': 'Enjoys long walks and short queries. ' * (1 + i % 4),
+        }
+        for i in range(records)
+    }
+
+def best_of(repeat, func):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def run_case(storage_format, store, path, repeat):
+    def save():
+        with open(path, 'wb') as f:
+            f.write(storage_format.dumps(store))
+
+    save_time = best_of(repeat, save)
+    load_time = best_of(repeat, lambda: storage_format.load(path))
+    assert storage_format.load(path) == store
+    result = {
+        'save_ms': round(save_time * 1000, 2),
+        'load_ms': round(load_time * 1000, 2),
+        'size_bytes': os.path.getsize(path),
+    }
+    if isinstance(storage_format, BinaryFormat):
+        key = next(iter(store))
+        lazy_time = best_of(repeat, lambda: storage_format.open_lazy(path)[key])
+        result['lazy_open_read_ms'] = round(lazy_time * 1000, 3)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare storage formats by load/save time and file size')
+    parser.add_argument('--records', type=int, nargs='+', default=[1000, 10000, 100000], help='Record counts')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement; the fastest is reported')
+    parser.add_argument('--output', type=str, help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for records in args.records:
+            store = make_store(records)
+            for name, storage_format in FORMATS.items():
+                path = os.path.join(tmp_dir, f'bench{storage_format.extension}')
+                result = run_case(storage_format, store, path, args.repeat)
+                result.update({'format': name, 'records': records})
+                results.append(result)
+                lazy = f", lazy open+read {result['lazy_open_read_ms']} ms" if 'lazy_open_read_ms' in result else ''
+                print(f"{name:>11} records={records}: save {result['save_ms']} ms, "
+                      f"load {result['load_ms']} ms, {result['size_bytes']} bytes{lazy}", file=sys.stderr)
+
+    report = {'benchmark': 'storage_formats', 'repeat': args.repeat, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,418 @@
+# benchmarks/bench_suite.py
+"""
+Benchmark suite for SimpleNoSQLDB and the Flask app.
+
+Cases (select with --cases, default all):
+- crud          create/read/update/delete throughput, in and out of a
+                transaction, for each storage mode
+- transactions  begin_transaction and commit cost as the database grows
+- query         query latency per operator and selectivity, without an index
+                and with hash, sorted and (if NumPy is installed) column
+                indexes on the field, plus the time to build each index
+- aggregate     aggregate() (count/sum/avg, with and without group-by)
+                against find() plus the same aggregation in the caller,
+                without indexes and with sorted or column indexes on 'age'
+- load          cold-start cost of opening a database (_load_data) per format,
+                eager and lazy
+- read_cache    read latency of a lazily opened binary database under a
+                skewed (Zipf-like) key distribution, with and without the
+                value cache
+- cli           end-to-end latency of cli.py invocations (process start,
+                opening the database and running the command) per format
+- flask         end-to-end request latency through the Flask test client
+                (skipped if Flask is not installed)
+
+Databases are generated with datagen.py in a temporary directory, so runs
+are reproducible for a given seed. Results are written as one JSON report
+including the environment and git revision, for tracking regressions.
+
+Usage: python benchmarks/bench_suite.py [--records N] [--sizes N ...] [--cases NAME ...] [--output FILE]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from datagen import generate_records, make_key
+from indexes import NUMPY_AVAILABLE
+from main import DatabaseEngine, DatabaseManager, DatabaseRegistry, SimpleNoSQLDB
+from storage import get_format
+
+# (operator, value, expected fraction of matches) on the uniform 0-99 'age' field.
+QUERY_CASES = [
+    ('=', 42, 0.01),
+    ('!=', 42, 0.99),
+    ('<', 1, 0.01),
+    ('<', 10, 0.10),
+    ('<', 50, 0.50),
+    ('<=', 9, 0.10),
+    ('>', 89, 0.10),
+    ('>=', 99, 0.01),
+]
+
+def write_database(path, records, storage_format='json'):
+    with open(path, 'wb') as f:
+        f.write(get_format(storage_format).dumps(records))
+    return path
+
+def latency_stats(samples):
+    samples = sorted(samples)
+    return {
+        'median_ms': round(statistics.median(samples) * 1000, 4),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 4),
+        'p99_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 4),
+        'max_ms': round(samples[-1] * 1000, 4),
+    }
+
+def time_calls(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def throughput(count, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    return round(count / elapsed, 1) if elapsed else None
+
+def bench_crud(args, tmp_dir):
+    records = generate_records(args.records, payload_bytes=args.payload_bytes, seed=args.seed)
+    ops = min(args.ops, args.records // 2)
+    results = []
+    for storage_mode in ('snapshot', 'wal'):
+        for in_transaction in (False, True):
+            path = write_database(os.path.join(tmp_dir, f'crud_{storage_mode}_{in_transaction}.json'), records)
+            db = SimpleNoSQLDB(path, storage_mode=storage_mode)
+            # Creates add new keys; reads, updates and deletes touch existing ones.
+            new_keys = [f'bench:{i:08d}' for i in range(ops)]
+            existing = [make_key(i) for i in range(ops)]
+            doomed = [make_key(ops + i) for i in range(ops)]
+            value = {'name': 'bench', 'age': 1, 'payload': 'y' * args.payload_bytes}
+            if in_transaction:
+                db.begin_transaction()
+            result = {
+                'case': 'crud',
+                'storage_mode': storage_mode,
+                'in_transaction': in_transaction,
+                'records': args.records,
+                'ops': ops,
+                'create_per_sec': throughput(ops, lambda: [db.create(key, value) for key in new_keys]),
+                'read_per_sec': throughput(ops, lambda: [db.read(key) for key in existing]),
+                'update_per_sec': throughput(ops, lambda: [db.update(key, value) for key in existing]),
+                'delete_per_sec': throughput(ops, lambda: [db.delete(key) for key in doomed]),
+            }
+            if in_transaction:
+                start = time.perf_counter()
+                db.commit()
+                result['commit_ms'] = round((time.perf_counter() - start) * 1000, 3)
+            db.close()
+            results.append(result)
+    return results
+
+def bench_transactions(args, tmp_dir):
+    results = []
+    for size in args.sizes:
+        records = generate_records(size, payload_bytes=args.payload_bytes, seed=args.seed)
+        for storage_mode in ('snapshot', 'wal'):
+            path = write_database(os.path.join(tmp_dir, f'txn_{size}_{storage_mode}.json'), records)
+            db = SimpleNoSQLDB(path, storage_mode=storage_mode)
+            begin_samples = []
+            commit_samples = []
+            for round_number in range(args.repeat):
+                start = time.perf_counter()
+                db.begin_transaction()
+                begin_samples.append(time.perf_counter() - start)
+                for i in range(args.txn_writes):
+                    db.update(make_key(i), {'round': round_number, 'i': i})
+                start = time.perf_counter()
+                db.commit()
+                commit_samples.append(time.perf_counter() - start)
+            db.close()
+            results.append({
+                'case': 'transactions',
+                'storage_mode': storage_mode,
+                'records': size,
+                'writes_per_transaction': args.txn_writes,
+                'begin': latency_stats(begin_samples),
+                'commit': latency_stats(commit_samples),
+            })
+    return results
+
+def bench_query(args, tmp_dir):
+    records = generate_records(args.records, payload_bytes=args.payload_bytes, seed=args.seed)
+    path = write_database(os.path.join(tmp_dir, 'query.json'), records)
+    db = SimpleNoSQLDB(path)
+    results = []
+    for index_kind in INDEX_KINDS:
+        build = None
+        if index_kind is not None:
+            if 'age' in db.list_indexes():
+                db.drop_index('age')
+            start = time.perf_counter()
+            db.create_index('age', index_kind)
+            # Indexes are built on first use unless others were built already.
+            db.indexes
+            build = round((time.perf_counter() - start) * 1000, 4)
+        for operator, value, selectivity in QUERY_CASES:
+            matches = len(db.query('age', operator, value))
+            result = {
+                'case': 'query',
+                'index': index_kind or 'none',
+                'index_build_ms': build,
+                'operator': operator,
+                'value': value,
+                'selectivity': selectivity,
+                'matches': matches,
+                'records': args.records,
+            }
+            result.update(latency_stats(time_calls(lambda: db.query('age', operator, value), args.repeat)))
+            results.append(result)
+    return results
+
+# Index kinds compared by the query and aggregate cases; column indexes need NumPy.
+INDEX_KINDS = (None, 'hash', 'sorted') + (('column',) if NUMPY_AVAILABLE else ())
+
+# (aggregates, group_by, where) over the generated 'age' and 'city' fields.
+AGGREGATE_CASES = [
+    ('count, sum(age), avg(age)', None, None),
+    ('count', 'city', None),
+    ('count, avg(age)', 'city', {'field': 'age', 'op': '<', 'value': 50}),
+]
+
+def find_and_aggregate(db, group_by, where):
+    """The caller-side equivalent of aggregate('count, sum(age)'): fetch the records, then count and sum."""
+    groups = {}
+    for record in db.find(where).values():
+        group = groups.setdefault(record.get(group_by) if group_by else None, [0, 0])
+        group[0] += 1
+        group[1] += record.get('age', 0)
+    return groups
+
+def bench_aggregate(args, tmp_dir):
+    records = generate_records(args.records, payload_bytes=args.payload_bytes, seed=args.seed)
+    path = write_database(os.path.join(tmp_dir, 'aggregate.json'), records)
+    db = SimpleNoSQLDB(path)
+    results = []
+    for index_kind in INDEX_KINDS:
+        if index_kind == 'hash':
+            continue
+        if index_kind is not None:
+            if 'age' in db.list_indexes():
+                db.drop_index('age')
+            db.create_index('age', index_kind)
+            if 'city' not in db.list_indexes():
+                db.create_index('city', 'hash')
+        for aggregates, group_by, where in AGGREGATE_CASES:
+            result = {
+                'case': 'aggregate',
+                'index': index_kind or 'none',
+                'aggregates': aggregates,
+                'group_by': group_by,
+                'where': where,
+                'records': args.records,
+            }
+            result['aggregate'] = latency_stats(time_calls(lambda: db.aggregate(aggregates, group_by, where), args.repeat))
+            result['find'] = latency_stats(time_calls(lambda: find_and_aggregate(db, group_by, where), args.repeat))
+            results.append(result)
+    return results
+
+def bench_load(args, tmp_dir):
+    results = []
+    for size in args.sizes:
+        records = generate_records(size, payload_bytes=args.payload_bytes, seed=args.seed)
+        key = make_key(size // 2)
+        for storage_format in ('json', 'binary'):
+            extension = get_format(storage_format).extension
+            path = write_database(os.path.join(tmp_dir, f'load_{size}{extension}'), records, storage_format)
+            for lazy in (False, True):
+                if lazy and storage_format == 'json':
+                    continue
+                open_samples = []
+                read_samples = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    engine = DatabaseEngine(path, lazy=lazy)
+                    opened = time.perf_counter()
+                    engine.store.get(key)
+                    open_samples.append(opened - start)
+                    read_samples.append(time.perf_counter() - opened)
+                    engine.close()
+                results.append({
+                    'case': 'load',
+                    'format': storage_format,
+                    'lazy': lazy,
+                    'records': size,
+                    'size_bytes': os.path.getsize(path),
+                    'open': latency_stats(open_samples),
+                    'first_read': latency_stats(read_samples),
+                })
+    return results
+
+def bench_read_cache(args, tmp_dir):
+    records = generate_records(args.records, payload_bytes=args.payload_bytes, seed=args.seed)
+    path = write_database(os.path.join(tmp_dir, 'read_cache.ndb'), records, 'binary')
+    rng = random.Random(args.seed)
+    # Zipf-like skew: key rank r is drawn with probability proportional to 1/r.
+    weights = [1 / rank for rank in range(1, args.records + 1)]
+    keys = [make_key(i) for i in rng.choices(range(args.records), weights=weights, k=args.ops * 50)]
+    results = []
+    for cache_bytes in (None, args.cache_bytes):
+        engine = DatabaseEngine(path, lazy=True, cache_bytes=cache_bytes)
+        samples = []
+        for key in keys:
+            start = time.perf_counter()
+            engine.store.get(key)
+            samples.append(time.perf_counter() - start)
+        results.append({
+            'case': 'read_cache',
+            'records': args.records,
+            'reads': len(keys),
+            'cache_bytes': cache_bytes,
+            'read': latency_stats(samples),
+            'cache': engine.stats()['cache'],
+        })
+        engine.close()
+    return results
+
+def bench_cli(args, tmp_dir):
+    records = generate_records(args.records, payload_bytes=args.payload_bytes, seed=args.seed)
+    # cli.py opens databases in '../data/databases' relative to the working directory.
+    run_dir = os.path.join(tmp_dir, 'cli', 'run')
+    databases_dir = os.path.join(tmp_dir, 'cli', 'data', 'databases')
+    os.makedirs(run_dir)
+    os.makedirs(databases_dir)
+    cli = os.path.join(SRC_DIR, 'cli.py')
+    key = make_key(args.records // 2)
+    commands = {
+        'read': ['read', 'bench', key],
+        'list --limit 10': ['list', 'bench', '--limit', '10'],
+        'query --limit 10': ['query', 'bench', 'age', '<', '1', '--limit', '10'],
+    }
+    results = []
+    for storage_format in ('json', 'binary'):
+        extension = get_format(storage_format).extension
+        path = write_database(os.path.join(databases_dir, f'bench{extension}'), records, storage_format)
+        for name, command in commands.items():
+            def run():
+                subprocess.run([sys.executable, cli] + command, cwd=run_dir, check=True, stdout=subprocess.DEVNULL)
+            result = {'case': 'cli', 'format': storage_format, 'command': name, 'records': args.records}
+            result.update(latency_stats(time_calls(run, args.cli_repeat)))
+            results.append(result)
+        os.remove(path)
+    return results
+
+def bench_flask(args, tmp_dir):
+    try:
+        import flask  # noqa: F401
+    except ImportError:
+        return [{'case': 'flask', 'skipped': 'Flask is not installed'}]
+    # app.py creates its default database directory relative to the working directory.
+    run_dir = os.path.join(tmp_dir, 'flask', 'run')
+    os.makedirs(run_dir)
+    cwd = os.getcwd()
+    os.chdir(run_dir)
+    try:
+        import app as app_module
+    finally:
+        os.chdir(cwd)
+    manager = DatabaseManager(os.path.join(tmp_dir, 'flask', 'databases'), registry=DatabaseRegistry())
+    app_module.db_manager = manager
+    manager.create_database('bench')
+    manager.get_db('bench').bulk_create(generate_records(args.records, payload_bytes=args.payload_bytes,
+                                                         seed=args.seed))
+    client = app_module.app.test_client()
+    key = make_key(args.records // 2)
+    requests = {
+        'GET /api/<db>/<key>': lambda: client.get(f'/api/bench/{key}'),
+        'PUT /api/<db>/<key>': lambda: client.put(f'/api/bench/{key}', json={'age': 7}),
+        'POST /api/<db>/_mget': lambda: client.post('/api/bench/_mget', json=[make_key(i) for i in range(10)]),
+        'GET /api/<db>/_keys': lambda: client.get('/api/bench/_keys?limit=100'),
+        'POST /api/<db>/_query': lambda: client.post('/api/bench/_query',
+                                                    json={'field': 'age', 'operator': '<', 'value': 10,
+                                                          'limit': 100}),
+        'POST /database/<db>?action=read': lambda: client.post('/database/bench?action=read', data={'key': key}),
+    }
+    results = []
+    for name, send in requests.items():
+        response = send()
+        if response.status_code >= 400:
+            raise RuntimeError(f'{name} returned {response.status_code}')
+        result = {'case': 'flask', 'request': name, 'records': args.records}
+        result.update(latency_stats(time_calls(send, args.repeat)))
+        results.append(result)
+    return results
+
+CASES = {
+    'crud': bench_crud,
+    'transactions': bench_transactions,
+    'query': bench_query,
+    'aggregate': bench_aggregate,
+    'load': bench_load,
+    'read_cache': bench_read_cache,
+    'cli': bench_cli,
+    'flask': bench_flask,
+}
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BENCH_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the SimpleNoSQLDB benchmark suite')
+    parser.add_argument('--cases', type=str, nargs='+', choices=list(CASES), default=list(CASES),
+                        help='Cases to run')
+    parser.add_argument('--records', type=int, default=10000, help='Database size for crud, query, aggregate and flask')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Database sizes for transactions and load')
+    parser.add_argument('--ops', type=int, default=200, help='Operations per crud measurement')
+    parser.add_argument('--txn-writes', type=int, default=10, help='Updates per transaction')
+    parser.add_argument('--repeat', type=int, default=20, help='Samples per latency measurement')
+    parser.add_argument('--cli-repeat', type=int, default=5, help='Samples per cli.py command')
+    parser.add_argument('--cache-bytes', type=int, default=16 * 1024 * 1024, help='Value cache size for read_cache')
+    parser.add_argument('--payload-bytes', type=int, default=64, help='Size of the filler field of each record')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated data')
+    parser.add_argument('--output', type=str, help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in args.cases:
+            start = time.perf_counter()
+            case_results = CASES[name](args, tmp_dir)
+            results.extend(case_results)
+            print(f"{name}: {len(case_results)} result(s) in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+
+    report = {
+        'benchmark': 'suite',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {key: value for key, value in vars(args).items() if key != 'output'},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+if __name__ == '__main__':
+    main()
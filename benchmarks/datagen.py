@@ -0,0 +1,64 @@
+# benchmarks/datagen.py
+"""
+Synthetic data for benchmarks.
+
+generate_records() builds N deterministic records of a configurable shape.
+Field distributions are fixed so queries of known selectivity can be built:
+'age' is uniform over 0-99 (so 'age < 10' matches 10% of records), 'city'
+takes one of CITIES uniformly, 'score' is a float in [0, 1) and 'active' is
+true for half the records. extra_fields adds 'fN' string fields and
+payload_bytes sizes a filler string.
+
+Run as a script to write the records as JSON lines for `cli.py import`:
+
+    python benchmarks/datagen.py 100000 --output users.jsonl
+"""
+
+import argparse
+import json
+import random
+import sys
+
+CITIES = ['Amsterdam', 'Berlin', 'Cairo', 'Delhi', 'Lima', 'Oslo', 'Paris', 'Quito', 'Rome', 'Tokyo']
+
+def make_key(i):
+    return f'user:{i:08d}'
+
+def make_record(rng, i, extra_fields=0, payload_bytes=64):
+    record = {
+        'name': f'User {i}',
+        'age': rng.randrange(100),
+        'city': rng.choice(CITIES),
+        'score': rng.random(),
+        'active': i % 2 == 0,
+        'payload': 'x' * payload_bytes,
+    }
+    for field in range(extra_fields):
+        record[f'f{field}'] = f'value {rng.randrange(1000)}'
+    return record
+
+def generate_records(count, extra_fields=0, payload_bytes=64, seed=0):
+    """Return a dict of `count` synthetic records keyed 'user:00000000', 'user:00000001', ..."""
+    rng = random.Random(seed)
+    return {make_key(i): make_record(rng, i, extra_fields, payload_bytes) for i in range(count)}
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic records as JSON lines')
+    parser.add_argument('records', type=int, help='Number of records')
+    parser.add_argument('--extra-fields', type=int, default=0, help='Number of additional string fields')
+    parser.add_argument('--payload-bytes', type=int, default=64, help='Size of the filler string field')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--output', type=str, help='Write to this file instead of stdout')
+    args = parser.parse_args()
+
+    records = generate_records(args.records, args.extra_fields, args.payload_bytes, args.seed)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for key, value in records.items():
+            out.write(json.dumps({'key': key, 'value': value}) + '\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+# src/aggregate.py
+
+import re
+from indexes import _as_number
+from query import _sort_value, field_getter
+
+AGGREGATE_FUNCTIONS = ('count', 'sum', 'min', 'max', 'avg')
+_SPEC = re.compile(r'^\s*(count|sum|min|max|avg)\s*(?:\(\s*([^()\s]*)\s*\))?\s*$')
+
+def parse_aggregates(aggregates):
+    """
+    Parse aggregates such as 'count', 'count(email)', 'sum(price)' or
+    'avg(address.age)' (a list of them, or one string separating them with
+    commas) into [(name, function, field)]; field is None for a plain count.
+    """
+    if isinstance(aggregates, str):
+        aggregates = [spec for spec in aggregates.split(',') if spec.strip()]
+    parsed = []
+    for spec in aggregates or ():
+        match = _SPEC.match(spec) if isinstance(spec, str) else None
+        if match is None:
+            raise ValueError(f"Invalid aggregate {spec!r}: expected count or one of "
+                             f"{', '.join(f'{function}(field)' for function in AGGREGATE_FUNCTIONS)}.")
+        function, field = match.group(1), match.group(2) or None
+        if field is None and function != 'count':
+            raise ValueError(f"Aggregate '{function}' needs a field, e.g. {function}(price).")
+        name = function if field is None else f"{function}({field})"
+        if all(name != other for other, _, _ in parsed):
+            parsed.append((name, function, field))
+    if not parsed:
+        raise ValueError("Give at least one aggregate, e.g. count or sum(price).")
+    return parsed
+
+class Aggregation:
+    """
+    Aggregates (see parse_aggregates) over records, optionally per group of
+    a field's value, computed in one pass that reads each field once per
+    record and keeps no record.
+
+    Values are read the way query.compare reads them: sum, avg, min and max
+    take the values that convert to numbers, numeric strings included (min
+    and max fall back to the string values when there are none), and
+    count(field) counts the records having the field. Records are grouped
+    by the values '=' treats as equal, so a group holds exactly the records
+    query(group_by, '=', group) returns; records without the field form
+    the group None.
+
+    run() returns a partial result, {group: state}, made of plain lists so
+    that the parts computed by shards or worker processes can be merged.
+    """
+    def __init__(self, aggregates, group_by=None):
+        if group_by is not None and (not isinstance(group_by, str) or not group_by):
+            raise ValueError(f"Invalid group_by {group_by!r}: expected a field name.")
+        self.aggregates = parse_aggregates(aggregates)
+        self.group_by = group_by
+        self._group_getter = field_getter(group_by) if group_by else None
+        self.fields = sorted({field for _, _, field in self.aggregates if field is not None})
+        # Top-level fields are read with dict.get, nested ones through their getter.
+        self._readers = [(position, field, field_getter(field) if '.' in field else None)
+                         for position, field in enumerate(self.fields, 1)]
+
+    def run(self, records):
+        """Aggregate an iterable of records; returns a partial result."""
+        groups = {}
+        get_group = self._group_getter
+        readers = self._readers
+        fields = len(readers)
+        # Group values repeat; their labels are looked up rather than recomputed.
+        labels = {}
+        state = None
+        if get_group is None:
+            state = groups[None] = _new_state(fields)
+        for record in records:
+            if get_group is not None:
+                value = get_group(record)
+                try:
+                    label = labels[value]
+                except KeyError:
+                    label = labels[value] = _group_label(value)
+                except TypeError:
+                    label = _group_label(value)
+                state = groups.get(label)
+                if state is None:
+                    state = groups[label] = _new_state(fields)
+            state[0] += 1
+            if not isinstance(record, dict):
+                continue
+            for position, field, get in readers:
+                value = record.get(field) if get is None else get(record)
+                if value is None:
+                    continue
+                stats = state[position]
+                stats[0] += 1
+                # Values as query.compare sees them; ints and floats need no conversion.
+                kind = type(value)
+                if kind is int or kind is float:
+                    number = value
+                else:
+                    number = _as_number(value)
+                if number is not None and number == number:
+                    stats[1] += 1
+                    stats[2] += number
+                    if stats[3] is None or number < stats[3]:
+                        stats[3] = number
+                    if stats[4] is None or number > stats[4]:
+                        stats[4] = number
+                elif kind is str:
+                    if stats[5] is None or value < stats[5]:
+                        stats[5] = value
+                    if stats[6] is None or value > stats[6]:
+                        stats[6] = value
+        if get_group is None and not state[0]:
+            del groups[None]
+        return groups
+
+    def from_indexes(self, indexes, records):
+        """
+        Compute the partial result of an aggregation over all `records`
+        records from their secondary indexes, without reading a record, or
+        return None if the indexes cannot answer it: every field read must
+        be indexed, and per group only counts are available.
+        """
+        if self.group_by is not None:
+            index = indexes.get(self.group_by)
+            if index is None or '.' in self.group_by:
+                return None
+            if any(field not in (None, self.group_by) or function != 'count'
+                   for _, function, field in self.aggregates):
+                return None
+            groups = {}
+            for value, count in index.value_counts().items():
+                label = _group_label(value)
+                # NaN index values do not keep how the records spelled them ('nan',
+                # 'NaN', a float), which are different groups; nor may two values
+                # share a group. Either way the records must be read.
+                if value != value or label in groups:
+                    return None
+                state = groups[label] = _new_state(len(self.fields))
+                state[0] = count
+                for stats in state[1:]:
+                    stats[0] = count
+            missing = records - len(index.entries)
+            if missing:
+                groups[None] = _new_state(len(self.fields))
+                groups[None][0] = missing
+            return groups
+        state = _new_state(len(self.fields))
+        state[0] = records
+        for field, stats in zip(self.fields, state[1:]):
+            index = indexes.get(field)
+            if index is None or '.' in field:
+                return None
+            stats[0] = len(index.entries)
+            count, total, low, high = index.numeric_stats()
+            if count:
+                stats[1:5] = count, total, low, high
+            elif any(function in ('min', 'max') and name_field == field
+                     for _, function, name_field in self.aggregates):
+                # Indexes keep the string form of every value, not whether it was a string.
+                return None
+        return {None: state} if records else {}
+
+    def merge(self, partials):
+        """Merge partial results into one."""
+        merged = {}
+        for partial in partials:
+            for label, state in partial.items():
+                current = merged.get(label)
+                if current is None:
+                    merged[label] = [state[0]] + [list(stats) for stats in state[1:]]
+                    continue
+                current[0] += state[0]
+                for stats, other in zip(current[1:], state[1:]):
+                    _merge_stats(stats, other)
+        return merged
+
+    def result(self, groups):
+        """
+        Turn a partial result into the aggregates: {name: value}, or with
+        group_by a list of rows {'group': value, name: value, ...} ordered
+        like query sort order (numbers, strings, then None).
+        """
+        if self.group_by is None:
+            return self._values(groups.get(None) or _new_state(len(self.fields)))
+        rows = []
+        for label in sorted(groups, key=_sort_value):
+            row = {'group': label}
+            row.update(self._values(groups[label]))
+            rows.append(row)
+        return rows
+
+    def _values(self, state):
+        values = {}
+        for name, function, field in self.aggregates:
+            if field is None:
+                values[name] = state[0]
+                continue
+            present, count, total, low, high, text_low, text_high = state[1 + self.fields.index(field)]
+            if function == 'count':
+                values[name] = present
+            elif function == 'sum':
+                values[name] = _plain_number(total) if count else None
+            elif function == 'avg':
+                values[name] = total / count if count else None
+            elif function == 'min':
+                values[name] = _plain_number(low) if count else text_low
+            else:
+                values[name] = _plain_number(high) if count else text_high
+        return values
+
+def _new_state(fields):
+    """State of a group: its record count, then per field [present, numeric count, sum, min, max, min string, max string]."""
+    return [0] + [[0, 0, 0.0, None, None, None, None] for _ in range(fields)]
+
+def _merge_stats(stats, other):
+    stats[0] += other[0]
+    stats[1] += other[1]
+    stats[2] += other[2]
+    for position, pick in ((3, min), (4, max), (5, min), (6, max)):
+        if other[position] is not None:
+            stats[position] = other[position] if stats[position] is None else pick(stats[position], other[position])
+
+def _group_label(value):
+    """The group of a field value: its number if it converts to one, else its string form; None if missing."""
+    if value is None:
+        return None
+    number = _as_number(value)
+    if number is not None and number == number:
+        return _plain_number(number)
+    return value if type(value) is str else str(value)
+
+def _plain_number(number):
+    """Show integral floats as ints, as JSON numbers usually are."""
+    if isinstance(number, int):
+        return number
+    if number.is_integer() and abs(number) < 2 ** 53:
+        return int(number)
+    return number
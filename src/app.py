@@ -1,14 +1,37 @@
 # src/app.py
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, session, jsonify, \
+    stream_with_context
 from main import DatabaseManager
+from transactions import TransactionManager
+from metrics import metrics
+from query import OPERATORS, condition, parse_condition
+from sharding import ShardedNoSQLDB
 import json
 import os
 from urllib.parse import urlparse, urljoin
 
 app = Flask(__name__)
 app.secret_key = 'your_secure_secret_key'  # Replace with a secure secret key
-db_manager = DatabaseManager()
+# Number of keys or query results shown per page in the web UI and returned by default by the API.
+PAGE_SIZE = 100
+db_manager = DatabaseManager(storage_mode=os.environ.get('NOSQL_STORAGE_MODE', 'snapshot'),
+                             storage_format=os.environ.get('NOSQL_STORAGE_FORMAT', 'json'),
+                             lazy=os.environ.get('NOSQL_LAZY_LOAD') == '1',
+                             durability=os.environ.get('NOSQL_DURABILITY', 'sync'),
+                             flush_interval=float(os.environ.get('NOSQL_FLUSH_INTERVAL', 1.0)),
+                             shard_processes=int(os.environ.get('NOSQL_SHARD_PROCESSES', 0)) or None,
+                             cache_bytes=int(os.environ.get('NOSQL_CACHE_BYTES', 64 * 1024 * 1024)),
+                             # Workers of e.g. gunicorn share databases safely (but not transactions,
+                             # see below); NOSQL_MULTIPROCESS=0 opts out.
+                             multiprocess=False if os.environ.get('NOSQL_MULTIPROCESS') == '0' else None)
+# Operation metrics are served on /metrics; set NOSQL_METRICS=0 to turn instrumentation off.
+metrics.enabled = os.environ.get('NOSQL_METRICS', '1') != '0'
+# Pending writes live on the server; the session only carries the transaction id.
+# They are kept in this process's memory, so web UI transactions
+# require the app to run as a single worker process (threads are fine, e.g.
+# gunicorn -w 1 --threads 8): another worker would not know the transaction.
+transaction_manager = TransactionManager(timeout=int(os.environ.get('NOSQL_TRANSACTION_TIMEOUT', 900)))
 
 def is_safe_url(target):
     """Check if the URL is safe for redirection to prevent open redirects."""
@@ -19,6 +42,51 @@ def is_safe_url(target):
         ref_url.netloc == test_url.netloc
     )
 
+def parse_query_value(value):
+    """Interpret a query value as JSON (number, string, etc.) when possible."""
+    try:
+        return json.loads(value)
+    except (json.JSONDecodeError, TypeError):
+        return value
+
+def build_predicate(field=None, operator=None, value=None, conditions=(), match='all'):
+    """
+    Combine a single field/operator/value condition and a list of condition
+    strings ('age >= 30') into one predicate. Raises ValueError when invalid.
+    """
+    specs = []
+    if field or operator:
+        if not field or operator not in OPERATORS or (value is None and operator != 'exists'):
+            raise ValueError(f"'field', 'operator' ({', '.join(OPERATORS)}) and 'value' are required.")
+        specs.append(condition(field, operator, True if value is None else value))
+    specs.extend(parse_condition(text) for text in conditions if text.strip())
+    if not specs:
+        return None
+    if len(specs) == 1:
+        return specs[0]
+    return {'or' if match == 'any' else 'and': specs}
+
+def split_fields(text):
+    """Split a comma-separated list of field names."""
+    return [field.strip() for field in text.split(',') if field.strip()] if text else None
+
+def parse_ttl(text):
+    """Parse an optional time to live in seconds from a form field or query argument."""
+    if not text:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        raise ValueError(f"Time to live must be a number of seconds, not '{text}'.")
+
+def scan_page(db, start=None, end=None, prefix=None, reverse=False, after=None, limit=None):
+    """Scan a key range, or the keys with a prefix, of a database (see SimpleNoSQLDB.scan)."""
+    if prefix is not None:
+        if start is not None or end is not None:
+            raise ValueError("A key prefix cannot be combined with a start or end key.")
+        return db.scan_prefix(prefix, reverse, after, limit)
+    return db.scan(start, end, reverse, after, limit)
+
 @app.context_processor
 def inject_current_url():
     """Make the current URL available in all templates."""
@@ -32,10 +100,11 @@ def index():
         db_name = request.form.get('db_name')
         if db_name:
             try:
-                db_manager.create_database(db_name)
+                shards = request.form.get('shards')
+                db_manager.create_database(db_name, shards=int(shards) if shards else None)
                 flash(f"Database '{db_name}' created successfully.", 'success')
                 return redirect(url_for('index'))
-            except FileExistsError as e:
+            except (FileExistsError, ValueError) as e:
                 flash(str(e), 'danger')
         else:
             flash('Database name is required.', 'warning')
@@ -55,9 +124,14 @@ def delete_database_from_home(db_name):
 # Database Interaction Page
 @app.route('/database/<db_name>', methods=['GET', 'POST'])
 def database(db_name):
-    # Retrieve transaction state from session
-    in_transaction = session.get('in_transaction', False)
-    transaction_store = session.get('transaction_store', None)
+    # Retrieve the server-side transaction referenced by the session
+    txn_id = session.get('txn_id')
+    transaction = transaction_manager.get(txn_id)
+    if txn_id and transaction is None:
+        session.pop('txn_id', None)
+        flash('Your transaction expired and was rolled back.', 'warning')
+    in_transaction = transaction is not None and transaction.db_name == db_name
+    transaction_store = transaction.overlay if in_transaction else None
 
     try:
         db = db_manager.get_db(db_name, in_transaction, transaction_store)
@@ -78,24 +152,21 @@ def database(db_name):
         if action == 'begin_transaction':
             if in_transaction:
                 flash('A transaction is already in progress.', 'warning')
+            elif transaction is not None:
+                flash(f"A transaction is already in progress on database '{transaction.db_name}'.", 'warning')
+            elif isinstance(db, ShardedNoSQLDB):
+                flash('Transactions are not supported on sharded databases.', 'warning')
             else:
-                try:
-                    db.begin_transaction()
-                    # Update session with transaction state
-                    session['in_transaction'] = db.in_transaction
-                    session['transaction_store'] = db.transaction_store
-                    flash(f"Transaction started on database '{db_name}'.", 'info')
-                except Exception as e:
-                    flash(str(e), 'danger')
+                session['txn_id'] = transaction_manager.begin(db_name)
+                flash(f"Transaction started on database '{db_name}'.", 'info')
         elif action == 'commit':
             if not in_transaction:
                 flash('No active transaction to commit.', 'warning')
             else:
                 try:
                     db.commit()
-                    # Update session with transaction state
-                    session['in_transaction'] = db.in_transaction
-                    session['transaction_store'] = None
+                    transaction_manager.end(txn_id)
+                    session.pop('txn_id', None)
                     flash(f"Transaction committed on database '{db_name}'.", 'success')
                 except Exception as e:
                     flash(str(e), 'danger')
@@ -105,9 +176,8 @@ def database(db_name):
             else:
                 try:
                     db.rollback()
-                    # Update session with transaction state
-                    session['in_transaction'] = db.in_transaction
-                    session['transaction_store'] = None
+                    transaction_manager.end(txn_id)
+                    session.pop('txn_id', None)
                     flash(f"Transaction rolled back on database '{db_name}'.", 'info')
                 except Exception as e:
                     flash(str(e), 'danger')
@@ -128,13 +198,12 @@ def database(db_name):
             if key and value:
                 try:
                     value = json.loads(value)
-                    db.create(key, value)
-                    session['transaction_store'] = db.transaction_store  # Update transaction_store in session
+                    db.create(key, value, parse_ttl(request.form.get('ttl')))
                     flash(f"Key '{key}' created successfully in database '{db_name}' (pending commit).", 'success')
                     return redirect(url_for('database', db_name=db_name, action='create'))
                 except json.JSONDecodeError:
                     flash('Invalid JSON value.', 'danger')
-                except KeyError as e:
+                except (KeyError, ValueError) as e:
                     flash(str(e), 'danger')
             else:
                 flash('Both key and value are required.', 'warning')
@@ -163,7 +232,6 @@ def database(db_name):
                         if error_messages:
                             for msg in error_messages:
                                 flash(msg, 'danger')
-                        session['transaction_store'] = db.transaction_store  # Update transaction_store in session
                         return redirect(url_for('database', db_name=db_name, action='create_multiple'))
                     else:
                         flash('The input must be a JSON object with key-value pairs.', 'warning')
@@ -195,13 +263,12 @@ def database(db_name):
             if key and new_value:
                 try:
                     new_value = json.loads(new_value)
-                    db.update(key, new_value)
-                    session['transaction_store'] = db.transaction_store  # Update transaction_store in session
+                    db.update(key, new_value, parse_ttl(request.form.get('ttl')))
                     flash(f"Key '{key}' updated successfully in database '{db_name}' (pending commit).", 'warning')
                     return redirect(url_for('database', db_name=db_name, action='update'))
                 except json.JSONDecodeError:
                     flash('Invalid JSON value.', 'danger')
-                except KeyError as e:
+                except (KeyError, ValueError) as e:
                     flash(str(e), 'danger')
             else:
                 flash('Both key and new value are required.', 'warning')
@@ -216,7 +283,6 @@ def database(db_name):
             if key:
                 try:
                     db.delete(key)
-                    session['transaction_store'] = db.transaction_store  # Update transaction_store in session
                     flash(f"Key '{key}' deleted successfully from database '{db_name}' (pending commit).", 'danger')
                     return redirect(url_for('database', db_name=db_name, action='delete'))
                 except KeyError as e:
@@ -226,33 +292,359 @@ def database(db_name):
         return render_template('delete.html', db_name=db_name, in_transaction=in_transaction)
 
     elif action == 'list_keys':
-        keys = db.list_keys()
-        return render_template('list_keys.html', db_name=db_name, keys=keys, in_transaction=in_transaction)
+        prefix = request.args.get('prefix') or None
+        after = request.args.get('after') or None
+        keys, next_cursor = db.keys_page(prefix=prefix, after=after, limit=PAGE_SIZE)
+        return render_template('list_keys.html', db_name=db_name, keys=keys, prefix=prefix, after=after,
+                               next_cursor=next_cursor, in_transaction=in_transaction)
+
+    elif action == 'scan':
+        form = {name: request.args.get(name) or '' for name in ('start', 'end', 'prefix')}
+        reverse = request.args.get('reverse') == '1'
+        after = request.args.get('after') or None
+        results = None
+        next_cursor = None
+        # The form and page links set 'run'; without it only the form is shown.
+        if request.args.get('run'):
+            try:
+                page = list(scan_page(db, form['start'] or None, form['end'] or None, form['prefix'] or None,
+                                      reverse, after, PAGE_SIZE + 1))
+                if len(page) > PAGE_SIZE:
+                    page = page[:PAGE_SIZE]
+                    next_cursor = page[-1][0]
+                results = page
+            except ValueError as e:
+                flash(str(e), 'warning')
+        return render_template('scan.html', db_name=db_name, results=results, form=form, reverse=reverse,
+                               after=after, next_cursor=next_cursor, in_transaction=in_transaction)
 
     elif action == 'query':
+        results = None
+        next_cursor = None
+        # The first page is requested by the form (POST); following pages by the "Next" link (GET).
+        form = {name: request.values.get(name) or '' for name in
+                ('field', 'operator', 'value', 'where', 'match', 'select', 'order_by', 'limit')}
+        after = request.args.get('after') or None
+        if request.method == 'POST' or form['field'] or form['where']:
+            try:
+                value = parse_query_value(form['value']) if form['value'] else None
+                where = build_predicate(form['field'], form['operator'], value,
+                                        form['where'].splitlines(), form['match'])
+                if where is None:
+                    raise ValueError('Enter at least one condition.')
+                select = split_fields(form['select'])
+                order_by = split_fields(form['order_by'])
+                limit = int(form['limit']) if form['limit'] else None
+                if order_by:
+                    results = db.find(where, select, order_by, limit or PAGE_SIZE)
+                else:
+                    size = min(limit or PAGE_SIZE, PAGE_SIZE)
+                    page = list(db.iter_find(where, select, after=after, limit=size + 1))
+                    if len(page) > size:
+                        page = page[:size]
+                        next_cursor = page[-1][0]
+                    results = dict(page)
+                if not results:
+                    flash('No records match the query.', 'info')
+            except ValueError as e:
+                flash(str(e), 'warning')
+            except KeyError as e:
+                flash(str(e), 'danger')
+        return render_template('query.html', db_name=db_name, results=results, form=form, operators=OPERATORS,
+                               next_cursor=next_cursor, in_transaction=in_transaction)
+
+    elif action == 'aggregate':
+        form = {name: request.values.get(name) or '' for name in ('aggregates', 'group_by', 'where', 'match')}
+        form['aggregates'] = form['aggregates'] or 'count'
         results = None
         if request.method == 'POST':
-            field = request.form.get('field')
-            operator = request.form.get('operator')
-            value = request.form.get('value')
-            if field and operator and value:
-                try:
-                    try:
-                        value_parsed = json.loads(value)
-                    except json.JSONDecodeError:
-                        value_parsed = value
-                    results = db.query(field, operator, value_parsed)
-                    if not results:
-                        flash('No records match the query.', 'info')
-                except KeyError as e:
-                    flash(str(e), 'danger')
-            else:
-                flash('All fields are required.', 'warning')
-        return render_template('query.html', db_name=db_name, results=results, in_transaction=in_transaction)
+            try:
+                where = build_predicate(conditions=form['where'].splitlines(), match=form['match'])
+                results = db.aggregate(form['aggregates'], form['group_by'] or None, where)
+                if form['group_by'] and not results:
+                    flash('No records match.', 'info')
+            except ValueError as e:
+                flash(str(e), 'warning')
+        return render_template('aggregate.html', db_name=db_name, results=results, form=form, operators=OPERATORS,
+                               in_transaction=in_transaction)
 
     else:
         # Default Home View within Database
         return render_template('database.html', db_name=db_name, in_transaction=in_transaction)
 
+# JSON API: machine-facing access to the same databases, without templates or redirects.
+# Names starting with '_' after the database name are reserved for API endpoints.
+
+def api_error(message, status, **details):
+    """Build a JSON error response, with any details as extra fields."""
+    return jsonify({'error': message, **details}), status
+
+def api_body():
+    """Parse the request body as JSON, raising ValueError if it is missing or invalid."""
+    data = request.get_data(as_text=True)
+    if not data:
+        raise ValueError('Request body must be JSON.')
+    try:
+        return json.loads(data)
+    except json.JSONDecodeError as e:
+        raise ValueError(f'Invalid JSON body: {e}')
+
+def reserved_key(key):
+    """Check whether a key starts with '_', which the API reserves for its own routes (_bulk, _query, ...)."""
+    return isinstance(key, str) and key.startswith('_')
+
+@app.route('/api/<db_name>/<key>', methods=['GET', 'PUT', 'DELETE'])
+def api_record(db_name, key):
+    try:
+        db = db_manager.get_db(db_name)
+    except FileNotFoundError as e:
+        return api_error(str(e), 404)
+    if reserved_key(key):
+        return api_error(f"Keys starting with '_' are reserved by the API: '{key}'.", 400)
+
+    if request.method == 'GET':
+        value = db.read(key)
+        try:
+            ttl = db.ttl(key)
+        except KeyError:
+            # read() returns None for missing keys and for stored nulls alike.
+            return api_error(f"Key '{key}' not found in database '{db_name}'.", 404)
+        result = {'key': key, 'value': value}
+        if ttl is not None:
+            result['ttl'] = ttl
+        return jsonify(result)
+
+    if request.method == 'PUT':
+        # An optional ?ttl= (seconds) makes the key expire.
+        try:
+            value = api_body()
+            created = db.put(key, value, parse_ttl(request.args.get('ttl')))
+        except ValueError as e:
+            return api_error(str(e), 400)
+        return jsonify({'key': key, 'value': value}), 201 if created else 200
+
+    try:
+        db.delete(key)
+    except KeyError:
+        return api_error(f"Key '{key}' not found in database '{db_name}'.", 404)
+    return jsonify({'key': key, 'deleted': True})
+
+@app.route('/api/<db_name>/_bulk', methods=['POST'])
+def api_bulk(db_name):
+    """Apply many operations atomically with a single durable write."""
+    try:
+        db = db_manager.get_db(db_name)
+    except FileNotFoundError as e:
+        return api_error(str(e), 404)
+    try:
+        body = api_body()
+    except ValueError as e:
+        return api_error(str(e), 400)
+    operations = body.get('ops') if isinstance(body, dict) else body
+    if not isinstance(operations, list):
+        return api_error("Body must be a list of operations or an object with an 'ops' list.", 400)
+    for index, operation in enumerate(operations):
+        if isinstance(operation, dict) and reserved_key(operation.get('key')):
+            return api_error(f"Keys starting with '_' are reserved by the API: '{operation['key']}'.", 400,
+                             index=index)
+
+    # Errors name the position of the operation that failed in 'index'.
+    try:
+        applied = db.write_batch(operations)
+    except KeyError as e:
+        return api_error(e.args[0], 409, index=getattr(e, 'index', None))
+    except ValueError as e:
+        return api_error(str(e), 400, index=getattr(e, 'index', None))
+    return jsonify({'applied': applied})
+
+@app.route('/api/<db_name>/_mget', methods=['POST'])
+def api_multi_get(db_name):
+    """Read many keys at once; missing keys map to null."""
+    try:
+        db = db_manager.get_db(db_name)
+    except FileNotFoundError as e:
+        return api_error(str(e), 404)
+    try:
+        body = api_body()
+    except ValueError as e:
+        return api_error(str(e), 400)
+    keys = body.get('keys') if isinstance(body, dict) else body
+    if not isinstance(keys, list) or not all(isinstance(key, str) for key in keys):
+        return api_error("Body must be a list of string keys or an object with a 'keys' list of them.", 400)
+    return jsonify({'values': {key: db.read(key) for key in keys}})
+
+@app.route('/api/<db_name>/_query', methods=['GET', 'POST'])
+def api_query(db_name):
+    """
+    Run a query given as query-string parameters (GET) or a JSON object (POST).
+
+    POST bodies take a predicate in 'where' ({"field", "op", "value"} conditions
+    combined with "and", "or" and "not"); GET requests take 'where' conditions
+    such as 'age >= 30' (repeatable, combined with AND or with OR when
+    match=any). Both accept the single 'field', 'operator' and 'value' form,
+    'select' fields, 'order_by' fields ('-field' descending) and 'limit'.
+    Unordered queries are paginated by key with 'after'; ordered results are
+    returned as a list of {key, value} objects.
+    """
+    try:
+        db = db_manager.get_db(db_name)
+    except FileNotFoundError as e:
+        return api_error(str(e), 404)
+    try:
+        if request.method == 'POST':
+            params = api_body()
+            if not isinstance(params, dict):
+                return api_error('Body must be a JSON object.', 400)
+            where = build_predicate(params.get('field'), params.get('operator'), params.get('value'))
+            if params.get('where') is not None:
+                where = params['where'] if where is None else {'and': [where, params['where']]}
+            select = params.get('select')
+            order_by = params.get('order_by')
+        else:
+            params = request.args
+            value = params.get('value')
+            where = build_predicate(params.get('field'), params.get('operator'),
+                                    parse_query_value(value) if value is not None else None,
+                                    params.getlist('where'), params.get('match', 'all'))
+            select = split_fields(params.get('select'))
+            order_by = params.getlist('order_by') or None
+        after = params.get('after')
+        limit = params.get('limit')
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except (TypeError, ValueError):
+                raise ValueError("'limit' must be an integer.")
+            if limit < 1:
+                raise ValueError("'limit' must be at least 1.")
+        if params.get('explain') in (True, 'true', '1'):
+            return jsonify(db.explain(where))
+        if order_by:
+            if after is not None:
+                raise ValueError("'after' cannot be combined with 'order_by'.")
+            results = db.find(where, select, order_by, limit)
+            return jsonify({'results': [{'key': key, 'value': record} for key, record in results.items()]})
+        if limit is None and after is None:
+            return jsonify({'results': db.find(where, select)})
+        limit = limit if limit is not None else PAGE_SIZE
+        page = list(db.iter_find(where, select, after=after, limit=limit + 1))
+    except ValueError as e:
+        return api_error(str(e), 400)
+    next_cursor = page[limit - 1][0] if len(page) > limit else None
+    return jsonify({'results': dict(page[:limit]), 'next': next_cursor})
+
+@app.route('/api/<db_name>/_aggregate', methods=['GET', 'POST'])
+def api_aggregate(db_name):
+    """
+    Compute aggregates over the records matching a query (see
+    SimpleNoSQLDB.aggregate). GET requests take comma-separated 'aggregates',
+    'group_by' and 'where' conditions as in _query; POST bodies take a JSON
+    object with 'aggregates' (a list or string), 'group_by' and a 'where' predicate.
+    """
+    try:
+        db = db_manager.get_db(db_name)
+    except FileNotFoundError as e:
+        return api_error(str(e), 404)
+    try:
+        if request.method == 'POST':
+            params = api_body()
+            if not isinstance(params, dict):
+                return api_error('Body must be a JSON object.', 400)
+            where = params.get('where')
+        else:
+            params = request.args
+            where = build_predicate(conditions=params.getlist('where'), match=params.get('match', 'all'))
+        results = db.aggregate(params.get('aggregates', 'count'), params.get('group_by'), where)
+    except ValueError as e:
+        return api_error(str(e), 400)
+    return jsonify({'results': results})
+
+@app.route('/api/<db_name>/_keys', methods=['GET'])
+def api_keys(db_name):
+    """List one page of keys in key order; pass 'next' back as 'after' for the following page."""
+    try:
+        db = db_manager.get_db(db_name)
+    except FileNotFoundError as e:
+        return api_error(str(e), 404)
+    try:
+        limit = int(request.args.get('limit', PAGE_SIZE))
+        keys, next_cursor = db.keys_page(prefix=request.args.get('prefix'), after=request.args.get('after'),
+                                         limit=limit)
+    except ValueError as e:
+        return api_error(str(e), 400)
+    return jsonify({'keys': keys, 'next': next_cursor})
+
+@app.route('/api/<db_name>/_scan', methods=['GET'])
+def api_scan(db_name):
+    """Return one page of records in a key range or with a key prefix; pass 'next' back as 'after'."""
+    try:
+        db = db_manager.get_db(db_name)
+    except FileNotFoundError as e:
+        return api_error(str(e), 404)
+    args = request.args
+    try:
+        limit = int(args.get('limit', PAGE_SIZE))
+        if limit < 1:
+            raise ValueError("Page limit must be at least 1.")
+        page = list(scan_page(db, args.get('start'), args.get('end'), args.get('prefix'),
+                              args.get('reverse') in ('1', 'true'), args.get('after'), limit + 1))
+    except ValueError as e:
+        return api_error(str(e), 400)
+    next_cursor = page[limit - 1][0] if len(page) > limit else None
+    return jsonify({'results': [[key, value] for key, value in page[:limit]], 'next': next_cursor})
+
+@app.route('/api/<db_name>/_changes', methods=['GET'])
+def api_changes(db_name):
+    """
+    Stream committed changes as server-sent events, one 'change' event per
+    write, batch or transaction, with the sequence number as the event id.
+    'since' (or the Last-Event-ID header sent by reconnecting clients)
+    resumes after a sequence number; without it only new changes are sent.
+    'timeout' ends the stream after that many idle seconds. Responds 410
+    when the changes after 'since' are no longer retained.
+    """
+    try:
+        db = db_manager.get_db(db_name)
+    except FileNotFoundError as e:
+        return api_error(str(e), 404)
+    if isinstance(db, ShardedNoSQLDB):
+        return api_error("Change feeds are not supported on sharded databases.", 400)
+    try:
+        since = request.args.get('since', request.headers.get('Last-Event-ID'))
+        since = int(since) if since is not None else None
+        timeout = request.args.get('timeout')
+        timeout = float(timeout) if timeout is not None else None
+    except ValueError:
+        return api_error("'since' must be an integer and 'timeout' a number.", 400)
+    try:
+        events = db.watch(since=since, timeout=timeout)
+    except ValueError as e:
+        return api_error(str(e), 410)
+
+    def stream():
+        try:
+            for event in events:
+                yield f"id: {event['seq']}\nevent: change\ndata: {json.dumps(event)}\n\n"
+        except ValueError as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Expose metrics in the Prometheus text format, or as JSON (optionally for one database) with ?format=json."""
+    for name, stats in db_manager.registry.stats().items():
+        metrics.set_gauge('nosql_records', stats['records'], db=name)
+        metrics.set_gauge('nosql_file_bytes', stats['file_bytes'] + stats['wal_bytes'], db=name)
+        if stats['cache'] is not None:
+            metrics.set_counter('nosql_cache_requests_total', stats['cache']['hits'], db=name, result='hit')
+            metrics.set_counter('nosql_cache_requests_total', stats['cache']['misses'], db=name, result='miss')
+            metrics.set_gauge('nosql_cache_bytes', stats['cache']['bytes'], db=name)
+    if request.args.get('format') == 'json':
+        labels = {'db': request.args['db']} if request.args.get('db') else {}
+        return jsonify({'enabled': metrics.enabled, 'metrics': metrics.snapshot(**labels)})
+    return app.response_class(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,199 @@
+# src/async_db.py
+
+import asyncio
+import functools
+from main import DatabaseManager
+
+class AsyncNoSQLDB:
+    """
+    asyncio facade over a SimpleNoSQLDB handle, for use from an event loop.
+
+    Writes are queued and applied in batches in the executor: while one batch
+    is applied and persisted, further writes accumulate and go out together
+    in the next one, so concurrent writers share one lock acquisition and
+    one flush. Reads, queries and key listings also run in the executor, as
+    a read takes the lock and may catch up with other processes' changes or
+    decode a lazily loaded record, so the loop never waits for a lock or
+    the disk.
+
+    A write that is cancelled after it was queued may still be applied.
+    Transactions are not supported; use SimpleNoSQLDB for them.
+    """
+    def __init__(self, db, executor=None, max_batch=1000):
+        """
+        Wrap a SimpleNoSQLDB handle. executor runs the blocking work (the
+        loop's default executor if None); max_batch caps the number of writes
+        applied per batch.
+        """
+        if db.in_transaction:
+            raise ValueError("AsyncNoSQLDB does not support transactions.")
+        self.db = db
+        self.executor = executor
+        self.max_batch = max_batch
+        self._queue = []
+        self._writer = None
+
+    async def _run(self, func, *args, **kwargs):
+        """Run a blocking call in the executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def _write(self, operation):
+        """Queue a write operation and wait for the batch that applies it."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.append((operation, future))
+        if self._writer is None:
+            self._writer = loop.create_task(self._drain())
+        return await future
+
+    async def _drain(self):
+        """Apply queued writes batch by batch until the queue is empty."""
+        try:
+            while self._queue:
+                batch = self._queue[:self.max_batch]
+                del self._queue[:self.max_batch]
+                try:
+                    results = await self._run(self.db.apply_operations, [operation for operation, _ in batch])
+                except Exception as e:
+                    # The batch failed as a whole (e.g. the disk is full).
+                    results = [e] * len(batch)
+                for (_, future), result in zip(batch, results):
+                    if future.done():
+                        continue
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+        finally:
+            self._writer = None
+
+    async def create(self, key, value, ttl=None):
+        """Create a new key-value pair in the database, optionally with a time to live in seconds."""
+        await self._write(_operation('create', key, value, ttl))
+
+    async def read(self, key):
+        """Read the value associated with a key."""
+        return await self._run(self.db.read, key)
+
+    async def update(self, key, value, ttl=None):
+        """Update the value of an existing key, replacing its time to live."""
+        await self._write(_operation('update', key, value, ttl))
+
+    async def put(self, key, value, ttl=None):
+        """Create or update a key; returns True if the key was created."""
+        return await self._write(_operation('put', key, value, ttl))
+
+    async def delete(self, key):
+        """Delete a key-value pair from the database."""
+        await self._write({'op': 'delete', 'key': key})
+
+    async def write_batch(self, operations):
+        """Apply many operations atomically (see SimpleNoSQLDB.write_batch)."""
+        return await self._run(self.db.write_batch, operations)
+
+    async def query(self, field, operator, value):
+        """Return the records where a field satisfies a condition (see SimpleNoSQLDB.query)."""
+        return await self._run(self.db.query, field, operator, value)
+
+    async def find(self, where=None, select=None, order_by=None, limit=None):
+        """Return the records matching a predicate (see SimpleNoSQLDB.find)."""
+        return await self._run(self.db.find, where, select, order_by, limit)
+
+    async def aggregate(self, aggregates, group_by=None, where=None):
+        """Compute aggregates over the matching records (see SimpleNoSQLDB.aggregate)."""
+        return await self._run(self.db.aggregate, aggregates, group_by, where)
+
+    async def list_keys(self):
+        """List all keys in the database."""
+        return await self._run(self.db.list_keys)
+
+    async def keys_page(self, prefix=None, after=None, limit=100):
+        """Return one page of keys in key order as (keys, next_cursor)."""
+        return await self._run(self.db.keys_page, prefix, after, limit)
+
+    async def iter_keys(self, prefix=None, after=None, page_size=1000):
+        """Asynchronously iterate over keys in key order, fetching them a page at a time."""
+        while True:
+            keys, after = await self._run(self.db.keys_page, prefix, after, page_size)
+            for key in keys:
+                yield key
+            if after is None:
+                return
+
+    async def iter_items(self, prefix=None, after=None, page_size=1000):
+        """Asynchronously iterate over (key, value) pairs in key order, a page at a time."""
+        while True:
+            page = await self._run(lambda: list(self.db.iter_items(prefix, after, page_size, page_size)))
+            for item in page:
+                yield item
+            if len(page) < page_size:
+                return
+            after = page[-1][0]
+
+    async def scan(self, start=None, end=None, reverse=False, after=None, page_size=1000):
+        """Asynchronously iterate over the (key, value) pairs with start <= key < end (see SimpleNoSQLDB.scan), a page at a time."""
+        while True:
+            page = await self._run(lambda: list(self.db.scan(start, end, reverse, after, page_size, page_size)))
+            for item in page:
+                yield item
+            if len(page) < page_size:
+                return
+            after = page[-1][0]
+
+    async def watch(self, since=None, timeout=None, poll_interval=0.5):
+        """Asynchronously iterate over change feed events (see SimpleNoSQLDB.watch), waiting in the executor."""
+        events = await self._run(self.db.watch, since, timeout, poll_interval)
+        while True:
+            event = await self._run(next, events, None)
+            if event is None:
+                return
+            yield event
+
+    async def flush(self):
+        """Wait for queued writes, then persist every committed write."""
+        while self._writer is not None:
+            await self._writer
+        await self._run(self.db.flush)
+
+    async def close(self):
+        """Wait for queued writes and close the underlying handle."""
+        while self._writer is not None:
+            await self._writer
+        await self._run(self.db.close)
+
+class AsyncDatabaseManager:
+    """asyncio facade over DatabaseManager; databases are opened (loaded from disk) in the executor."""
+    def __init__(self, databases_dir='../data/databases', executor=None, max_batch=1000, **options):
+        """Create a DatabaseManager with the given options (see DatabaseManager)."""
+        self.manager = DatabaseManager(databases_dir, **options)
+        self.executor = executor
+        self.max_batch = max_batch
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def create_database(self, db_name):
+        """Create a new database with the given name."""
+        await self._run(self.manager.create_database, db_name)
+
+    async def delete_database(self, db_name):
+        """Delete the specified database."""
+        await self._run(self.manager.delete_database, db_name)
+
+    async def list_databases(self):
+        """List all existing databases."""
+        return await self._run(self.manager.list_databases)
+
+    async def get_db(self, db_name):
+        """Return an AsyncNoSQLDB for the specified database."""
+        db = await self._run(self.manager.get_db, db_name)
+        return AsyncNoSQLDB(db, self.executor, self.max_batch)
+
+def _operation(op, key, value, ttl):
+    """Build a batch operation, with a time to live only if one is given."""
+    operation = {'op': op, 'key': key, 'value': value}
+    if ttl is not None:
+        operation['ttl'] = ttl
+    return operation
@@ -0,0 +1,192 @@
+# src/backup.py
+
+import gzip
+import hashlib
+import json
+import os
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+
+BACKUP_FORMAT = 'nosql-backup'
+BACKUP_VERSION = 1
+# Encoded records are buffered and written in chunks of about this size.
+CHUNK_BYTES = 1024 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+# Stands for the value of a deleted key in backup entries.
+DELETED = object()
+
+# A backup is a stream of JSON lines, optionally gzip-compressed:
+#   {"format": "nosql-backup", "version": 1, "id": ..., "kind": "full" | "incremental", "base": ..., ...}
+#   ["key", value]           a record
+#   ["key", value, expires]  a record with a time to live, expiring at a Unix time
+#   ["key"]                  a key deleted since the base backup (incremental only)
+#   {"end": {"records": n, "deleted": m}}
+# The closing line tells a complete backup from a truncated one.
+
+def value_digest(value, expires=None):
+    """Digest of a value's canonical JSON encoding (and expiry time, if any), used to detect changed records."""
+    if expires is not None:
+        value = [value, expires]
+    encoded = json.dumps(value, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.blake2b(encoded, digest_size=16).digest()
+
+def new_header(database, kind, base=None, **fields):
+    """Create the header of a new backup."""
+    header = {
+        'format': BACKUP_FORMAT,
+        'version': BACKUP_VERSION,
+        'id': uuid.uuid4().hex,
+        'database': database,
+        'kind': kind,
+        'base': base,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+    header.update(fields)
+    return header
+
+def write_backup(path, header, entries, compress=False):
+    """
+    Stream a backup to path: the header, then every (key, value, expires)
+    entry (value DELETED for a deleted key, expires None for a key without a
+    time to live), buffered into chunks. The file is written
+    under a temporary name, fsynced and renamed, so a backup is either
+    complete or absent. Returns the header with the record counts added.
+    """
+    temp_file = f"{path}.tmp"
+    records = deleted = 0
+    with open(temp_file, 'wb') as raw:
+        f = gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) if compress else raw
+        chunk = [_line(header)]
+        size = 0
+        for key, value, expires in entries:
+            if value is DELETED:
+                line = _line([key])
+                deleted += 1
+            else:
+                line = _line([key, value] if expires is None else [key, value, expires])
+                records += 1
+            chunk.append(line)
+            size += len(line)
+            if size >= CHUNK_BYTES:
+                f.write(b''.join(chunk))
+                chunk = []
+                size = 0
+        chunk.append(_line({'end': {'records': records, 'deleted': deleted}}))
+        f.write(b''.join(chunk))
+        if compress:
+            f.close()
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(temp_file, path)
+    return dict(header, records=records, deleted=deleted)
+
+def read_header(path):
+    """Read the header of a backup file."""
+    with _open(path) as f, _reading(path):
+        return _parse_header(path, f.readline())
+
+def read_backup(path):
+    """
+    Iterate over a backup: yields the header first, then (key, value, expires)
+    entries (value DELETED for deletions). Raises ValueError if the file is not a
+    complete backup.
+    """
+    with _open(path) as f, _reading(path):
+        yield _parse_header(path, f.readline())
+        for line in f:
+            entry = json.loads(line)
+            if isinstance(entry, dict):
+                if 'end' in entry:
+                    return
+                break
+            if len(entry) == 1:
+                yield entry[0], DELETED, None
+            else:
+                yield entry[0], entry[1], entry[2] if len(entry) > 2 else None
+    raise ValueError(f"Backup '{path}' is truncated or corrupt.")
+
+def replay_chain(paths, apply):
+    """
+    Replay a backup chain, a full backup followed by incremental backups each
+    based on the previous one, calling apply(key, value, expires) for every
+    entry (value DELETED for deletions). Returns the header of the last backup.
+    """
+    if not paths:
+        raise ValueError("No backup given.")
+    previous = None
+    for path in paths:
+        entries = read_backup(path)
+        header = next(entries)
+        if previous is None and header['kind'] != 'full':
+            raise ValueError(f"Backup '{path}' is incremental; the chain must start with a full backup.")
+        if previous is not None and header['base'] != previous['id']:
+            raise ValueError(f"Backup '{path}' is not based on '{previous['path']}'.")
+        for key, value, expires in entries:
+            apply(key, value, expires)
+        previous = dict(header, path=path)
+    return previous
+
+def restore_chain(paths):
+    """Rebuild the records of a backup chain; returns (last header, store, {key: expiry time})."""
+    store = {}
+    expiries = {}
+    def apply(key, value, expires):
+        expiries.pop(key, None)
+        if value is DELETED:
+            store.pop(key, None)
+            return
+        store[key] = value
+        if expires is not None:
+            expiries[key] = expires
+    return replay_chain(paths, apply), store, expiries
+
+def chain_digests(paths):
+    """Digest every record of a backup chain; returns (last header, {key: digest})."""
+    digests = {}
+    def apply(key, value, expires):
+        if value is DELETED:
+            digests.pop(key, None)
+        else:
+            digests[key] = value_digest(value, expires)
+    return replay_chain(paths, apply), digests
+
+def changed_entries(items, digests):
+    """
+    Yield the entries of an incremental backup: the (key, value, expires)
+    entries whose value or expiry time differs from the base's digest, then
+    the base's keys that are gone. Consumes digests.
+    """
+    for key, value, expires in items:
+        if digests.pop(key, None) != value_digest(value, expires):
+            yield key, value, expires
+    for key in digests:
+        yield key, DELETED, None
+
+def _line(entry):
+    return (json.dumps(entry, separators=(',', ':')) + '\n').encode('utf-8')
+
+def _open(path):
+    with open(path, 'rb') as f:
+        compressed = f.read(2) == GZIP_MAGIC
+    return gzip.open(path, 'rb') if compressed else open(path, 'rb')
+
+@contextmanager
+def _reading(path):
+    """Report a backup that was cut short or damaged, compressed or not, as ValueError."""
+    try:
+        yield
+    except (EOFError, OSError, zlib.error, json.JSONDecodeError) as e:
+        raise ValueError(f"Backup '{path}' is truncated or corrupt ({e}).") from e
+
+def _parse_header(path, line):
+    try:
+        header = json.loads(line)
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get('format') != BACKUP_FORMAT:
+        raise ValueError(f"'{path}' is not a database backup.")
+    if header.get('version') != BACKUP_VERSION:
+        raise ValueError(f"Backup '{path}' has unsupported version {header.get('version')}.")
+    return header
@@ -0,0 +1,124 @@
+# src/cache.py
+
+import threading
+from collections import OrderedDict
+
+# Approximate bytes held per cache entry besides the value: the key, the
+# dictionary slot and the entry tuple.
+ENTRY_OVERHEAD = 100
+# Share of the budget reserved for entries that were read more than once.
+PROTECTED_SHARE = 0.8
+
+MISSING = object()
+
+class ValueCache:
+    """
+    Segmented LRU cache of decoded values bounded by a size in bytes.
+
+    Values enter a probationary segment and move to a protected segment when
+    read again, so keys read once (e.g. by a scan over cold data) are evicted
+    before the hot set. Entries evicted from the protected segment get a
+    second chance at the head of the probationary one. Sizes are supplied by
+    the caller (the encoded size of the value) plus ENTRY_OVERHEAD.
+
+    The cache is safe to use from several threads. Every invalidation bumps a
+    generation number, and put() ignores values decoded under an older
+    generation, so a reader racing a writer never caches a stale value.
+    """
+    def __init__(self, max_bytes):
+        if max_bytes < 0:
+            raise ValueError("Cache size must not be negative.")
+        self.max_bytes = max_bytes
+        self.protected_bytes_max = int(max_bytes * PROTECTED_SHARE)
+        self.lock = threading.Lock()
+        self.generation = 0
+        self._probation = OrderedDict()
+        self._protected = OrderedDict()
+        self._probation_bytes = 0
+        self._protected_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached value of a key, or MISSING."""
+        with self.lock:
+            entry = self._protected.get(key)
+            if entry is not None:
+                self._protected.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            entry = self._probation.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            self._probation_bytes -= entry[1]
+            self._protected[key] = entry
+            self._protected_bytes += entry[1]
+            while self._protected_bytes > self.protected_bytes_max and len(self._protected) > 1:
+                demoted_key, demoted = self._protected.popitem(last=False)
+                self._protected_bytes -= demoted[1]
+                self._probation[demoted_key] = demoted
+                self._probation_bytes += demoted[1]
+            self._evict()
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size, generation):
+        """
+        Cache a value decoded while the cache was at `generation` (read it
+        before decoding); ignored if anything was invalidated since.
+        """
+        size += ENTRY_OVERHEAD
+        with self.lock:
+            if generation != self.generation or size > self.max_bytes:
+                return
+            if key in self._protected or key in self._probation:
+                return
+            self._probation[key] = (value, size)
+            self._probation_bytes += size
+            self._evict()
+
+    def discard(self, key):
+        """Invalidate a key after it was written or deleted."""
+        with self.lock:
+            self.generation += 1
+            entry = self._probation.pop(key, None)
+            if entry is not None:
+                self._probation_bytes -= entry[1]
+            entry = self._protected.pop(key, None)
+            if entry is not None:
+                self._protected_bytes -= entry[1]
+
+    def clear(self):
+        """Invalidate every key."""
+        with self.lock:
+            self.generation += 1
+            self._probation.clear()
+            self._protected.clear()
+            self._probation_bytes = self._protected_bytes = 0
+
+    def _evict(self):
+        """Drop least recently used entries, probationary first, until within budget. Caller must hold the lock."""
+        while self._probation_bytes + self._protected_bytes > self.max_bytes:
+            segment = self._probation if self._probation else self._protected
+            _, entry = segment.popitem(last=False)
+            if segment is self._probation:
+                self._probation_bytes -= entry[1]
+            else:
+                self._protected_bytes -= entry[1]
+            self.evictions += 1
+
+    def stats(self):
+        """Return the size and hit/miss counters of the cache."""
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'max_bytes': self.max_bytes,
+                'bytes': self._probation_bytes + self._protected_bytes,
+                'entries': len(self._probation) + len(self._protected),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / requests, 4) if requests else None,
+            }
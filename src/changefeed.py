@@ -0,0 +1,218 @@
+# src/changefeed.py
+
+import json
+import os
+import time
+
+# The feed is kept in two segments: once the current one grows beyond half
+# of max_bytes it becomes the old one, replacing the previous old segment.
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# Bytes read at a time when looking for the last event from the end of a segment.
+_TAIL_CHUNK = 64 * 1024
+
+class ChangeFeed:
+    """
+    The change feed of a database: a log of committed changes kept in
+    '<db_file>.changes' (and the previous segment, '<db_file>.changes.old')
+    as one JSON event per line:
+
+        {"seq": 42, "time": 1700000000.0, "changes": [
+            {"op": "create" | "update", "key": ..., "value": ...},
+            {"op": "delete", "key": ...}]}
+
+    Every committed write, batch or transaction is one event; seq increases
+    by one from event to event. Only events written by the database engine
+    (see DatabaseEngine) are appended; any process may follow the files.
+    """
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.old_path = f"{path}.old"
+        self.max_bytes = max_bytes
+        self._file = None
+        self._inode = None
+
+    def exists(self):
+        """Whether the feed is enabled for the database."""
+        return os.path.exists(self.path)
+
+    def create(self):
+        """Enable the feed, starting empty."""
+        with open(self.path, 'a'):
+            pass
+
+    def remove(self):
+        """Disable the feed and discard its events."""
+        self.close()
+        for path in (self.path, self.old_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def append(self, events, sync=True):
+        """Append events, starting a new segment first if the current one is full."""
+        data = ''.join(json.dumps(event, separators=(',', ':')) + '\n' for event in events)
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            stat = None
+        # The file stays open between appends unless another process started a new segment.
+        if stat is None or stat.st_ino != self._inode:
+            self.close()
+        if stat is not None and stat.st_size >= self.max_bytes // 2:
+            self.close()
+            os.replace(self.path, self.old_path)
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+            self._inode = os.fstat(self._file.fileno()).st_ino
+        self._file.write(data)
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        """Close the file kept open for appending."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._inode = None
+
+    def last_sequence(self):
+        """Return the sequence number of the last event, or 0 if there is none."""
+        for path in (self.path, self.old_path):
+            event = _last_event(path)[0]
+            if event is not None:
+                return event['seq']
+        return 0
+
+    def first_sequence(self):
+        """Return the sequence number of the oldest retained event, or None if there is none."""
+        for path in (self.old_path, self.path):
+            events, _ = _read_events(path, 0, limit=1)
+            if events:
+                return events[0]['seq']
+        return None
+
+    def events(self, since=0):
+        """Return the retained events after sequence number `since`, oldest first (see follow)."""
+        events = []
+        for path in (self.old_path, self.path):
+            events.extend(_read_events(path, 0)[0])
+        return _after(events, since)
+
+    def follow(self, since=None, timeout=None, poll_interval=0.5, wait=None):
+        """
+        Return an iterator over the events after sequence number `since`
+        (None: from now on, fixed when follow is called), which then keeps
+        yielding new events as they are appended, like `tail -F`. Stops once no event arrived for `timeout` seconds (None
+        waits forever) or the feed is disabled. Between polls it calls
+        wait(last_seq, poll_interval) if given, which may return early when
+        a new event is appended, and sleeps otherwise.
+
+        Raises ValueError if events after `since` were already dropped from
+        the feed or `since` is ahead of it: the consumer missed changes and
+        must read the database in full before following again.
+        """
+        inode = None
+        offset = 0
+        if since is None:
+            # Start after the last event rather than reading the whole feed.
+            try:
+                with open(self.path, 'rb') as f:
+                    inode = os.fstat(f.fileno()).st_ino
+                    event, offset = _tail(f)
+            except FileNotFoundError:
+                return
+            if event is None:
+                event = _last_event(self.old_path)[0]
+            last = event['seq'] if event is not None else 0
+        else:
+            last = since
+            if last > self.last_sequence():
+                raise ValueError(f"Sequence number {last} is ahead of the change feed "
+                                 f"(last is {self.last_sequence()}); it was reset.")
+            first = self.first_sequence()
+            if first is not None and first > last + 1:
+                raise _missing(last, first)
+        return self._follow(inode, offset, last, timeout, poll_interval, wait)
+
+    def _follow(self, inode, offset, last, timeout, poll_interval, wait):
+        idle_since = time.monotonic()
+        while True:
+            try:
+                with open(self.path, 'rb') as f:
+                    current = os.fstat(f.fileno()).st_ino
+                    rotated = current != inode
+                    events, offset = _read_lines(f, 0 if rotated else offset)
+            except FileNotFoundError:
+                return
+            if rotated:
+                # First poll, or a new segment was started: the events not seen
+                # yet may be at the end of what is now the old segment.
+                events = _read_events(self.old_path, 0)[0] + events
+                inode = current
+            events = _after(events, last)
+            for event in events:
+                last = event['seq']
+                yield event
+            if events:
+                idle_since = time.monotonic()
+            elif timeout is not None and time.monotonic() - idle_since >= timeout:
+                return
+            else:
+                delay = poll_interval if timeout is None else min(poll_interval, timeout)
+                if wait is not None:
+                    wait(last, delay)
+                else:
+                    time.sleep(delay)
+
+def _after(events, since):
+    """Keep the events after `since`, checking that none is missing."""
+    events = [event for event in events if event['seq'] > since]
+    if events and events[0]['seq'] != since + 1:
+        raise _missing(since, events[0]['seq'])
+    return events
+
+def _missing(since, first):
+    return ValueError(f"Changes after sequence number {since} are no longer in the change feed "
+                      f"(it starts at {first}); read the database in full, then follow again.")
+
+def _read_lines(f, offset, limit=None):
+    """Read the complete events of an open segment from a byte offset; returns (events, new offset)."""
+    events = []
+    f.seek(offset)
+    for line in f:
+        if not line.endswith(b'\n') or len(events) == limit:
+            break
+        events.append(json.loads(line))
+        offset += len(line)
+    return events, offset
+
+def _read_events(path, offset, limit=None):
+    try:
+        with open(path, 'rb') as f:
+            return _read_lines(f, offset, limit)
+    except FileNotFoundError:
+        return [], offset
+
+def _last_event(path):
+    """Return (last complete event or None, offset after it) of a segment."""
+    try:
+        with open(path, 'rb') as f:
+            return _tail(f)
+    except FileNotFoundError:
+        return None, 0
+
+def _tail(f):
+    """Find the last complete event of an open segment, reading it from the end."""
+    end = f.seek(0, os.SEEK_END)
+    position = end
+    while position > 0:
+        position = max(0, position - _TAIL_CHUNK)
+        f.seek(position)
+        tail = f.read(end - position)
+        # A torn event being appended is ignored; the tail must also hold the
+        # newline ending the event before the last one.
+        complete = tail[:tail.rfind(b'\n') + 1]
+        start = complete.rfind(b'\n', 0, len(complete) - 1)
+        if start >= 0 or (position == 0 and complete):
+            return json.loads(complete[start + 1:]), position + len(complete)
+    return None, 0
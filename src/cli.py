@@ -2,16 +2,103 @@
 
 import argparse
 from main import SimpleNoSQLDB, DatabaseManager
+from metrics import metrics
+from query import OPERATORS, condition, parse_condition
+from sharding import ShardedNoSQLDB
 import json
+import os
 import sys
+from urllib.parse import urlencode
+from urllib.request import urlopen
+from urllib.error import URLError
+
+def print_metrics(samples):
+    """Print a per-operation summary of metric samples as returned by Metrics.snapshot()."""
+    operations = {}
+    totals = {}
+    for sample in samples:
+        labels = sample['labels']
+        if sample['name'] == 'nosql_operation_seconds':
+            phases = operations.setdefault(labels['op'], {})
+            phases[labels['phase']] = sample
+        elif sample['name'] == 'nosql_load_seconds':
+            print(f"Opened in {sample['sum'] * 1000:.3f} ms ({sample['count']} load(s))")
+        elif 'value' in sample:
+            key = (sample['name'], labels.get('plan') or labels.get('kind'))
+            totals[key] = totals.get(key, 0) + sample['value']
+    if operations:
+        print("Operations (count: mean lock wait / execute / I/O in ms):")
+        for op, phases in sorted(operations.items()):
+            count = phases['execute']['count'] if 'execute' in phases else 0
+            means = []
+            for phase in ('lock_wait', 'execute', 'io'):
+                sample = phases.get(phase)
+                means.append(f"{sample['sum'] * 1000 / sample['count']:.3f}" if sample else '-')
+            print(f"- {op}: {count}: {' / '.join(means)}")
+    queries = {plan: value for (name, plan), value in totals.items() if name == 'nosql_queries_total'}
+    if queries:
+        print(f"Queries: {sum(queries.values())} ({', '.join(f'{plan}: {n}' for plan, n in sorted(queries.items()))}), "
+              f"records scanned: {totals.get(('nosql_query_scanned_records_total', None), 0)}, "
+              f"returned: {totals.get(('nosql_query_returned_records_total', None), 0)}")
+    written = {kind: value for (name, kind), value in totals.items() if name == 'nosql_persist_bytes_total'}
+    if written:
+        print(f"Bytes written: {', '.join(f'{kind}: {n}' for kind, n in sorted(written.items()))}")
+
+def build_predicate(args):
+    """Combine the query command's positional condition, --where conditions and --filter into one predicate."""
+    conditions = []
+    if args.field is not None:
+        if args.operator is None:
+            raise ValueError("An operator is required after the field.")
+        if args.value is None:
+            if args.operator != 'exists':
+                raise ValueError("A value is required after the operator.")
+            value = True
+        else:
+            try:
+                # Attempt to parse value as JSON (number, string, etc.)
+                value = json.loads(args.value)
+            except json.JSONDecodeError:
+                value = args.value
+        conditions.append(condition(args.field, args.operator, value))
+    conditions.extend(parse_condition(text) for text in args.where)
+    where = None
+    if len(conditions) == 1:
+        where = conditions[0]
+    elif conditions:
+        where = {'or' if args.any else 'and': conditions}
+    if args.filter:
+        try:
+            extra = json.loads(args.filter)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"--filter is not valid JSON: {e}")
+        where = extra if where is None else {'and': [where, extra]}
+    return where
+
+def path_size(path):
+    """Return the size in bytes of a database file, or of every file of a sharded database's directory."""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path)
 
 def main():
     parser = argparse.ArgumentParser(description="Simple NoSQL Database CLI with Multiple Databases")
+    parser.add_argument('--storage-mode', choices=['snapshot', 'wal'], default='snapshot',
+                        help='Persist writes by rewriting the file (snapshot) or appending to a write-ahead log (wal)')
+    parser.add_argument('--storage-format', choices=['json', 'binary'], default='json',
+                        help='On-disk format of newly created databases')
+    parser.add_argument('--compress', action='store_true',
+                        help='Compress the records of newly created binary databases')
+    parser.add_argument('--durability', choices=['none', 'async', 'sync'], default='sync',
+                        help='Fsync every write before returning (sync), in the background (async) or never (none)')
+    parser.add_argument('--shard-processes', type=int,
+                        help='Fan queries on sharded databases out to this many worker processes')
     subparsers = parser.add_subparsers(dest='command', help='Available commands')
 
     # Database management commands
     db_parser = subparsers.add_parser('create_db', help='Create a new database')
     db_parser.add_argument('database', type=str, help='Name of the database to create')
+    db_parser.add_argument('--shards', type=int, help='Hash-partition the database into this many files')
 
     del_db_parser = subparsers.add_parser('delete_db', help='Delete an existing database')
     del_db_parser.add_argument('database', type=str, help='Name of the database to delete')
@@ -23,6 +110,7 @@ def main():
     create_parser.add_argument('database', type=str, help='Name of the database')
     create_parser.add_argument('key', type=str, help='The key')
     create_parser.add_argument('value', type=str, help='The value (JSON string)')
+    create_parser.add_argument('--ttl', type=float, help='Seconds until the key expires')
 
     read_parser = subparsers.add_parser('read', help='Read the value of a key from a specified database')
     read_parser.add_argument('database', type=str, help='Name of the database')
@@ -32,28 +120,124 @@ def main():
     update_parser.add_argument('database', type=str, help='Name of the database')
     update_parser.add_argument('key', type=str, help='The key')
     update_parser.add_argument('value', type=str, help='The new value (JSON string)')
+    update_parser.add_argument('--ttl', type=float, help='Seconds until the key expires (without it, it never does)')
 
     delete_parser = subparsers.add_parser('delete', help='Delete a key-value pair from a specified database')
     delete_parser.add_argument('database', type=str, help='Name of the database')
     delete_parser.add_argument('key', type=str, help='The key')
 
+    expire_parser = subparsers.add_parser('expire', help='Delete the keys whose time to live has passed')
+    expire_parser.add_argument('database', type=str, help='Name of the database')
+
     list_keys_parser = subparsers.add_parser('list', help='List all keys in a specified database')
     list_keys_parser.add_argument('database', type=str, help='Name of the database')
+    list_keys_parser.add_argument('--limit', type=int, help='Maximum number of keys to list')
+    list_keys_parser.add_argument('--after', type=str, help='Only list keys after this key (cursor from the previous page)')
+    list_keys_parser.add_argument('--prefix', type=str, help='Only list keys starting with this prefix')
+
+    scan_parser = subparsers.add_parser('scan', help='Print the records in a key range or with a key prefix, in key order')
+    scan_parser.add_argument('database', type=str, help='Name of the database')
+    scan_parser.add_argument('--start', type=str, help='First key of the range (inclusive)')
+    scan_parser.add_argument('--end', type=str, help='End of the range (exclusive)')
+    scan_parser.add_argument('--prefix', type=str, help='Only scan keys starting with this prefix')
+    scan_parser.add_argument('--reverse', action='store_true', help='Scan in descending key order')
+    scan_parser.add_argument('--limit', type=int, help='Maximum number of records to print')
+    scan_parser.add_argument('--after', type=str, help='Continue after this key (cursor from the previous page)')
 
     query_parser = subparsers.add_parser('query', help='Query the database')
     query_parser.add_argument('database', type=str, help='Name of the database')
-    query_parser.add_argument('field', type=str, help='Field to query')
-    query_parser.add_argument('operator', type=str, choices=['=', '!=', '>', '<', '>=', '<='], help='Comparison operator')
-    query_parser.add_argument('value', type=str, help='Value to compare against')
+    query_parser.add_argument('field', type=str, nargs='?', help='Field to query (dotted paths such as address.city reach nested fields)')
+    query_parser.add_argument('operator', type=str, nargs='?', choices=OPERATORS, help='Comparison operator')
+    query_parser.add_argument('value', type=str, nargs='?', help='Value to compare against')
+    query_parser.add_argument('--where', type=str, action='append', default=[], metavar='CONDITION',
+                              help="Another condition such as 'age >= 30' or 'city in [\"Paris\", \"Rome\"]' (repeatable)")
+    query_parser.add_argument('--any', action='store_true', help='Match records meeting any condition instead of all of them')
+    query_parser.add_argument('--filter', type=str,
+                              help='Predicate as JSON, e.g. {"or": [{"field": "age", "op": "<", "value": 18}, ...]}; '
+                                   'combined with the conditions using AND')
+    query_parser.add_argument('--select', type=str, help='Comma-separated fields to return instead of whole records')
+    query_parser.add_argument('--order-by', type=str, action='append', metavar='FIELD',
+                              help="Sort results by a field; use --order-by=-field for descending (repeatable)")
+    query_parser.add_argument('--limit', type=int, help='Maximum number of records to return')
+    query_parser.add_argument('--after', type=str, help='Only return keys after this key (cursor from the previous page)')
+    query_parser.add_argument('--explain', action='store_true', help='Show how the query would be evaluated instead of running it')
+
+    aggregate_parser = subparsers.add_parser('aggregate', help='Count, sum, average or find the min/max of fields over matching records')
+    aggregate_parser.add_argument('database', type=str, help='Name of the database')
+    aggregate_parser.add_argument('aggregates', type=str, nargs='+', metavar='AGGREGATE',
+                                  help="count, count(field), sum(field), min(field), max(field) or avg(field)")
+    aggregate_parser.add_argument('--group-by', type=str, metavar='FIELD', help='Compute the aggregates per value of this field')
+    aggregate_parser.add_argument('--where', type=str, action='append', default=[], metavar='CONDITION',
+                                  help="Only aggregate records meeting a condition such as 'age >= 30' (repeatable)")
+    aggregate_parser.add_argument('--any', action='store_true', help='Match records meeting any condition instead of all of them')
+    aggregate_parser.add_argument('--filter', type=str, help='Predicate as JSON (see query --filter); combined using AND')
+    aggregate_parser.set_defaults(field=None, operator=None, value=None)
+
+    import_parser = subparsers.add_parser('import', help='Import records from a JSON-lines file into a database')
+    import_parser.add_argument('database', type=str, help='Name of the database')
+    import_parser.add_argument('file', type=str, help="JSON-lines file of {\"key\": ..., \"value\": ...} objects ('-' for stdin)")
+    import_parser.add_argument('--batch-size', type=int, default=10000, help='Number of records written per batch')
+    import_parser.add_argument('--upsert', action='store_true', help='Overwrite existing keys instead of failing')
+
+    create_index_parser = subparsers.add_parser('create_index', help='Create a secondary index on a field')
+    create_index_parser.add_argument('database', type=str, help='Name of the database')
+    create_index_parser.add_argument('field', type=str, help='Field to index')
+    create_index_parser.add_argument('--kind', type=str, choices=['hash', 'sorted', 'column'], default='hash',
+                                     help="Index kind: 'hash' for =/!= queries, 'sorted' for range queries, "
+                                          "'column' for vectorized numeric queries and aggregates (needs NumPy)")
+
+    drop_index_parser = subparsers.add_parser('drop_index', help='Drop the secondary index on a field')
+    drop_index_parser.add_argument('database', type=str, help='Name of the database')
+    drop_index_parser.add_argument('field', type=str, help='Indexed field')
+
+    list_indexes_parser = subparsers.add_parser('list_indexes', help='List secondary indexes of a database')
+    list_indexes_parser.add_argument('database', type=str, help='Name of the database')
+
+    migrate_parser = subparsers.add_parser('migrate', help='Convert databases to another storage format')
+    migrate_parser.add_argument('databases', type=str, nargs='*', help='Names of the databases (default: all)')
+    migrate_parser.add_argument('--to', type=str, choices=['json', 'binary'], default='binary',
+                                help='Target storage format')
+    migrate_parser.add_argument('--compress', action='store_true', dest='compress_records',
+                                help='Compress records in the binary format')
+
+    watch_parser = subparsers.add_parser('watch', help='Stream the committed changes of a database as JSON lines')
+    watch_parser.add_argument('database', type=str, help='Name of the database')
+    watch_parser.add_argument('--since', type=int,
+                              help='Sequence number of the last change seen, to resume after it (default: new changes only)')
+    watch_parser.add_argument('--timeout', type=float, help='Stop after this many seconds without changes')
+
+    backup_parser = subparsers.add_parser('backup', help='Back up a database while it stays writable')
+    backup_parser.add_argument('database', type=str, help='Name of the database')
+    backup_parser.add_argument('output', type=str, help='Backup file to write')
+    backup_parser.add_argument('--compress', action='store_true', dest='compress_backup',
+                               help='Compress the backup with gzip')
+    backup_parser.add_argument('--since', type=str, nargs='+', metavar='BACKUP',
+                               help='Backup chain (full backup first) to take an incremental backup against')
+
+    restore_parser = subparsers.add_parser('restore', help='Restore a database from a backup chain')
+    restore_parser.add_argument('database', type=str, help='Name of the database')
+    restore_parser.add_argument('backups', type=str, nargs='+',
+                                help='Full backup followed by its incremental backups, in order')
+    restore_parser.add_argument('--force', action='store_true', help='Replace the database if it exists')
+
+    stats_parser = subparsers.add_parser('stats', help='Show statistics and operation metrics of a database')
+    stats_parser.add_argument('database', type=str, help='Name of the database')
+    stats_parser.add_argument('--url', type=str,
+                              help='Base URL of a running web app to report its live metrics (e.g. http://localhost:5000)')
 
     args = parser.parse_args()
-    db_manager = DatabaseManager()
+    # Each invocation touches few records, so binary databases are opened lazily.
+    db_manager = DatabaseManager(storage_mode=args.storage_mode, storage_format=args.storage_format,
+                                 compress=args.compress, lazy=True, durability=args.durability,
+                                 shard_processes=args.shard_processes,
+                                 # 'expire' deletes expired keys itself, so it can count them.
+                                 expire_in_background=args.command != 'expire')
 
     if args.command == 'create_db':
         try:
-            db_manager.create_database(args.database)
+            db_manager.create_database(args.database, shards=args.shards)
             print(f"Database '{args.database}' created successfully.")
-        except FileExistsError as e:
+        except (FileExistsError, ValueError) as e:
             print(e)
 
     elif args.command == 'delete_db':
@@ -86,10 +270,13 @@ def main():
             print("Ensure that the value is a valid JSON string.")
             sys.exit(1)
         try:
-            db.create(args.key, value)
+            db.create(args.key, value, args.ttl)
             print(f"Key '{args.key}' created successfully in database '{args.database}'.")
         except KeyError as e:
             print(e)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
 
     elif args.command == 'read':
         try:
@@ -101,6 +288,12 @@ def main():
         if value is not None:
             print(f"Value for key '{args.key}' in database '{args.database}':")
             print(json.dumps(value, indent=4))
+            try:
+                ttl = db.ttl(args.key)
+            except KeyError:
+                ttl = None
+            if ttl is not None:
+                print(f"Expires in {ttl:.1f} seconds.")
         else:
             print(f"Key '{args.key}' not found in database '{args.database}'.")
 
@@ -118,10 +311,13 @@ def main():
             print("Ensure that the value is a valid JSON string.")
             sys.exit(1)
         try:
-            db.update(args.key, value)
+            db.update(args.key, value, args.ttl)
             print(f"Key '{args.key}' updated successfully in database '{args.database}'.")
         except KeyError as e:
             print(e)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
 
     elif args.command == 'delete':
         try:
@@ -141,13 +337,60 @@ def main():
         except FileNotFoundError as e:
             print(e)
             sys.exit(1)
-        keys = db.list_keys()
-        if not keys:
+        if args.limit is not None and args.limit < 1:
+            print("--limit must be at least 1.")
+            sys.exit(1)
+        # Keys are streamed in key order, one bounded page at a time.
+        limit = args.limit + 1 if args.limit is not None else None
+        count = 0
+        for key in db.iter_keys(prefix=args.prefix, after=args.after, limit=limit):
+            if count == args.limit:
+                print(f"More keys available; continue with --after '{last_key}'.")
+                break
+            if count == 0:
+                print(f"Keys in database '{args.database}':")
+            print(f"- {key}")
+            last_key = key
+            count += 1
+        if count == 0:
             print(f"No keys found in database '{args.database}'.")
+
+    elif args.command == 'expire':
+        try:
+            db = db_manager.get_db(args.database)
+        except FileNotFoundError as e:
+            print(e)
+            sys.exit(1)
+        deleted = db.expire_keys()
+        print(f"Deleted {deleted} expired key(s) from database '{args.database}'.")
+
+    elif args.command == 'scan':
+        try:
+            db = db_manager.get_db(args.database)
+        except FileNotFoundError as e:
+            print(e)
+            sys.exit(1)
+        if args.limit is not None and args.limit < 1:
+            print("--limit must be at least 1.")
+            sys.exit(1)
+        if args.prefix is not None and (args.start is not None or args.end is not None):
+            print("--prefix cannot be combined with --start or --end.")
+            sys.exit(1)
+        limit = args.limit + 1 if args.limit is not None else None
+        if args.prefix is not None:
+            items = db.scan_prefix(args.prefix, args.reverse, args.after, limit)
         else:
-            print(f"Keys in database '{args.database}':")
-            for key in keys:
-                print(f"- {key}")
+            items = db.scan(args.start, args.end, args.reverse, args.after, limit)
+        count = 0
+        for key, value in items:
+            if count == args.limit:
+                print(f"More records available; continue with --after '{last_key}'.")
+                break
+            print(f"{key}: {json.dumps(value, indent=4)}")
+            last_key = key
+            count += 1
+        if count == 0:
+            print(f"No keys in range in database '{args.database}'.")
 
     elif args.command == 'query':
         try:
@@ -156,18 +399,222 @@ def main():
             print(e)
             sys.exit(1)
         try:
-            # Attempt to parse value as JSON (number, string, etc.)
-            value = json.loads(args.value)
-        except json.JSONDecodeError:
-            value = args.value
+            where = build_predicate(args)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        if args.explain:
+            plan = db.explain(where)
+            if plan['plan'] == 'index':
+                print(f"Index lookup on {' | '.join(plan['indexes'])}, about {plan['estimate']} candidate record(s).")
+            else:
+                print("Full scan of every record.")
+            return
 
-        results = db.query(args.field, args.operator, value)
-        if not results:
+        if args.limit is not None and args.limit < 1:
+            print("--limit must be at least 1.")
+            sys.exit(1)
+        if args.order_by and args.after is not None:
+            print("--after cannot be combined with --order-by.")
+            sys.exit(1)
+        select = [field.strip() for field in args.select.split(',') if field.strip()] if args.select else None
+        try:
+            if args.order_by or (args.limit is None and args.after is None):
+                results = db.find(where, select, args.order_by, args.limit).items()
+            else:
+                # Paginated results are returned in key order.
+                results = db.iter_find(where, select, after=args.after, limit=args.limit)
+            count = 0
+            for k, v in results:
+                if count == 0:
+                    print("Query Results:")
+                print(f"{k}: {json.dumps(v, indent=4)}")
+                count += 1
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        if count == 0:
             print("No records match the query.")
+        elif count == args.limit and not args.order_by:
+            print(f"Results may continue with --after '{k}'.")
+
+    elif args.command == 'aggregate':
+        try:
+            db = db_manager.get_db(args.database)
+        except FileNotFoundError as e:
+            print(e)
+            sys.exit(1)
+        try:
+            results = db.aggregate(args.aggregates, args.group_by, build_predicate(args))
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        if args.group_by is None:
+            for name, value in results.items():
+                print(f"{name}: {json.dumps(value)}")
+        elif not results:
+            print("No records match.")
         else:
-            print("Query Results:")
-            for k, v in results.items():
-                print(f"{k}: {json.dumps(v, indent=4)}")
+            print(f"Aggregates per {args.group_by}:")
+            for row in results:
+                group = row.pop('group')
+                label = json.dumps(group) if group is not None else '(missing)'
+                print(f"- {label}: " + ', '.join(f"{name}={json.dumps(value)}" for name, value in row.items()))
+
+    elif args.command == 'import':
+        try:
+            db = db_manager.get_db(args.database)
+        except FileNotFoundError as e:
+            print(e)
+            sys.exit(1)
+        op = 'put' if args.upsert else 'create'
+        imported = 0
+        batch = []
+        # The line number of each operation in the batch, to report the one that fails.
+        batch_lines = []
+        source = sys.stdin if args.file == '-' else open(args.file, 'r')
+        try:
+            for line_number, line in enumerate(source, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    batch.append({'op': op, 'key': record['key'], 'value': record['value']})
+                    batch_lines.append(line_number)
+                except (json.JSONDecodeError, KeyError, TypeError) as e:
+                    print(f"Line {line_number}: expected a JSON object with 'key' and 'value' ({e}).")
+                    sys.exit(1)
+                if len(batch) >= args.batch_size:
+                    imported += db.write_batch(batch)
+                    batch = []
+                    batch_lines = []
+            if batch:
+                imported += db.write_batch(batch)
+        except (KeyError, ValueError) as e:
+            message = e.args[0] if isinstance(e, KeyError) else str(e)
+            index = getattr(e, 'index', None)
+            print(f"Line {batch_lines[index]}: {message}" if index is not None else message)
+            print(f"Imported {imported} record(s) before the failing batch; that batch was not applied.")
+            sys.exit(1)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+        print(f"Imported {imported} record(s) into database '{args.database}'.")
+
+    elif args.command == 'create_index':
+        try:
+            db = db_manager.get_db(args.database)
+        except FileNotFoundError as e:
+            print(e)
+            sys.exit(1)
+        try:
+            db.create_index(args.field, args.kind)
+            print(f"{args.kind.capitalize()} index on field '{args.field}' created in database '{args.database}'.")
+        except KeyError as e:
+            print(e)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+
+    elif args.command == 'drop_index':
+        try:
+            db = db_manager.get_db(args.database)
+        except FileNotFoundError as e:
+            print(e)
+            sys.exit(1)
+        try:
+            db.drop_index(args.field)
+            print(f"Index on field '{args.field}' dropped from database '{args.database}'.")
+        except KeyError as e:
+            print(e)
+
+    elif args.command == 'list_indexes':
+        try:
+            db = db_manager.get_db(args.database)
+        except FileNotFoundError as e:
+            print(e)
+            sys.exit(1)
+        indexes = db.list_indexes()
+        if not indexes:
+            print(f"No indexes found in database '{args.database}'.")
+        else:
+            print(f"Indexes in database '{args.database}':")
+            for field, kind in indexes.items():
+                print(f"- {field} ({kind})")
+
+    elif args.command == 'migrate':
+        databases = args.databases or db_manager.list_databases()
+        if not databases:
+            print("No databases found.")
+        for database in databases:
+            try:
+                db_file = db_manager.migrate_database(database, args.to, compress=args.compress or args.compress_records)
+            except FileNotFoundError as e:
+                print(e)
+                sys.exit(1)
+            print(f"Database '{database}' migrated to {args.to} format ({path_size(db_file)} bytes).")
+
+    elif args.command == 'watch':
+        try:
+            db = db_manager.get_db(args.database)
+            if isinstance(db, ShardedNoSQLDB):
+                raise ValueError("Change feeds are not supported on sharded databases.")
+            events = db.watch(since=args.since, timeout=args.timeout)
+        except (FileNotFoundError, ValueError) as e:
+            print(e)
+            sys.exit(1)
+        # Progress goes to stderr so that stdout is one JSON event per line.
+        print(f"Watching database '{args.database}'; press Ctrl+C to stop.", file=sys.stderr)
+        try:
+            for event in events:
+                print(json.dumps(event), flush=True)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        except KeyboardInterrupt:
+            pass
+
+    elif args.command == 'backup':
+        try:
+            header = db_manager.backup_database(args.database, args.output, compress=args.compress_backup,
+                                                since=args.since)
+        except (FileNotFoundError, ValueError) as e:
+            print(e)
+            sys.exit(1)
+        print(f"{header['kind'].capitalize()} backup of '{args.database}' written to '{args.output}': "
+              f"{header['records']} records, {header['deleted']} deletions ({path_size(args.output)} bytes).")
+
+    elif args.command == 'restore':
+        try:
+            header = db_manager.restore_database(args.database, args.backups, overwrite=args.force)
+        except (FileNotFoundError, FileExistsError, ValueError) as e:
+            print(e)
+            sys.exit(1)
+        print(f"Database '{args.database}' restored from {len(args.backups)} backup(s) taken up to {header['created']}.")
+
+    elif args.command == 'stats':
+        metrics.enabled = True
+        try:
+            db = db_manager.get_db(args.database)
+        except FileNotFoundError as e:
+            print(e)
+            sys.exit(1)
+        print(f"Database '{args.database}':")
+        for name, value in db.stats().items():
+            print(f"- {name}: {value}")
+        if args.url:
+            query = urlencode({'format': 'json', 'db': args.database})
+            try:
+                with urlopen(f"{args.url.rstrip('/')}/metrics?{query}") as response:
+                    samples = json.load(response)['metrics']
+            except (URLError, ValueError, KeyError) as e:
+                print(f"Could not fetch metrics from {args.url}: {e}")
+                sys.exit(1)
+            print(f"Live metrics from {args.url}:")
+        else:
+            engines = db.engines if isinstance(db, ShardedNoSQLDB) else [db.engine]
+            samples = [sample for engine in engines for sample in metrics.snapshot(db=engine.name)]
+        print_metrics(samples)
 
     else:
         parser.print_help()
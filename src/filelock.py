@@ -0,0 +1,142 @@
+# src/filelock.py
+
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # flock() is POSIX only; without it databases cannot be shared between processes.
+    fcntl = None
+
+FLOCK_AVAILABLE = fcntl is not None
+
+LOCK_MAGIC = b'NOSQLLCK'
+# magic, generation (bumped by every persisted change), snapshot (bumped whenever
+# the database file is rewritten and its write-ahead log restarted).
+_LAYOUT = struct.Struct('<8sQQ')
+_GENERATION = struct.Struct('<Q')
+_GENERATION_OFFSET = 8
+
+class ProcessLock:
+    """
+    Coordinates the processes sharing a database through '<db_file>.lock'.
+
+    The file is locked with flock(): exclusively by a process writing the
+    database, from before it validates a write until the write is on disk,
+    and shared by a process reading changes made by others. It also holds
+    the database's stamp, a generation counter bumped after every persisted
+    change and a snapshot counter bumped whenever the database file is
+    rewritten. The stamp is memory-mapped, so checking whether another
+    process changed the database costs a read from memory, not a system call.
+
+    flock() locks belong to the open file, which the threads of a process
+    share, and so does the hold: while one thread holds the lock, others of
+    the same process join it in either mode, except that the exclusive lock
+    waits for a shared hold to end (and new shared holds wait for waiting
+    exclusive ones). The file is unlocked when the last thread leaves, so
+    threads writing at once stay inside one exclusive hold and can share a
+    flush. Both locks are re-entrant; a thread taking the shared lock while
+    holding the exclusive one, or the other way around, keeps what it holds.
+    """
+    def __init__(self, path):
+        if fcntl is None:
+            raise ValueError("Sharing databases between processes requires flock(), which this platform lacks.")
+        self.path = path
+        self._cond = threading.Condition(threading.Lock())
+        self._mode = None
+        self._holders = 0
+        self._waiting_exclusive = 0
+        self._local = threading.local()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            with self.exclusive():
+                if os.fstat(self._fd).st_size < _LAYOUT.size:
+                    os.ftruncate(self._fd, 0)
+                    os.write(self._fd, _LAYOUT.pack(LOCK_MAGIC, 0, 0))
+                self._map = mmap.mmap(self._fd, _LAYOUT.size)
+            if self._map[:len(LOCK_MAGIC)] != LOCK_MAGIC:
+                raise ValueError(f"'{path}' is not a database lock file.")
+        except Exception:
+            os.close(self._fd)
+            raise
+
+    @contextmanager
+    def _locked(self, operation):
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0:
+            self._acquire(operation)
+        self._local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self._local.depth = depth
+            if depth == 0:
+                self._release()
+
+    def _acquire(self, operation):
+        """Join this process's hold of the file lock, locking the file first if nobody holds it."""
+        with self._cond:
+            if operation == fcntl.LOCK_EX:
+                self._waiting_exclusive += 1
+                try:
+                    while self._mode == fcntl.LOCK_SH:
+                        self._cond.wait()
+                finally:
+                    self._waiting_exclusive -= 1
+            else:
+                while self._waiting_exclusive and self._mode != fcntl.LOCK_EX:
+                    self._cond.wait()
+            if self._mode is None:
+                fcntl.flock(self._fd, operation)
+                self._mode = operation
+            self._holders += 1
+
+    def _release(self):
+        """Leave this process's hold of the file lock, unlocking the file when the last holder leaves."""
+        with self._cond:
+            self._holders -= 1
+            if self._holders == 0:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+                self._mode = None
+                self._cond.notify_all()
+
+    def exclusive(self):
+        """Hold the lock exclusively, to change the database."""
+        return self._locked(fcntl.LOCK_EX)
+
+    def shared(self):
+        """Hold the lock shared with other readers, to read changes made by other processes."""
+        return self._locked(fcntl.LOCK_SH)
+
+    def generation(self):
+        """Return the current generation without locking; a cheap check for changes by other processes."""
+        return _GENERATION.unpack_from(self._map, _GENERATION_OFFSET)[0]
+
+    def stamp(self):
+        """Return (generation, snapshot). Caller should hold the lock."""
+        _, generation, snapshot = _LAYOUT.unpack_from(self._map)
+        return generation, snapshot
+
+    def bump(self, rewritten=False):
+        """
+        Record a persisted change, and with rewritten=True a rewrite of the
+        database file; returns the new (generation, snapshot). Caller must hold
+        the exclusive lock.
+        """
+        generation, snapshot = self.stamp()
+        generation += 1
+        if rewritten:
+            snapshot += 1
+        _LAYOUT.pack_into(self._map, 0, LOCK_MAGIC, generation, snapshot)
+        return generation, snapshot
+
+    def close(self):
+        """Unmap and close the lock file."""
+        if self._fd is not None:
+            self._map.close()
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,570 @@
+# src/indexes.py
+
+import bisect
+import operator as operators
+
+try:
+    import numpy
+except ImportError:
+    # Column indexes are optional; without NumPy they cannot be declared.
+    numpy = None
+
+NUMPY_AVAILABLE = numpy is not None
+INDEX_KINDS = ('hash', 'sorted', 'column')
+# The comparisons of query.compare; applied to NumPy arrays they compare element-wise.
+_COMPARISONS = {
+    '=': operators.eq,
+    '!=': operators.ne,
+    '>': operators.gt,
+    '<': operators.lt,
+    '>=': operators.ge,
+    '<=': operators.le,
+}
+
+def _as_number(value):
+    """Return the value as a float when query.compare would compare it numerically."""
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+class _Highest:
+    """Sorts after every key, so (value, HIGHEST) bounds all entries holding value."""
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+HIGHEST = _Highest()
+
+class FieldIndex:
+    """
+    Base class for secondary indexes on a top-level record field.
+
+    Records are classified the same way query.compare treats them:
+    values that convert to float are compared numerically against numeric
+    query values and as strings otherwise, so every record is kept both under
+    its numeric value (when it has one) and under its string form.
+    """
+    kind = None
+
+    def __init__(self, field):
+        self.field = field
+        self.entries = {}
+
+    def build(self, store):
+        """Index every record of the given store."""
+        for key, record in store.items():
+            self.add(key, record)
+
+    def add(self, key, record):
+        """Index a record; records without the field are not indexed."""
+        if not isinstance(record, dict):
+            return
+        value = record.get(self.field)
+        if value is None:
+            return
+        number = _as_number(value)
+        text = str(value)
+        self.entries[key] = (number, text)
+        self._insert(key, number, text)
+
+    def remove(self, key):
+        """Remove a key from the index if it is indexed."""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self._discard(key, *entry)
+
+    def replace(self, key, record):
+        """Re-index a key after its record changed; a record of None means deleted."""
+        self.remove(key)
+        if record is not None:
+            self.add(key, record)
+
+    def lookup(self, operator, value):
+        """
+        Return the set of keys whose field satisfies the condition, or None if
+        this index cannot answer the operator.
+        """
+        raise NotImplementedError
+
+    def estimate(self, operator, value):
+        """
+        Return the number of keys lookup() would return, without building the
+        set, or None if this index cannot answer the operator. Used by the
+        query planner to pick the most selective index.
+        """
+        raise NotImplementedError
+
+    def value_counts(self):
+        """
+        Count the indexed keys per value as '=' tells values apart: numeric
+        values under their number, others under their string form.
+        """
+        counts = {}
+        for number, text in self.entries.values():
+            value = text if number is None else number
+            counts[value] = counts.get(value, 0) + 1
+        return counts
+
+    def numeric_stats(self):
+        """Return (count, sum, min, max) of the indexed values that are numbers (NaN excluded); min and max are None if there are none."""
+        numbers = [number for number, _ in self.entries.values() if number is not None and number == number]
+        if not numbers:
+            return 0, 0.0, None, None
+        return len(numbers), sum(numbers), min(numbers), max(numbers)
+
+    def _insert(self, key, number, text):
+        raise NotImplementedError
+
+    def _discard(self, key, number, text):
+        raise NotImplementedError
+
+class HashIndex(FieldIndex):
+    """Hash index answering '=' and '!=' lookups."""
+    kind = 'hash'
+
+    def __init__(self, field):
+        super().__init__(field)
+        self._numbers = {}
+        self._texts = {}
+        self._numeric_texts = {}
+
+    def _buckets(self, number):
+        if number is None:
+            return None, self._texts
+        return self._numbers, self._numeric_texts
+
+    def _insert(self, key, number, text):
+        numbers, texts = self._buckets(number)
+        if numbers is not None:
+            numbers.setdefault(number, set()).add(key)
+        texts.setdefault(text, set()).add(key)
+
+    def _discard(self, key, number, text):
+        numbers, texts = self._buckets(number)
+        if numbers is not None:
+            _discard_from_bucket(numbers, number, key)
+        _discard_from_bucket(texts, text, key)
+
+    def _equal_buckets(self, value):
+        """Return the two disjoint buckets of keys whose field equals value."""
+        number = _as_number(value)
+        text = str(value)
+        if number is not None:
+            return self._numbers.get(number, set()), self._texts.get(text, set())
+        return self._texts.get(text, set()), self._numeric_texts.get(text, set())
+
+    def lookup(self, operator, value):
+        if operator not in ('=', '!='):
+            return None
+        first, second = self._equal_buckets(value)
+        equal = first | second
+        if operator == '=':
+            return equal
+        return self.entries.keys() - equal
+
+    def estimate(self, operator, value):
+        if operator not in ('=', '!='):
+            return None
+        first, second = self._equal_buckets(value)
+        equal = len(first) + len(second)
+        return equal if operator == '=' else len(self.entries) - equal
+
+    def value_counts(self):
+        # The buckets already group the keys: O(distinct values).
+        counts = {number: len(keys) for number, keys in self._numbers.items()}
+        counts.update((text, len(keys)) for text, keys in self._texts.items())
+        return counts
+
+class SortedIndex(FieldIndex):
+    """Sorted (bisect-backed) index answering range lookups as well as '=' and '!='."""
+    kind = 'sorted'
+
+    def __init__(self, field):
+        super().__init__(field)
+        self._numbers = []
+        self._texts = []
+        self._numeric_texts = []
+
+    def build(self, store):
+        # Bulk load with one sort per list instead of repeated insort calls.
+        for key, record in store.items():
+            if not isinstance(record, dict) or record.get(self.field) is None:
+                continue
+            value = record[self.field]
+            number = _as_number(value)
+            text = str(value)
+            self.entries[key] = (number, text)
+            if number is None:
+                self._texts.append((text, key))
+            else:
+                if number == number:
+                    self._numbers.append((number, key))
+                self._numeric_texts.append((text, key))
+        self._numbers.sort()
+        self._texts.sort()
+        self._numeric_texts.sort()
+
+    def _insert(self, key, number, text):
+        if number is None:
+            bisect.insort(self._texts, (text, key))
+            return
+        # NaN never satisfies a numeric comparison and would break the ordering.
+        if number == number:
+            bisect.insort(self._numbers, (number, key))
+        bisect.insort(self._numeric_texts, (text, key))
+
+    def _discard(self, key, number, text):
+        if number is None:
+            _discard_sorted(self._texts, (text, key))
+            return
+        if number == number:
+            _discard_sorted(self._numbers, (number, key))
+        _discard_sorted(self._numeric_texts, (text, key))
+
+    def lookup(self, operator, value):
+        if operator == '!=':
+            return self.entries.keys() - self.lookup('=', value)
+        if operator == 'prefix':
+            # Every string form starting with the prefix, numeric or not; the
+            # caller re-checks the records, so extra keys are harmless.
+            bounds = _prefix_bounds(value)
+            if bounds is None:
+                return None
+            return _slice_keys(self._texts, *bounds) | _slice_keys(self._numeric_texts, *bounds)
+        number = _as_number(value)
+        text = str(value)
+        if number is not None:
+            keys = _range_keys(self._numbers, number, operator) if number == number else set()
+            return keys | _range_keys(self._texts, text, operator)
+        return _range_keys(self._texts, text, operator) | _range_keys(self._numeric_texts, text, operator)
+
+    def estimate(self, operator, value):
+        if operator == '!=':
+            return len(self.entries) - self.estimate('=', value)
+        if operator == 'prefix':
+            bounds = _prefix_bounds(value)
+            if bounds is None:
+                return None
+            return _slice_count(self._texts, *bounds) + _slice_count(self._numeric_texts, *bounds)
+        number = _as_number(value)
+        text = str(value)
+        if number is not None:
+            count = _range_count(self._numbers, number, operator) if number == number else 0
+            return count + _range_count(self._texts, text, operator)
+        return _range_count(self._texts, text, operator) + _range_count(self._numeric_texts, text, operator)
+
+class ColumnIndex(FieldIndex):
+    """
+    Columnar index answering numeric comparisons ('=', '!=', '>', '<', '>=',
+    '<=') and numeric aggregates with vectorized NumPy operations.
+
+    The field's numbers are kept in a float64 array with one slot per
+    indexed key and a mask of the slots holding a number: entries maps each
+    key to its slot and _keys each slot to its key. Slots freed by deletes
+    are masked out and reused, so writes update the column in place instead
+    of shifting sorted lists. Values that do not convert to numbers are
+    compared as strings, as query.compare does, one by one from _texts.
+    Queries with a non-numeric value are left to other indexes or a scan.
+    """
+    kind = 'column'
+
+    def __init__(self, field):
+        if numpy is None:
+            raise ValueError("Column indexes require NumPy, which is not installed.")
+        super().__init__(field)
+        self._keys = []
+        self._free = []
+        self._values = numpy.empty(0)
+        self._numeric = numpy.zeros(0, dtype=bool)
+        self._texts = {}
+
+    def build(self, store):
+        # Bulk load: collect the column in lists and convert it once.
+        values = []
+        for key, record in store.items():
+            if not isinstance(record, dict) or record.get(self.field) is None:
+                continue
+            value = record[self.field]
+            number = _as_number(value)
+            self.entries[key] = len(self._keys)
+            self._keys.append(key)
+            if number is None:
+                self._texts[key] = str(value)
+            values.append(number)
+        self._numeric = numpy.array([number is not None for number in values], dtype=bool)
+        self._values = numpy.array([number if number is not None else 0.0 for number in values], dtype=float)
+
+    def add(self, key, record):
+        if not isinstance(record, dict):
+            return
+        value = record.get(self.field)
+        if value is None:
+            return
+        number = _as_number(value)
+        slot = self.entries.get(key)
+        if slot is None:
+            slot = self._allocate(key)
+        if number is None:
+            self._texts[key] = str(value)
+            self._numeric[slot] = False
+        else:
+            self._texts.pop(key, None)
+            self._values[slot] = number
+            self._numeric[slot] = True
+
+    def remove(self, key):
+        slot = self.entries.pop(key, None)
+        if slot is not None:
+            self._numeric[slot] = False
+            self._keys[slot] = None
+            self._texts.pop(key, None)
+            self._free.append(slot)
+
+    def _allocate(self, key):
+        """Assign a slot to a key, reusing a free one or growing the arrays by doubling."""
+        if self._free:
+            slot = self._free.pop()
+            self._keys[slot] = key
+        else:
+            slot = len(self._keys)
+            self._keys.append(key)
+            if slot == len(self._values):
+                grow = max(slot, 16)
+                self._values = numpy.concatenate([self._values, numpy.zeros(grow)])
+                self._numeric = numpy.concatenate([self._numeric, numpy.zeros(grow, dtype=bool)])
+        self.entries[key] = slot
+        return slot
+
+    def _numbers(self):
+        """The column's numbers, NaN included, as an array."""
+        used = len(self._keys)
+        return self._values[:used][self._numeric[:used]]
+
+    def _matches(self, operator, value):
+        """Return (mask of the matching slots, matching keys of non-numeric values), or None."""
+        number = _as_number(value)
+        if operator not in _COMPARISONS or number is None:
+            return None
+        test = _COMPARISONS[operator]
+        used = len(self._keys)
+        mask = test(self._values[:used], number)
+        mask &= self._numeric[:used]
+        text = str(value)
+        return mask, [key for key, key_text in self._texts.items() if test(key_text, text)]
+
+    def lookup(self, operator, value):
+        matches = self._matches(operator, value)
+        if matches is None:
+            return None
+        mask, texts = matches
+        keys = self._keys
+        found = {keys[slot] for slot in numpy.flatnonzero(mask).tolist()}
+        found.update(texts)
+        return found
+
+    def estimate(self, operator, value):
+        matches = self._matches(operator, value)
+        if matches is None:
+            return None
+        mask, texts = matches
+        return int(numpy.count_nonzero(mask)) + len(texts)
+
+    def value_counts(self):
+        numbers, counts = numpy.unique(self._numbers(), return_counts=True)
+        value_counts = dict(zip(numbers.tolist(), counts.tolist()))
+        for text in self._texts.values():
+            value_counts[text] = value_counts.get(text, 0) + 1
+        return value_counts
+
+    def numeric_stats(self):
+        numbers = self._numbers()
+        numbers = numbers[~numpy.isnan(numbers)]
+        if not numbers.size:
+            return 0, 0.0, None, None
+        return int(numbers.size), float(numbers.sum()), float(numbers.min()), float(numbers.max())
+
+INDEX_CLASSES = {cls.kind: cls for cls in (HashIndex, SortedIndex, ColumnIndex)}
+
+# Keys per chunk of a KeyIndex when built; a chunk is split once it holds twice as many.
+KEY_CHUNK_SIZE = 1000
+
+class KeyIndex:
+    """
+    The keys of a store in sorted order, for range and prefix scans.
+
+    Keys are kept in sorted chunks, with the first key of each chunk in a
+    list of its own: a lookup bisects that list and then one chunk, so
+    inserts and deletes shift at most 2 * KEY_CHUNK_SIZE references instead
+    of a list as long as the store, and a scan of k keys costs O(log n + k).
+    """
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self._chunks = [keys[i:i + KEY_CHUNK_SIZE] for i in range(0, len(keys), KEY_CHUNK_SIZE)]
+        self._firsts = [chunk[0] for chunk in self._chunks]
+        self._length = len(keys)
+
+    def __len__(self):
+        return self._length
+
+    def _locate(self, key):
+        """Return the position of the chunk that holds, or would hold, a key."""
+        return max(bisect.bisect_right(self._firsts, key) - 1, 0)
+
+    def __contains__(self, key):
+        if not self._chunks:
+            return False
+        chunk = self._chunks[self._locate(key)]
+        pos = bisect.bisect_left(chunk, key)
+        return pos < len(chunk) and chunk[pos] == key
+
+    def add(self, key):
+        """Insert a key if it is not present."""
+        if not self._chunks:
+            self._chunks.append([key])
+            self._firsts.append(key)
+            self._length = 1
+            return
+        i = self._locate(key)
+        chunk = self._chunks[i]
+        pos = bisect.bisect_left(chunk, key)
+        if pos < len(chunk) and chunk[pos] == key:
+            return
+        chunk.insert(pos, key)
+        self._length += 1
+        if pos == 0:
+            self._firsts[i] = key
+        if len(chunk) > 2 * KEY_CHUNK_SIZE:
+            half = len(chunk) // 2
+            self._chunks.insert(i + 1, chunk[half:])
+            self._firsts.insert(i + 1, chunk[half])
+            del chunk[half:]
+
+    def discard(self, key):
+        """Remove a key if it is present."""
+        if not self._chunks:
+            return
+        i = self._locate(key)
+        chunk = self._chunks[i]
+        pos = bisect.bisect_left(chunk, key)
+        if pos == len(chunk) or chunk[pos] != key:
+            return
+        del chunk[pos]
+        self._length -= 1
+        if not chunk:
+            del self._chunks[i]
+            del self._firsts[i]
+        elif pos == 0:
+            self._firsts[i] = chunk[0]
+
+    def irange(self, low=None, high=None, reverse=False, low_inclusive=True, high_inclusive=False):
+        """
+        Iterate over the keys from low to high (None for no bound), in order
+        or in reverse. By default low is included and high is not. The index
+        must not change during the iteration.
+        """
+        chunks = self._chunks
+        if not chunks:
+            return iter(())
+        if low is None:
+            first, start = 0, 0
+        else:
+            first = self._locate(low)
+            find = bisect.bisect_left if low_inclusive else bisect.bisect_right
+            start = find(chunks[first], low)
+        if high is None:
+            last, stop = len(chunks) - 1, len(chunks[-1])
+        else:
+            last = self._locate(high)
+            find = bisect.bisect_right if high_inclusive else bisect.bisect_left
+            stop = find(chunks[last], high)
+        return self._walk(first, start, last, stop, reverse)
+
+    def _walk(self, first, start, last, stop, reverse):
+        """Yield the keys from position start of chunk first up to (excluding) position stop of chunk last."""
+        chunks = self._chunks
+        spans = range(last, first - 1, -1) if reverse else range(first, last + 1)
+        for i in spans:
+            chunk = chunks[i]
+            begin = start if i == first else 0
+            end = stop if i == last else len(chunk)
+            positions = range(end - 1, begin - 1, -1) if reverse else range(begin, end)
+            for pos in positions:
+                yield chunk[pos]
+
+def create_index(field, kind, fallback=False):
+    """
+    Create an empty index of the given kind for a field. With fallback, a
+    column index is created as a sorted index, which answers the same
+    queries, when NumPy is not installed; declared indexes are opened this way.
+    """
+    if kind not in INDEX_CLASSES:
+        raise ValueError(f"Unknown index kind '{kind}'. Supported kinds: {', '.join(INDEX_KINDS)}.")
+    if kind == 'column' and fallback and not NUMPY_AVAILABLE:
+        kind = 'sorted'
+    return INDEX_CLASSES[kind](field)
+
+def _discard_from_bucket(buckets, value, key):
+    bucket = buckets.get(value)
+    if bucket is not None:
+        bucket.discard(key)
+        if not bucket:
+            del buckets[value]
+
+def _discard_sorted(entries, entry):
+    pos = bisect.bisect_left(entries, entry)
+    if pos < len(entries) and entries[pos] == entry:
+        del entries[pos]
+
+def _range_slice(entries, bound, operator):
+    """Return the (start, stop) positions of the (value, key) entries whose value satisfies `value <operator> bound`."""
+    low = bisect.bisect_left(entries, (bound,))
+    high = bisect.bisect_right(entries, (bound, HIGHEST))
+    if operator == '=':
+        return low, high
+    elif operator == '>':
+        return high, len(entries)
+    elif operator == '>=':
+        return low, len(entries)
+    elif operator == '<':
+        return 0, low
+    elif operator == '<=':
+        return 0, high
+    return 0, 0
+
+def _range_keys(entries, bound, operator):
+    """Return the keys of (value, key) entries whose value satisfies `value <operator> bound`."""
+    start, stop = _range_slice(entries, bound, operator)
+    return {key for _, key in entries[start:stop]}
+
+def _range_count(entries, bound, operator):
+    """Count the (value, key) entries whose value satisfies `value <operator> bound`."""
+    start, stop = _range_slice(entries, bound, operator)
+    return stop - start
+
+def _prefix_bounds(prefix):
+    """Return the (low, high) strings bounding every string that starts with prefix, or None."""
+    if not isinstance(prefix, str):
+        return None
+    if not prefix:
+        return '', None
+    last = ord(prefix[-1])
+    if last == 0x10FFFF:
+        return None
+    return prefix, prefix[:-1] + chr(last + 1)
+
+def _slice_positions(entries, low, high):
+    start = bisect.bisect_left(entries, (low,))
+    stop = len(entries) if high is None else bisect.bisect_left(entries, (high,))
+    return start, stop
+
+def _slice_keys(entries, low, high):
+    """Return the keys of (text, key) entries with low <= text < high (high None for no upper bound)."""
+    start, stop = _slice_positions(entries, low, high)
+    return {key for _, key in entries[start:stop]}
+
+def _slice_count(entries, low, high):
+    start, stop = _slice_positions(entries, low, high)
+    return stop - start
@@ -1,195 +1,1731 @@
 # src/main.py
 
+import atexit
 import json
 import os
+import shutil
 import threading
-import copy
+import time
+import weakref
+import heapq
+from operator import itemgetter
+from collections import OrderedDict
+from itertools import islice
+from contextlib import nullcontext
+from wal import WriteAheadLog, expand_record
+from filelock import FLOCK_AVAILABLE, ProcessLock
+from indexes import KeyIndex, _prefix_bounds, create_index
+from transactions import TransactionOverlay
+from rwlock import ReadWriteLock
+from aggregate import Aggregation
+from backup import chain_digests, changed_entries, new_header, restore_chain, write_backup
+from cache import ValueCache
+from changefeed import ChangeFeed
+from storage import EXTENSIONS, LazyStore, fsync_directory, get_format, format_for_file
+from metrics import metrics, OperationTimer
+from query import Query, compare, compile_predicate, condition, describe_plan, plan
+from sharding import SHARDS_SUFFIX, ShardedNoSQLDB, read_manifest, shard_file_names, write_manifest
 
-class SimpleNoSQLDB:
-    def __init__(self, db_file, in_transaction=False, transaction_store=None):
+STORAGE_MODES = ('snapshot', 'wal')
+DURABILITY_MODES = ('none', 'async', 'sync')
+# Files kept next to the database file ('<name>.json' or '<name>.ndb') that belong to the same database.
+SIDECAR_SUFFIXES = ('.wal', '.indexes', '.tmp', '.lock', '.changes', '.changes.old', '.ttl')
+BATCH_OPERATIONS = ('create', 'update', 'put', 'delete')
+# Most expired keys deleted with one persist; the expirer repeats until none is due.
+EXPIRE_BATCH = 1000
+# Longest the expirer sleeps, so it also notices keys given a time to live by other processes.
+EXPIRE_POLL_INTERVAL = 1.0
+# Marks a key deleted by an earlier operation of the same batch.
+_DELETED = object()
+
+class DatabaseEngine:
+    def __init__(self, db_file, storage_mode='snapshot', sync_every=1, checkpoint_interval=None,
+                 checkpoint_bytes=16 * 1024 * 1024, storage_format=None, lazy=False,
+                 durability='sync', flush_interval=1.0, flush_writes=1000, cache_bytes=None,
+                 multiprocess=False, read_only=False, expire_in_background=True):
         """
-        Initialize the SimpleNoSQLDB with the specified database file and transaction state.
+        Initialize the engine owning a database file: its in-memory store, lock,
+        persistence and secondary indexes. Any number of SimpleNoSQLDB handles,
+        each with its own transaction state, can share one engine.
+
+        storage_format is the on-disk format of the file (see storage.py); by
+        default it is chosen from the file extension. With lazy=True a binary
+        file is memory-mapped and records are decoded only when accessed, so
+        opening the database does not depend on its size; JSON files are
+        always loaded in full. cache_bytes bounds a cache of the values that
+        lazy reads decode (see cache.ValueCache), so hot keys are decoded
+        once rather than on every read.
+
+        storage_mode selects how mutations are persisted:
+        - 'snapshot' rewrites the whole file on every write.
+        - 'wal' appends each mutation to '<db_file>.wal' and periodically
+          checkpoints the log into a new snapshot. sync_every sets how many
+          records are appended between fsyncs. The log is compacted into a
+          new snapshot as soon as it grows beyond checkpoint_bytes, and
+          checkpoint_interval (seconds) starts a background thread that
+          also compacts it periodically.
+
+        durability selects when writes reach stable storage:
+        - 'sync' persists a write before it returns and fsyncs the file and
+          its directory (in 'wal' mode the log is fsynced every sync_every
+          records).
+        - 'async' returns once a write is applied in memory; a background
+          thread flushes and fsyncs every flush_interval seconds, or sooner
+          once flush_writes writes are waiting. A crash loses at most the
+          writes since the last flush; flush() forces one.
+        - 'none' persists a write before it returns but never fsyncs, so
+          writes survive a process crash but not a power loss.
+        Concurrent writers share flushes: a writer waiting for the disk finds
+        its changes already written by the flush of another writer, so the
+        number of flushes is bounded by the disk rather than the write rate.
+
+        The change feed, once enabled (see enable_change_feed and watch),
+        records every committed write as an event with a sequence number in
+        '<db_file>.changes'. Events are appended when their writes are
+        persisted, so with 'async' durability they appear at the next flush.
+
+        multiprocess=True lets several processes (the CLI, web app workers)
+        share the file through '<db_file>.lock' (see filelock.ProcessLock).
+        A write locks it exclusively, catches up with the changes of other
+        processes, and is persisted before the lock is released, so no
+        process overwrites another's writes. Every operation first compares
+        the lock file's generation stamp with the one it last saw and only
+        catches up when it changed: in 'wal' mode by replaying just the log
+        records appended since, otherwise (or after a checkpoint) by
+        reloading the file, an O(1) remap for lazy binary files. 'async'
+        durability keeps writes in memory, so it cannot be combined with it.
+        Threads of one process writing at once share the exclusive lock and,
+        as above, their flushes.
+
+        Keys written with a time to live (see SimpleNoSQLDB.create) read as
+        absent once it passes. Their expiry times are logged with the write
+        and kept in '<db_file>.ttl' by snapshots; a background thread, started
+        when the first key is given a time to live, deletes expired keys in
+        batches, waking when the earliest expiry in a heap is due. With
+        expire_in_background=False no such thread is started and expired keys
+        stay on disk until expire_keys is called.
+
+        read_only=True opens the file only to read it, as the worker processes
+        of sharded databases do while the parent process writes: writes raise
+        ValueError, no background thread is started, and the engine never
+        flushes, checkpoints, expires keys or repairs the log.
         """
+        if storage_mode not in STORAGE_MODES:
+            raise ValueError(f"Unknown storage mode '{storage_mode}'.")
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode '{durability}'. Supported modes: {', '.join(DURABILITY_MODES)}.")
+        if multiprocess and durability == 'async':
+            raise ValueError("'async' durability cannot be used by databases shared between processes.")
         self.db_file = db_file
-        self.lock = threading.Lock()
-        self._load_data()
-        self.in_transaction = in_transaction
-        if in_transaction and transaction_store is not None:
-            self.transaction_store = transaction_store
-        else:
-            self.transaction_store = None
+        self.name = os.path.splitext(os.path.basename(db_file))[0]
+        self.read_only = read_only
+        self.expire_in_background = expire_in_background
+        self.storage_mode = storage_mode
+        self.format = storage_format if storage_format is not None else format_for_file(db_file)
+        self.lazy = lazy
+        self.cache = ValueCache(cache_bytes) if lazy and cache_bytes else None
+        self.durability = durability
+        self.flush_writes = flush_writes
+        self.checkpoint_bytes = checkpoint_bytes
+        # Readers share the lock; writers hold it only while mutating memory.
+        # Disk I/O is serialized separately by io_lock.
+        self.lock = ReadWriteLock()
+        self.io_lock = threading.Lock()
+        self.version = 0
+        self.persisted_version = 0
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self.wal = WriteAheadLog(self._get_wal_file(), sync_every if durability == 'sync' else 0)
+        self.process_lock = ProcessLock(f"{db_file}.lock") if multiprocess else None
+        self.feed = ChangeFeed(f"{db_file}.changes")
+        self._feed_pending = []
+        self._feed_published = threading.Condition()
+        start = time.perf_counter()
+        with self.shared():
+            self._load_data()
+            self._load_feed_state()
+            self._mark_seen(self.wal.size())
+        if metrics.enabled:
+            metrics.observe('nosql_load_seconds', time.perf_counter() - start, db=self.name)
+        self._indexes_build_lock = threading.Lock()
+        self._load_indexes()
+        self.handles = weakref.WeakSet()
+        self._checkpoint_stop = None
+        self._flush_stop = None
+        self._expirer_stop = None
+        self.expired_count = 0
+        if self.expiries:
+            self._wake_expirer()
+        if storage_mode == 'wal' and checkpoint_interval and not read_only:
+            self._start_checkpointer(checkpoint_interval)
+        if durability == 'async' and not read_only:
+            self._start_flusher(flush_interval)
+
+    def _check_writable(self):
+        """Raise ValueError if the engine is read-only."""
+        if self.read_only:
+            raise ValueError(f"Database '{self.name}' is open read-only.")
+
+    def exclusive(self):
+        """Context holding the cross-process lock exclusively; a no-op unless multiprocess."""
+        return self.process_lock.exclusive() if self.process_lock is not None else nullcontext()
+
+    def shared(self):
+        """Context holding the cross-process lock shared; a no-op unless multiprocess."""
+        return self.process_lock.shared() if self.process_lock is not None else nullcontext()
+
+    def _mark_seen(self, wal_offset):
+        """
+        Record that the store is up to date with the lock file's stamp and the
+        log up to wal_offset. Caller must hold the cross-process lock.
+        """
+        if self.process_lock is not None:
+            self._seen_generation, self._seen_snapshot = self.process_lock.stamp()
+            self._wal_offset = wal_offset
+
+    def _publish(self, rewritten=False):
+        """Stamp a persisted change for other processes. Caller must hold the exclusive cross-process lock."""
+        if self.process_lock is not None:
+            self._seen_generation, self._seen_snapshot = self.process_lock.bump(rewritten)
+
+    def refresh(self):
+        """
+        Catch up with the changes other processes persisted (multiprocess
+        engines only). When nothing changed this is one read of the mapped
+        stamp; otherwise only the log records appended since the last
+        catch-up are applied, unless the file was rewritten meanwhile, in
+        which case it is reloaded.
+        """
+        process_lock = self.process_lock
+        if process_lock is None or process_lock.generation() == self._seen_generation:
+            return
+        # Threads of this process share the lock file's hold, so the stamp is
+        # compared under the I/O lock that this process's flushes publish under.
+        with process_lock.shared(), self.io_lock:
+            generation, snapshot = process_lock.stamp()
+            if generation == self._seen_generation:
+                return
+            with self.lock.write_lock():
+                if snapshot != self._seen_snapshot:
+                    kind = 'reload'
+                    # The log may have been folded into the file and removed; appends must not go to the old one.
+                    self.wal.reopen_if_replaced()
+                    self._load_data()
+                    self._indexes = None
+                    if self.cache is not None:
+                        self.cache.clear()
+                    if self.expiries:
+                        self._wake_expirer()
+                    wal_offset = self.wal.size()
+                else:
+                    kind = 'log'
+                    records, wal_offset = self.wal.read_from(self._wal_offset)
+                    for record in records:
+                        for change in expand_record(record):
+                            key = change['key']
+                            if change['op'] == 'set':
+                                self.store[key] = change['value']
+                                self._reindex(key, change['value'])
+                                if self._key_index is not None:
+                                    self._key_index.add(key)
+                                self._set_expiry(key, change.get('expires'))
+                            elif key in self.store:
+                                del self.store[key]
+                                self._reindex(key, None)
+                                if self._key_index is not None:
+                                    self._key_index.discard(key)
+                                self._set_expiry(key, None)
+                self._load_indexes(keep_built=True)
+                self._load_feed_state()
+                # Changes of other processes are on disk already.
+                self.version += 1
+                self.persisted_version = self.version
+                self._mark_seen(wal_offset)
+        if metrics.enabled:
+            metrics.inc('nosql_refreshes_total', db=self.name, kind=kind)
+
+    def _load_feed_state(self):
+        """Read whether the change feed is enabled and its last sequence number."""
+        self.feed_enabled = self.feed.exists()
+        self.sequence = self.feed.last_sequence() if self.feed_enabled else 0
+        with self._feed_published:
+            self.published_sequence = self.sequence
+
+    def enable_change_feed(self):
+        """Start recording committed writes in the change feed; returns its last sequence number."""
+        self._check_writable()
+        with self.exclusive():
+            self.refresh()
+            with self.io_lock, self.lock.write_lock():
+                if not self.feed_enabled:
+                    self.feed.create()
+                    self.feed_enabled = True
+                    self._publish()
+                return self.sequence
+
+    def disable_change_feed(self):
+        """Stop recording committed writes and discard the change feed."""
+        self._check_writable()
+        with self.exclusive():
+            self.refresh()
+            with self.io_lock, self.lock.write_lock():
+                if self.feed_enabled:
+                    self.feed.remove()
+                    self._feed_pending = []
+                    self._load_feed_state()
+                    self._publish()
+
+    def watch(self, since=None, timeout=None, poll_interval=0.5):
+        """
+        Iterate over the committed writes after sequence number `since` as
+        change feed events (see changefeed.ChangeFeed), then follow new ones
+        as they are persisted, also those of other processes. since=None
+        starts from now. Stops after `timeout` seconds without events if
+        given. The feed is enabled if it was not. Raises ValueError if the
+        events after `since` are no longer retained.
+        """
+        self.refresh()
+        if not self.feed_enabled:
+            self.enable_change_feed()
+        return self.feed.follow(since, timeout, poll_interval, self._wait_for_event)
+
+    def _wait_for_event(self, last, timeout):
+        """Wait until this process publishes an event after `last`, or for `timeout` seconds."""
+        with self._feed_published:
+            self._feed_published.wait_for(lambda: self.published_sequence > last, timeout)
+
+    def _write_feed(self):
+        """Append the events of the persisted versions to the change feed. Caller must hold the I/O lock."""
+        with self._pending_lock:
+            ready = [event for version, event in self._feed_pending if version <= self.persisted_version]
+            if not ready:
+                return
+            del self._feed_pending[:len(ready)]
+        self.feed.append(ready, sync=self.durability != 'none')
+        with self._feed_published:
+            self.published_sequence = ready[-1]['seq']
+            self._feed_published.notify_all()
+
+    def _get_wal_file(self):
+        """Get the file path of the write-ahead log for this database."""
+        return f"{self.db_file}.wal"
+
+    def _get_ttl_file(self):
+        """Get the file path of the key expiry times saved with the snapshot of this database."""
+        return f"{self.db_file}.ttl"
+
+    def _get_indexes_file(self):
+        """Get the file path of the secondary index definitions for this database."""
+        return f"{self.db_file}.indexes"
+
+    def _load_indexes(self, keep_built=False):
+        """
+        Read the secondary index definitions; the indexes are built when first
+        needed. With keep_built, indexes already built are kept unless the
+        definitions changed.
+        """
+        definitions = {}
+        indexes_file = self._get_indexes_file()
+        if os.path.exists(indexes_file):
+            with open(indexes_file, 'r') as f:
+                definitions = json.load(f)
+        if keep_built and definitions == self._index_definitions:
+            return
+        self._index_definitions = definitions
+        self._indexes = None
+
+    @property
+    def indexes(self):
+        """
+        The secondary indexes keyed by field. They are built from the store on
+        first use rather than when the database is opened, so opening stays
+        cheap. Caller must hold the lock, shared or exclusive.
+        """
+        if self._indexes is None:
+            with self._indexes_build_lock:
+                if self._indexes is None:
+                    indexes = {}
+                    for field, kind in self._index_definitions.items():
+                        index = create_index(field, kind, fallback=True)
+                        index.build(self.store)
+                        indexes[field] = index
+                    self._indexes = indexes
+        return self._indexes
+
+    @property
+    def key_index(self):
+        """
+        The keys of the store in sorted order (see indexes.KeyIndex), for range
+        and prefix scans. Built on first use like the secondary indexes; lazy
+        stores yield their keys without decoding values. Caller must hold the
+        lock, shared or exclusive.
+        """
+        if self._key_index is None:
+            with self._indexes_build_lock:
+                if self._key_index is None:
+                    self._key_index = KeyIndex(self.store)
+        return self._key_index
+
+    def _save_indexes(self):
+        """Save the secondary index definitions next to the database file atomically."""
+        indexes_file = self._get_indexes_file()
+        temp_file = f"{indexes_file}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(self.list_indexes(), f, indent=4)
+        os.replace(temp_file, indexes_file)
+
+    def _reindex(self, key, record):
+        """Bring every secondary index up to date for a key; record is None when deleted."""
+        if self._indexes is None:
+            return
+        for index in self._indexes.values():
+            index.replace(key, record)
+
+    def create_index(self, field, kind='hash'):
+        """
+        Declare a secondary index on a top-level field.
+        'hash' indexes answer '=' and '!=' queries, 'sorted' indexes also answer
+        '>', '<', '>=' and '<='. 'column' indexes (which need NumPy) answer
+        numeric comparisons and aggregates with vectorized operations over a
+        column of the field's numbers. The definition is persisted and the
+        index is rebuilt whenever the database is opened.
+        """
+        self._check_writable()
+        with self.exclusive():
+            self.refresh()
+            with self.lock.write_lock():
+                if field in self._index_definitions:
+                    raise KeyError(f"Index on field '{field}' already exists.")
+                index = create_index(field, kind)
+                if self._indexes is not None:
+                    index.build(self.store)
+                    self._indexes[field] = index
+                self._index_definitions[field] = kind
+                self._save_indexes()
+                self._publish()
+
+    def drop_index(self, field):
+        """Remove the secondary index on a field."""
+        self._check_writable()
+        with self.exclusive():
+            self.refresh()
+            with self.lock.write_lock():
+                if field not in self._index_definitions:
+                    raise KeyError(f"Index on field '{field}' does not exist.")
+                del self._index_definitions[field]
+                if self._indexes is not None:
+                    del self._indexes[field]
+                self._save_indexes()
+                self._publish()
+
+    def list_indexes(self):
+        """Return a mapping of indexed field to index kind."""
+        return dict(self._index_definitions)
 
     def _load_data(self):
-        """Load data from the JSON file into the in-memory store."""
+        """
+        Load data from the database file into the in-memory store, then replay
+        any write-ahead log records written since the last checkpoint.
+        """
         if os.path.exists(self.db_file):
-            with open(self.db_file, 'r') as f:
-                try:
-                    self.store = json.load(f)
-                except json.JSONDecodeError:
-                    self.store = {}
+            if self.lazy:
+                self.store = self.format.open_lazy(self.db_file, self.cache)
+            else:
+                self.store = self.format.load(self.db_file)
         else:
             self.store = {}
+        expiries = {}
+        if os.path.exists(self._get_ttl_file()):
+            with open(self._get_ttl_file(), 'r') as f:
+                expiries = json.load(f)
+        # A read-only engine leaves a torn last record alone: its writer may still be appending it.
+        self.wal.replay(self.store, expiries, repair=not self.read_only)
+        self.expiries = {key: expires for key, expires in expiries.items() if key in self.store}
+        self._expiry_heap = [(expires, key) for key, expires in self.expiries.items()]
+        heapq.heapify(self._expiry_heap)
+        self._key_index = None
 
     def _save_data(self):
-        """Save the in-memory store to the JSON file atomically."""
-        dir_name = os.path.dirname(self.db_file)
-        temp_file = os.path.join(dir_name, 'temp.json')
-        with open(temp_file, 'w') as f:
-            json.dump(self.store, f, indent=4)
+        """
+        Save the in-memory store to the database file atomically and return the
+        version it contains. The store is serialized under the read lock and
+        written to disk after releasing it, so readers never wait for the I/O.
+        """
+        with self.lock.read_lock():
+            data = self.format.dumps(self.store)
+            expiries = json.dumps(self.expiries) if self.expiries else None
+            version = self.version
+        # Named after the database, so that databases saving at once do not clobber each other.
+        temp_file = f"{self.db_file}.tmp"
+        with open(temp_file, 'wb') as f:
+            f.write(data)
+            if self.durability != 'none':
+                f.flush()
+                os.fsync(f.fileno())
         os.replace(temp_file, self.db_file)
+        # Written after the data: a log being checkpointed is only reset
+        # afterwards, so after a crash its replay restores the expiry times.
+        self._save_expiries(expiries)
+        if self.durability != 'none':
+            fsync_directory(os.path.dirname(os.path.abspath(self.db_file)))
+        if metrics.enabled:
+            metrics.inc('nosql_persist_bytes_total', len(data), db=self.name, kind='snapshot')
+        if isinstance(self.store, LazyStore):
+            # Map the new file so that writes held in memory can be released;
+            # if the store changed meanwhile the old mapping stays valid. The
+            # cached values carry over: written keys were invalidated.
+            with self.lock.write_lock():
+                if self.version == version:
+                    self.store = self.format.open_lazy(self.db_file, self.cache)
+        return version
+
+    def _save_expiries(self, data):
+        """Replace the saved key expiry times with JSON data, or remove them if None."""
+        ttl_file = self._get_ttl_file()
+        if data is None:
+            if os.path.exists(ttl_file):
+                os.remove(ttl_file)
+            return
+        temp_file = f"{ttl_file}.tmp"
+        with open(temp_file, 'w') as f:
+            f.write(data)
+            if self.durability != 'none':
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_file, ttl_file)
+
+    def _set_expiry(self, key, expires):
+        """Record when a key expires (a Unix time), or None if it never does. Caller must hold the write lock."""
+        if expires is None:
+            if self.expiries:
+                self.expiries.pop(key, None)
+            return
+        self.expiries[key] = expires
+        heap = self._expiry_heap
+        heapq.heappush(heap, (expires, key))
+        if len(heap) > 2 * len(self.expiries) + EXPIRE_BATCH:
+            # Rewritten and deleted keys leave stale entries behind; drop them.
+            heap[:] = [(expires, key) for key, expires in self.expiries.items()]
+            heapq.heapify(heap)
+        if heap[0] == (expires, key):
+            self._wake_expirer()
+
+    def expired(self, key, now=None):
+        """Check whether a key's time to live has passed; it reads as absent until the expirer deletes it."""
+        expires = self.expiries.get(key)
+        return expires is not None and expires <= (time.time() if now is None else now)
+
+    def expire_keys(self):
+        """
+        Delete the keys whose time to live has passed, up to EXPIRE_BATCH keys
+        per write, and return how many were deleted. Run by the expirer.
+        """
+        deleted = 0
+        while True:
+            with self.exclusive():
+                self.refresh()
+                with self.lock.write_lock():
+                    now = time.time()
+                    heap = self._expiry_heap
+                    due = []
+                    while heap and heap[0][0] <= now and len(due) < EXPIRE_BATCH:
+                        expires, key = heapq.heappop(heap)
+                        # Entries of keys rewritten or deleted since are stale.
+                        if self.expiries.get(key) == expires and key in self.store:
+                            due.append(key)
+                    version = self.apply([{'op': 'del', 'key': key} for key in due]) if due else None
+                self.persist(version)
+            deleted += len(due)
+            if len(due) < EXPIRE_BATCH:
+                break
+        if deleted:
+            self.expired_count += deleted
+            if metrics.enabled:
+                metrics.inc('nosql_expired_keys_total', deleted, db=self.name)
+        return deleted
+
+    def next_expiry(self):
+        """Return the earliest expiry time (Unix time) of a key, or None."""
+        with self.lock.read_lock():
+            return self._expiry_heap[0][0] if self._expiry_heap else None
+
+    def _wake_expirer(self):
+        """Start the expirer, or wake it to reconsider the earliest expiry."""
+        if self.read_only or not self.expire_in_background:
+            # Expired keys read as absent anyway; the writer of the file deletes them.
+            return
+        if self._expirer_stop is None:
+            self._expirer_stop = threading.Event()
+            self._expiry_wake = threading.Event()
+            thread = threading.Thread(
+                target=_expire_loop,
+                args=(weakref.ref(self), self._expirer_stop, self._expiry_wake),
+                daemon=True,
+            )
+            thread.start()
+        else:
+            self._expiry_wake.set()
+
+    def apply(self, records):
+        """
+        Apply committed 'set'/'del' records to the store and indexes and stage
+        them for persistence. Caller must hold the write lock and then call
+        persist() with the returned version once the lock is released.
+        """
+        self._check_writable()
+        changes = [] if self.feed_enabled else None
+        for record in records:
+            key = record['key']
+            if record['op'] == 'set':
+                if changes is not None:
+                    exists = key in self.store and not self.expired(key)
+                    change = {'op': 'update' if exists else 'create', 'key': key, 'value': record['value']}
+                    if record.get('expires') is not None:
+                        change['expires'] = record['expires']
+                    changes.append(change)
+                self.store[key] = record['value']
+                self._reindex(key, record['value'])
+                if self._key_index is not None:
+                    self._key_index.add(key)
+                self._set_expiry(key, record.get('expires'))
+            else:
+                if changes is not None:
+                    changes.append({'op': 'delete', 'key': key})
+                del self.store[key]
+                self._reindex(key, None)
+                if self._key_index is not None:
+                    self._key_index.discard(key)
+                self._set_expiry(key, None)
+        if records:
+            self.version += 1
+            entry = None
+            if self.storage_mode == 'wal':
+                entry = records[0] if len(records) == 1 else {'op': 'batch', 'ops': records}
+            event = None
+            if changes is not None:
+                self.sequence += 1
+                event = {'seq': self.sequence, 'time': time.time(), 'changes': changes}
+            with self._pending_lock:
+                if entry is not None:
+                    self._pending.append((self.version, entry))
+                if event is not None:
+                    self._feed_pending.append((self.version, event))
+        return self.version
+
+    def persist(self, version):
+        """
+        Make committed mutations durable up to `version` as the durability mode
+        requires: immediately, or in 'async' mode by the background flusher
+        (woken early once flush_writes writes are waiting).
+        """
+        if version is None:
+            return
+        if self.durability == 'async':
+            if version - self.persisted_version >= self.flush_writes:
+                self._flush_wake.set()
+            return
+        self._flush(version)
+
+    def flush(self):
+        """Persist every mutation committed so far, whatever the durability mode."""
+        self._flush(self.version)
+
+    def _flush(self, version):
+        """
+        Persist committed mutations up to at least `version`. In 'wal' mode the
+        staged records are appended to the log; in 'snapshot' mode the whole
+        store is rewritten (and any log left over from a previous 'wal' session
+        is folded in). Either way one flush covers every mutation applied so
+        far, so writers that were queued behind another thread's flush find
+        their version persisted and return without touching the disk.
+        """
+        if self.read_only:
+            return
+        with self.io_lock:
+            if self.persisted_version >= version:
+                return
+            if metrics.enabled:
+                metrics.inc('nosql_flushes_total', db=self.name, kind=self.storage_mode)
+            if self.storage_mode == 'wal':
+                with self._pending_lock:
+                    pending, self._pending = self._pending, []
+                if pending:
+                    if self.process_lock is not None:
+                        self.wal.reopen_if_replaced()
+                        # Records after the log position we caught up to are torn ones of a crashed process.
+                        self.wal.truncate(self._wal_offset)
+                    written = self.wal.append([entry for _, entry in pending])
+                    if self.durability == 'async':
+                        self.wal.sync()
+                    if metrics.enabled:
+                        metrics.inc('nosql_persist_bytes_total', written, db=self.name, kind='wal')
+                    self.persisted_version = pending[-1][0]
+                    self._publish()
+                    self._wal_offset = self.wal.size()
+                if self.wal.size() >= self.checkpoint_bytes:
+                    self._checkpoint()
+            else:
+                self.persisted_version = self._save_data()
+                if os.path.exists(self.wal.path):
+                    self.wal.close()
+                    os.remove(self.wal.path)
+                self._publish(rewritten=True)
+                # A log started by another process after this rewrite is read from its beginning.
+                self._wal_offset = 0
+            self._write_feed()
+
+    def _checkpoint(self):
+        """Compact the write-ahead log into a new snapshot. Caller must hold the I/O lock."""
+        self.wal.sync()
+        version = self._save_data()
+        self.wal.reset()
+        # Staged records already contained in the snapshot need not be logged.
+        with self._pending_lock:
+            self._pending = [(v, entry) for v, entry in self._pending if v > version]
+        self.persisted_version = max(self.persisted_version, version)
+        self._publish(rewritten=True)
+        self._wal_offset = 0
+        self._write_feed()
+
+    def checkpoint(self):
+        """Write a new snapshot and truncate the write-ahead log."""
+        self._check_writable()
+        with self.exclusive():
+            self.refresh()
+            with self.io_lock:
+                self._checkpoint()
+
+    def _start_checkpointer(self, interval):
+        """Start a daemon thread that periodically checkpoints the log."""
+        self._checkpoint_stop = threading.Event()
+        thread = threading.Thread(
+            target=_checkpoint_loop,
+            args=(weakref.ref(self), self._checkpoint_stop, interval),
+            daemon=True,
+        )
+        thread.start()
+
+    def snapshot_view(self):
+        """
+        Return (view, expiries, version): a point-in-time copy of the store
+        and the key expiry times that later writes do not affect. Only the
+        dicts (or the lazy store's in-memory writes) are copied, under the
+        read lock; values are shared, which is safe because writes replace
+        values rather than modify them.
+        """
+        self.refresh()
+        with self.lock.read_lock():
+            return self.store.copy(), dict(self.expiries), self.version
+
+    def snapshot(self, path, compress=False, since=None):
+        """
+        Write a consistent point-in-time backup of the database to path (see
+        backup.py) and return its header. The store is copied under the read
+        lock and streamed to disk after releasing it, so writers are only
+        held off for the copy. With since, a backup chain (a full backup
+        and the incremental backups after it, in order), only the records
+        changed since the last backup of the chain are written.
+        """
+        base = None
+        if since:
+            base, digests = chain_digests(since)
+        view, expiries, version = self.snapshot_view()
+        fields = {'db_version': version, 'indexes': self.list_indexes()}
+        now = time.time()
+        # Keys that expired but were not deleted yet are left out.
+        entries = ((key, value, expiries.get(key)) for key, value in view.items()
+                   if not expiries.get(key, now + 1) <= now)
+        if base is None:
+            header = new_header(self.name, 'full', **fields)
+        else:
+            header = new_header(self.name, 'incremental', base['id'], **fields)
+            entries = changed_entries(entries, digests)
+        return write_backup(path, header, entries, compress)
+
+    def _start_flusher(self, interval):
+        """Start a daemon thread that flushes 'async' writes, and flush them at exit."""
+        self._flush_stop = threading.Event()
+        self._flush_wake = threading.Event()
+        engine_ref = weakref.ref(self)
+        thread = threading.Thread(
+            target=_flush_loop,
+            args=(engine_ref, self._flush_stop, self._flush_wake, interval),
+            daemon=True,
+        )
+        thread.start()
+        atexit.register(_flush_at_exit, engine_ref)
+
+    def stats(self):
+        """Return a summary of the database: record count, on-disk sizes and configuration."""
+        self.refresh()
+        return {
+            'records': len(self.store),
+            'file_bytes': os.path.getsize(self.db_file) if os.path.exists(self.db_file) else 0,
+            'wal_bytes': self.wal.size(),
+            'format': self.format.name,
+            'storage_mode': self.storage_mode,
+            'durability': self.durability,
+            'unflushed_writes': self.version - self.persisted_version,
+            'lazy': isinstance(self.store, LazyStore),
+            'cache': self.cache.stats() if self.cache is not None else None,
+            'multiprocess': self.process_lock is not None,
+            'change_feed': self.sequence if self.feed_enabled else None,
+            'expiring_keys': len(self.expiries),
+            'expired_keys': self.expired_count,
+            'indexes': self.list_indexes(),
+            'version': self.version,
+        }
+
+    def estimated_size(self):
+        """Estimate the memory held by this database from its on-disk size."""
+        size = self.wal.size()
+        if os.path.exists(self.db_file):
+            size += os.path.getsize(self.db_file)
+        return size
+
+    def close(self):
+        """Stop the background threads, flush pending writes and the write-ahead log."""
+        if self._checkpoint_stop is not None:
+            self._checkpoint_stop.set()
+            self._checkpoint_stop = None
+        if self._flush_stop is not None:
+            self._flush_stop.set()
+            self._flush_wake.set()
+            self._flush_stop = None
+        if self._expirer_stop is not None:
+            self._expirer_stop.set()
+            self._expiry_wake.set()
+            self._expirer_stop = None
+        if self.read_only:
+            self.wal.close()
+            if self.process_lock is not None:
+                self.process_lock.close()
+            return
+        with self.exclusive():
+            self.refresh()
+            self.flush()
+            with self.io_lock:
+                if self.storage_mode == 'wal' and (self._pending or self.wal.size() > 0):
+                    self._checkpoint()
+                self.wal.close()
+            self.feed.close()
+        if self.process_lock is not None:
+            self.process_lock.close()
+
+class SimpleNoSQLDB:
+    def __init__(self, db_file, in_transaction=False, transaction_store=None,
+                 storage_mode='snapshot', sync_every=1, checkpoint_interval=None,
+                 checkpoint_bytes=16 * 1024 * 1024, engine=None, lazy=False, durability='sync',
+                 cache_bytes=None, multiprocess=False, read_only=False):
+        """
+        Initialize the SimpleNoSQLDB with the specified database file and transaction state.
+
+        The storage options are described on DatabaseEngine. When an engine is
+        given (as DatabaseManager does) the handle shares its store and lock
+        instead of loading the file again.
+        """
+        if engine is None:
+            engine = DatabaseEngine(db_file, storage_mode, sync_every, checkpoint_interval, checkpoint_bytes,
+                                    lazy=lazy, durability=durability, cache_bytes=cache_bytes,
+                                    multiprocess=multiprocess, read_only=read_only)
+            self._owns_engine = True
+        else:
+            self._owns_engine = False
+        self.engine = engine
+        self.db_file = engine.db_file
+        engine.handles.add(self)
+        self.in_transaction = in_transaction
+        if in_transaction:
+            # transaction_store holds the pending write set, either as a
+            # TransactionOverlay or in the dict form returned by to_dict().
+            if transaction_store is None:
+                transaction_store = TransactionOverlay()
+            self.transaction_store = TransactionOverlay.from_dict(transaction_store)
+        else:
+            self.transaction_store = None
+
+    @property
+    def store(self):
+        """The committed in-memory store shared by all handles."""
+        return self.engine.store
+
+    @property
+    def lock(self):
+        """The lock shared by all handles on this database."""
+        return self.engine.lock
+
+    @property
+    def indexes(self):
+        """The secondary indexes of this database, keyed by field."""
+        return self.engine.indexes
+
+    @property
+    def wal(self):
+        """The write-ahead log of this database."""
+        return self.engine.wal
+
+    def create_index(self, field, kind='hash'):
+        """Declare a secondary index on a top-level field (see DatabaseEngine.create_index)."""
+        self.engine.create_index(field, kind)
+
+    def drop_index(self, field):
+        """Remove the secondary index on a field."""
+        self.engine.drop_index(field)
+
+    def list_indexes(self):
+        """Return a mapping of indexed field to index kind."""
+        self.engine.refresh()
+        return self.engine.list_indexes()
+
+    def checkpoint(self):
+        """Write a new snapshot and truncate the write-ahead log."""
+        self.engine.checkpoint()
+
+    def flush(self):
+        """Persist every committed write now, e.g. before relying on it with 'async' durability."""
+        self.engine.flush()
+
+    def snapshot(self, path, compress=False, since=None):
+        """Write a point-in-time backup of the committed data (see DatabaseEngine.snapshot)."""
+        return self.engine.snapshot(path, compress, since)
+
+    def expire_keys(self):
+        """Delete the keys whose time to live has passed now rather than waiting for the expirer; returns how many."""
+        return self.engine.expire_keys()
+
+    def enable_change_feed(self):
+        """Start recording committed writes in the change feed; returns its last sequence number."""
+        return self.engine.enable_change_feed()
+
+    def disable_change_feed(self):
+        """Stop recording committed writes and discard the change feed."""
+        self.engine.disable_change_feed()
+
+    def watch(self, since=None, timeout=None, poll_interval=0.5):
+        """
+        Iterate over committed writes as change feed events
+        {'seq': n, 'time': t, 'changes': [{'op': 'create'|'update'|'delete', 'key': k, 'value': v}]},
+        one per write, batch or transaction, with consecutive sequence numbers.
+        Yields the events after `since` (None: from now on), then follows new
+        ones; see DatabaseEngine.watch. Pass the last seq seen as `since` to
+        resume without missing or repeating a change.
+        """
+        return self.engine.watch(since, timeout, poll_interval)
+
+    def stats(self):
+        """Return a summary of the database (see DatabaseEngine.stats)."""
+        return self.engine.stats()
+
+    def close(self):
+        """Close the database if this handle opened it; shared engines are closed by their registry."""
+        if self._owns_engine:
+            self.engine.close()
+
+    def _locked(self, op, write=True):
+        """
+        Return the lock context for an operation, timed when metrics are
+        enabled, after catching up with changes made by other processes.
+        """
+        self.engine.refresh()
+        context = self.lock.write_lock() if write else self.lock.read_lock()
+        if metrics.enabled:
+            return OperationTimer(metrics, context, self.engine.name, op)
+        return context
+
+    def _persist(self, op, version):
+        """Persist the writes of an operation, timing the I/O when metrics are enabled."""
+        if not metrics.enabled or version is None:
+            self.engine.persist(version)
+            return
+        start = time.perf_counter()
+        self.engine.persist(version)
+        metrics.observe('nosql_operation_seconds', time.perf_counter() - start, db=self.engine.name,
+                        op=op, phase='io')
 
     def begin_transaction(self):
         """Begin a new transaction."""
-        with self.lock:
+        with self._locked('begin'):
             if not self.in_transaction:
                 self.in_transaction = True
-                self.transaction_store = copy.deepcopy(self.store)
+                self.transaction_store = TransactionOverlay()
             else:
                 raise Exception("Transaction already in progress.")
 
     def commit(self):
-        """Commit the current transaction."""
-        with self.lock:
-            if self.in_transaction:
-                self.store = self.transaction_store
-                self._save_data()
-                self.transaction_store = None
-                self.in_transaction = False
-            else:
-                raise Exception("No transaction in progress.")
+        """Commit the current transaction, applying only the keys it touched."""
+        with self.engine.exclusive():
+            with self._locked('commit'):
+                if self.in_transaction:
+                    records = self.transaction_store.records(self.store)
+                    version = self.engine.apply(records)
+                    self.transaction_store = None
+                    self.in_transaction = False
+                else:
+                    raise Exception("No transaction in progress.")
+            self._persist('commit', version)
+        if metrics.enabled:
+            metrics.observe('nosql_transaction_records', len(records), db=self.engine.name)
 
     def rollback(self):
         """Rollback the current transaction."""
-        with self.lock:
+        with self._locked('rollback'):
             if self.in_transaction:
                 self.transaction_store = None
                 self.in_transaction = False
             else:
                 raise Exception("No transaction in progress.")
 
-    def create(self, key, value):
-        """Create a new key-value pair in the database."""
-        with self.lock:
-            target_store = self.transaction_store if self.in_transaction else self.store
-            if key in target_store:
-                raise KeyError(f"Key '{key}' already exists.")
-            target_store[key] = value
-            if not self.in_transaction:
-                self._save_data()
+    def _contains(self, key):
+        """Check whether a key exists in the current view. Caller must hold the lock."""
+        if self.in_transaction:
+            overlay = self.transaction_store
+            if not overlay.touches(key) and self.engine.expired(key):
+                return False
+            return overlay.contains(self.store, key)
+        return key in self.store and not self.engine.expired(key)
+
+    def _put(self, key, value, expires=None):
+        """
+        Write a key, expiring at Unix time `expires` if given, to the
+        transaction overlay or the committed store. Caller must hold the write
+        lock and pass the returned version (None inside a transaction) to
+        engine.persist() after releasing it.
+        """
+        if self.in_transaction:
+            self.transaction_store.put(key, value, expires)
+            return None
+        return self.engine.apply([_set_record(key, value, expires)])
+
+    def create(self, key, value, ttl=None):
+        """
+        Create a new key-value pair in the database. With ttl (seconds) the
+        key reads as absent once that time has passed and is deleted soon
+        after. A key that expired can be created again.
+        """
+        _check_key(key)
+        expires = _expires_at(ttl)
+        with self.engine.exclusive():
+            with self._locked('create'):
+                if self._contains(key):
+                    raise KeyError(f"Key '{key}' already exists.")
+                version = self._put(key, value, expires)
+            self._persist('create', version)
 
     def read(self, key):
         """Read the value associated with a key."""
-        with self.lock:
-            target_store = self.transaction_store if self.in_transaction else self.store
-            return target_store.get(key, None)
+        if not self.in_transaction:
+            # A single dict lookup is atomic, so point reads of committed data
+            # need no lock and never wait behind writers.
+            self.engine.refresh()
+            if not metrics.enabled:
+                return self._read_committed(key)
+            start = time.perf_counter()
+            value = self._read_committed(key)
+            metrics.observe('nosql_operation_seconds', time.perf_counter() - start, db=self.engine.name,
+                            op='read', phase='execute')
+            metrics.inc('nosql_operations_total', db=self.engine.name, op='read')
+            return value
+        with self._locked('read', write=False):
+            if not self.transaction_store.touches(key) and self.engine.expired(key):
+                return None
+            return self.transaction_store.get(self.store, key)
 
-    def update(self, key, value):
-        """Update the value of an existing key."""
-        with self.lock:
-            target_store = self.transaction_store if self.in_transaction else self.store
-            if key not in target_store:
+    def _read_committed(self, key):
+        """Read a key of the committed store, None if it is missing or expired."""
+        if self.engine.expiries and self.engine.expired(key):
+            return None
+        return self.store.get(key, None)
+
+    def ttl(self, key):
+        """Return the seconds a key has left to live, or None if it never expires."""
+        with self._locked('ttl', write=False):
+            if not self._contains(key):
                 raise KeyError(f"Key '{key}' does not exist.")
-            target_store[key] = value
-            if not self.in_transaction:
-                self._save_data()
+            if self.in_transaction and self.transaction_store.touches(key):
+                expires = self.transaction_store.expires.get(key)
+            else:
+                expires = self.engine.expiries.get(key)
+        return None if expires is None else max(expires - time.time(), 0)
+
+    def update(self, key, value, ttl=None):
+        """
+        Update the value of an existing key. Like every write, this replaces
+        the key's time to live: with ttl (seconds) it expires that much later,
+        without it never.
+        """
+        _check_key(key)
+        expires = _expires_at(ttl)
+        with self.engine.exclusive():
+            with self._locked('update'):
+                if not self._contains(key):
+                    raise KeyError(f"Key '{key}' does not exist.")
+                version = self._put(key, value, expires)
+            self._persist('update', version)
+
+    def put(self, key, value, ttl=None):
+        """Create or update a key, with a time to live as in update; returns True if the key was created."""
+        _check_key(key)
+        expires = _expires_at(ttl)
+        with self.engine.exclusive():
+            with self._locked('put'):
+                created = not self._contains(key)
+                version = self._put(key, value, expires)
+            self._persist('put', version)
+        return created
 
     def delete(self, key):
         """Delete a key-value pair from the database."""
-        with self.lock:
-            target_store = self.transaction_store if self.in_transaction else self.store
-            if key in target_store:
-                del target_store[key]
-                if not self.in_transaction:
-                    self._save_data()
-            else:
-                raise KeyError(f"Key '{key}' does not exist.")
+        with self.engine.exclusive():
+            with self._locked('delete'):
+                if not self._contains(key):
+                    raise KeyError(f"Key '{key}' does not exist.")
+                if self.in_transaction:
+                    self.transaction_store.delete(key)
+                    version = None
+                else:
+                    version = self.engine.apply([{'op': 'del', 'key': key}])
+            self._persist('delete', version)
+
+    def write_batch(self, operations):
+        """
+        Apply many operations atomically under one lock acquisition with a single persist.
+        Each operation is a dict {'op': 'create'|'update'|'put'|'delete', 'key': ..., 'value': ...},
+        optionally with a 'ttl' in seconds (see create).
+        The whole batch is validated first (later operations see the effect of
+        earlier ones); if any operation fails nothing is applied, and the
+        KeyError or ValueError raised carries the failing operation's position
+        in its `index` attribute. Returns the number of operations applied.
+        """
+        with self.engine.exclusive():
+            with self._locked('write_batch'):
+                pending = {}
+                for index, operation in enumerate(operations):
+                    try:
+                        self._check_operation(operation, pending)
+                    except (KeyError, ValueError) as e:
+                        e.index = index
+                        raise
+                    pending[operation['key']] = _pending_entry(operation)
+                version = self._apply_pending(pending)
+            self._persist('write_batch', version)
+        return len(operations)
+
+    def apply_operations(self, operations):
+        """
+        Apply many independent operations (in the write_batch format) under
+        one lock acquisition with a single persist. Unlike write_batch, each
+        operation succeeds or fails on its own: returns a list holding, for
+        each operation, its result (whether the key was created for 'put',
+        None otherwise) or the KeyError/ValueError it raised.
+        """
+        results = []
+        with self.engine.exclusive():
+            with self._locked('apply_operations'):
+                pending = {}
+                for operation in operations:
+                    try:
+                        exists = self._check_operation(operation, pending)
+                    except (KeyError, ValueError) as e:
+                        results.append(e)
+                        continue
+                    pending[operation['key']] = _pending_entry(operation)
+                    results.append(not exists if operation['op'] == 'put' else None)
+                version = self._apply_pending(pending)
+            self._persist('apply_operations', version)
+        return results
+
+    def _check_operation(self, operation, pending):
+        """
+        Validate a batch operation against the current view as changed by the
+        earlier operations in pending; returns whether its key exists.
+        Caller must hold the lock.
+        """
+        if not isinstance(operation, dict) or operation.get('op') not in BATCH_OPERATIONS or 'key' not in operation:
+            raise ValueError(f"Invalid batch operation {operation!r}: expected 'op' in {BATCH_OPERATIONS} and a 'key'.")
+        op = operation['op']
+        key = operation['key']
+        _check_key(key)
+        if op != 'delete' and 'value' not in operation:
+            raise ValueError(f"Operation '{op}' on key '{key}' requires a 'value'.")
+        _expires_at(operation.get('ttl'))
+        if key in pending:
+            exists = pending[key] is not _DELETED
+        else:
+            exists = self._contains(key)
+        if op == 'create' and exists:
+            raise KeyError(f"Key '{key}' already exists.")
+        if op in ('update', 'delete') and not exists:
+            raise KeyError(f"Key '{key}' does not exist.")
+        return exists
+
+    def _apply_pending(self, pending):
+        """
+        Apply validated changes (key to (value, expiry time), or _DELETED) to
+        the transaction overlay or the committed store. Caller must hold the
+        write lock and persist the returned version (None inside a transaction).
+        """
+        if self.in_transaction:
+            for key, entry in pending.items():
+                if entry is _DELETED:
+                    self.transaction_store.delete(key)
+                else:
+                    self.transaction_store.put(key, *entry)
+            return None
+        records = []
+        for key, entry in pending.items():
+            if entry is not _DELETED:
+                records.append(_set_record(key, *entry))
+            elif key in self.store:
+                records.append({'op': 'del', 'key': key})
+        return self.engine.apply(records)
+
+    def bulk_create(self, records):
+        """Create many key-value pairs (a dict or (key, value) pairs) with a single persist."""
+        items = records.items() if isinstance(records, dict) else records
+        return self.write_batch([{'op': 'create', 'key': key, 'value': value} for key, value in items])
 
     def list_keys(self):
         """List all keys in the database."""
-        with self.lock:
-            target_store = self.transaction_store if self.in_transaction else self.store
-            return list(target_store.keys())
+        with self._locked('list_keys', write=False):
+            if self.in_transaction:
+                return list(self._unexpired(self.transaction_store.keys(self.store)))
+            return list(self._unexpired(self.store.keys()))
+
+    def scan(self, start=None, end=None, reverse=False, after=None, limit=None, page_size=1000):
+        """
+        Iterate over the (key, value) pairs with start <= key < end (None for
+        no bound) in key order, or in descending order with reverse=True.
+        after is a cursor, the last key already seen in the scan's direction.
+        Backed by the ordered key index, so k pairs cost O(log n + k) rather
+        than a pass over every record; pages are fetched as in iter_items.
+        """
+        fetch_page = self._range_page(start, end, None, reverse, values=True)
+        return self._paged(fetch_page, None, after, limit, page_size)
+
+    def scan_prefix(self, prefix, reverse=False, after=None, limit=None, page_size=1000):
+        """Iterate over the (key, value) pairs whose key starts with prefix (see scan)."""
+        fetch_page = self._prefix_page(prefix, reverse, values=True)
+        return self._paged(fetch_page, None, after, limit, page_size)
+
+    def keys_page(self, prefix=None, after=None, limit=100):
+        """
+        Return one page of keys in key order as (keys, next_cursor).
+        Pass next_cursor as `after` to fetch the following page; it is None on
+        the last page. Pages are stable under concurrent writes because the
+        cursor is a key rather than an offset.
+        """
+        if limit < 1:
+            raise ValueError("Page limit must be at least 1.")
+        keys = list(self.iter_keys(prefix, after, limit + 1))
+        if len(keys) > limit:
+            return keys[:limit], keys[limit - 1]
+        return keys, None
+
+    def iter_keys(self, prefix=None, after=None, limit=None, page_size=1000):
+        """Iterate over keys in key order, optionally only those starting with prefix or after a cursor key."""
+        # Values are never read, so lazy stores decode nothing.
+        for key, _ in self._paged(self._prefix_page(prefix, values=False), None, after, limit, page_size):
+            yield key
+
+    def iter_items(self, prefix=None, after=None, limit=None, page_size=1000):
+        """Iterate over (key, value) pairs in key order (see iter_keys)."""
+        return self._paged(self._prefix_page(prefix, values=True), None, after, limit, page_size)
+
+    def iter_query(self, field, operator, value, after=None, limit=None, page_size=1000):
+        """Iterate over (key, record) pairs matching a query (see query) in key order."""
+        return self.iter_find(condition(field, operator, value), after=after, limit=limit, page_size=page_size)
+
+    def iter_find(self, where=None, select=None, after=None, limit=None, page_size=1000):
+        """
+        Iterate over (key, record) pairs matching a predicate (see find) in key
+        order, page by page. Each page walks the key index on from the cursor
+        and stops at page_size matches, so an iteration reads every key once.
+        """
+        query = Query(where, select)
+        def fetch_page(_, after, count):
+            keys = self._iter_range_keys(None, None, None, False, after)
+            if self.in_transaction:
+                overlay = self.transaction_store
+                items = ((key, overlay.get(self.store, key)) for key in keys)
+            else:
+                items = ((key, self.store[key]) for key in keys)
+            return [(key, query.project(record)) for key, record in islice(query.filter(items), count)]
+        return self._paged(fetch_page, None, after, limit, page_size)
+
+    def _paged(self, fetch_page, prefix, after, limit, page_size):
+        """
+        Yield (key, value) pairs page by page. The lock is held only while a
+        page is fetched, so long iterations never block writers, and memory
+        stays bounded by page_size.
+        """
+        remaining = limit
+        while remaining is None or remaining > 0:
+            count = page_size if remaining is None else min(page_size, remaining)
+            with self._locked('page', write=False):
+                page = fetch_page(prefix, after, count)
+            yield from page
+            if len(page) < count:
+                return
+            after = page[-1][0]
+            if remaining is not None:
+                remaining -= len(page)
+
+    def _prefix_page(self, prefix, reverse=False, values=True):
+        """Build a page fetcher for _paged over the keys starting with prefix (None for all keys)."""
+        if prefix is None:
+            return self._range_page(None, None, None, reverse, values)
+        bounds = _prefix_bounds(prefix)
+        if bounds is None:
+            if not isinstance(prefix, str):
+                raise ValueError("Key prefix must be a string.")
+            # No string bounds a prefix ending in U+10FFFF from above; filter instead.
+            return self._range_page(prefix, None, prefix, reverse, values)
+        return self._range_page(bounds[0], bounds[1], None, reverse, values)
+
+    def _range_page(self, start, end, prefix, reverse, values):
+        """
+        Build a page fetcher for _paged over the keys with start <= key < end
+        that start with prefix (None for no filter), reading values if asked;
+        pairs hold None otherwise.
+        """
+        def fetch_page(_, after, count):
+            keys = self._range_keys(start, end, prefix, reverse, after, count)
+            if not values:
+                return [(key, None) for key in keys]
+            if self.in_transaction:
+                overlay = self.transaction_store
+                return [(key, overlay.get(self.store, key)) for key in keys]
+            return [(key, self.store[key]) for key in keys]
+        return fetch_page
+
+    def _range_keys(self, low, high, prefix, reverse, after, count):
+        """Return up to `count` keys of _iter_range_keys. Caller must hold the lock."""
+        return list(islice(self._iter_range_keys(low, high, prefix, reverse, after), count))
+
+    def _iter_range_keys(self, low, high, prefix, reverse, after):
+        """
+        Lazily iterate over the keys of the current view with low <= key < high
+        that start with prefix (None for no filter), in the scan's direction,
+        after the cursor key if given. Caller must hold the lock.
+        """
+        low_inclusive = True
+        if after is not None:
+            # The cursor narrows the range: past it going up, before it going down.
+            if not reverse and (low is None or after >= low):
+                low, low_inclusive = after, False
+            elif reverse and (high is None or after < high):
+                high = after
+        keys = self._unexpired(self.engine.key_index.irange(low, high, reverse, low_inclusive))
+        if self.in_transaction:
+            overlay = self.transaction_store
+            keys = (key for key in keys if key not in overlay.deletes)
+            added = sorted((key for key in overlay.puts if key not in self.store
+                            and _in_range(key, low, high, low_inclusive)), reverse=reverse)
+            keys = heapq.merge(keys, added, reverse=reverse)
+        if prefix is not None:
+            keys = (key for key in keys if key.startswith(prefix))
+        return keys
+
+    def _view_items(self):
+        """Iterate over the (key, value) pairs of the current view. Caller must hold the lock."""
+        if self.in_transaction:
+            return self._unexpired(self.transaction_store.items(self.store), itemgetter(0))
+        return self._unexpired(self.store.items(), itemgetter(0))
+
+    def _unexpired(self, entries, key_of=None):
+        """
+        Leave out the entries (keys, or items with key_of) of committed keys
+        whose time to live has passed, unless the transaction rewrote them.
+        Caller must hold the lock.
+        """
+        expiries = self.engine.expiries
+        if not expiries:
+            return entries
+        now = time.time()
+        rewritten = self.transaction_store.puts if self.in_transaction else {}
+        def live(entry):
+            key = entry if key_of is None else key_of(entry)
+            return key in rewritten or not expiries.get(key, now + 1) <= now
+        return filter(live, entries)
 
     def query(self, field, operator, value):
         """
         Query the database for records where a field meets a condition.
-        Supported operators: '=', '!=', '>', '<', '>=', '<='.
+        Supported operators: '=', '!=', '>', '<', '>=', '<=', plus those of find().
         """
-        with self.lock:
-            target_store = self.transaction_store if self.in_transaction else self.store
-            results = {}
-            for key, record in target_store.items():
-                if isinstance(record, dict):
-                    record_value = record.get(field)
-                    if record_value is None:
-                        continue
-                    if self._compare(record_value, operator, value):
-                        results[key] = record
-                else:
-                    # Skip non-dict records for field-based queries
-                    continue
-            return results
+        return self.find(condition(field, operator, value))
+
+    def find(self, where=None, select=None, order_by=None, limit=None):
+        """
+        Return the records matching a predicate as an ordered dict of key to record.
+
+        where is a predicate spec (see query.compile_predicate): conditions
+        {'field': 'address.city', 'op': '=', 'value': 'Paris'} on (nested)
+        field paths with operators '=', '!=', '>', '<', '>=', '<=', 'in',
+        'prefix' and 'exists', combined with {'and': [...]}, {'or': [...]}
+        and {'not': ...}. select lists the field paths to return, order_by is
+        a field path or list of them ('-field' for descending) and limit caps
+        the number of results, keeping only the top ones in a heap.
+
+        The planner answers conditions from secondary indexes when it can,
+        using the most selective index of a conjunction; otherwise every
+        record is scanned. Inside a transaction the index answers for
+        committed keys and only the keys the transaction wrote are scanned.
+        Raises ValueError for malformed queries.
+        """
+        query = Query(where, select, order_by, limit)
+        with self._locked('query', write=False):
+            if not metrics.enabled:
+                return dict(query.run(self._matching_items(query)))
+            counts = {}
+            results = dict(query.run(self._matching_items(query, counts)))
+        labels = {'db': self.engine.name}
+        metrics.inc('nosql_queries_total', plan=counts['plan'], **labels)
+        metrics.inc('nosql_query_scanned_records_total', counts['scanned'], **labels)
+        metrics.inc('nosql_query_returned_records_total', len(results), **labels)
+        return results
+
+    def aggregate(self, aggregates, group_by=None, where=None):
+        """
+        Compute aggregates over the records matching a predicate (see find):
+        'count', 'count(field)', 'sum(field)', 'min(field)', 'max(field)' and
+        'avg(field)' on (nested) field paths, per group of group_by's value if
+        given (see aggregate.Aggregation for how values are read). Returns
+        {name: value}, or with group_by a list of rows {'group': value,
+        name: value, ...}.
+
+        The matching records are streamed through one pass under the read
+        lock, never copied. Without a predicate, aggregates over indexed
+        fields (and counts per group of an indexed field) are answered from
+        the indexes without reading records. Raises ValueError for malformed
+        aggregates or predicates.
+        """
+        aggregation = Aggregation(aggregates, group_by)
+        return aggregation.result(self.partial_aggregate(aggregates, group_by, where))
+
+    def partial_aggregate(self, aggregates, group_by=None, where=None):
+        """Aggregate as aggregate() does, returning the partial result that shards merge (see aggregate.Aggregation.run)."""
+        aggregation = Aggregation(aggregates, group_by)
+        query = Query(where)
+        with self._locked('aggregate', write=False):
+            # Transactions and keys past their time to live are not in the indexes' counts.
+            if where is None and not self.in_transaction and not self.engine.expiries:
+                groups = aggregation.from_indexes(self.indexes, len(self.store))
+                if groups is None:
+                    groups = aggregation.run(self.store.values())
+                return groups
+            return aggregation.run(record for _, record in self._matching_items(query))
+
+    def explain(self, where=None):
+        """Describe how find() would evaluate a predicate: an index lookup or a full scan."""
+        compile_predicate(where)
+        self.engine.refresh()
+        with self.lock.read_lock():
+            return describe_plan(where, self.indexes)
+
+    def _matching_items(self, query, counts=None):
+        """
+        Iterate over the (key, record) pairs matching a query's predicate.
+        Caller must hold the lock. If a counts dict is given, the plan used
+        ('index' or 'scan') and the number of records examined are stored in it.
+        """
+        keys, description = plan(query.where, self.indexes)
+        if keys is not None:
+            if counts is not None:
+                counts['plan'] = 'index'
+                counts['scanned'] = len(keys) + (len(self.transaction_store.puts) if self.in_transaction else 0)
+            if not self.in_transaction:
+                items = ((key, self.store[key]) for key in self._unexpired(keys))
+            else:
+                overlay = self.transaction_store
+                items = [(key, self.store[key]) for key in self._unexpired(keys) if not overlay.touches(key)]
+                items.extend(overlay.puts.items())
+        else:
+            items = self._view_items()
+            if counts is not None:
+                counts['plan'] = 'scan'
+                counts['scanned'] = 0
+                items = _counted(items, counts)
+        return query.filter(items)
 
     def _compare(self, record_value, operator, value):
-        """Helper method to compare values based on the operator."""
-        try:
-            # Attempt to convert both values to float for numerical comparisons
-            record_num = float(record_value)
-            value_num = float(value)
-            if operator == '=':
-                return record_num == value_num
-            elif operator == '!=':
-                return record_num != value_num
-            elif operator == '>':
-                return record_num > value_num
-            elif operator == '<':
-                return record_num < value_num
-            elif operator == '>=':
-                return record_num >= value_num
-            elif operator == '<=':
-                return record_num <= value_num
-        except (ValueError, TypeError):
-            # If conversion fails, fall back to string comparison
-            if operator == '=':
-                return str(record_value) == str(value)
-            elif operator == '!=':
-                return str(record_value) != str(value)
-            elif operator == '>':
-                return str(record_value) > str(value)
-            elif operator == '<':
-                return str(record_value) < str(value)
-            elif operator == '>=':
-                return str(record_value) >= str(value)
-            elif operator == '<=':
-                return str(record_value) <= str(value)
+        """Compare a record value with a query value (see query.compare)."""
+        return compare(record_value, operator, value)
+
+def _check_key(key):
+    """Raise ValueError unless a key is a string, as every storage format and the key index require."""
+    if not isinstance(key, str):
+        raise ValueError(f"Keys must be strings, not {type(key).__name__}: {key!r}.")
+
+def _expires_at(ttl):
+    """Turn a time to live in seconds into the Unix time the key expires at (None stays None)."""
+    if ttl is None:
+        return None
+    if isinstance(ttl, bool) or not isinstance(ttl, (int, float)) or not ttl > 0:
+        raise ValueError(f"Time to live must be a positive number of seconds, not {ttl!r}.")
+    return time.time() + ttl
+
+def _set_record(key, value, expires=None):
+    """Build the log record writing a key, expiring at Unix time `expires` if given."""
+    record = {'op': 'set', 'key': key, 'value': value}
+    if expires is not None:
+        record['expires'] = expires
+    return record
+
+def _pending_entry(operation):
+    """Turn a validated batch operation into its pending change (see _apply_pending)."""
+    if operation['op'] == 'delete':
+        return _DELETED
+    return operation['value'], _expires_at(operation.get('ttl'))
+
+def _counted(items, counts):
+    """Pass items through, counting them in counts['scanned']."""
+    for item in items:
+        counts['scanned'] += 1
+        yield item
+
+def _in_range(key, low, high, low_inclusive=True):
+    """Check low <= key < high (low < key without low_inclusive); None bounds are open."""
+    if low is not None and (key < low or (key == low and not low_inclusive)):
+        return False
+    return high is None or key < high
+
+def _checkpoint_loop(engine_ref, stop_event, interval):
+    """Background checkpointer body; holds only a weak reference to the engine."""
+    while not stop_event.wait(interval):
+        db = engine_ref()
+        if db is None:
+            return
+        with db.exclusive():
+            db.refresh()
+            with db.io_lock:
+                if db.wal.size() > 0:
+                    db._checkpoint()
+        del db
+
+def _expire_loop(engine_ref, stop_event, wake_event):
+    """Background expirer body; holds only a weak reference to the engine between rounds."""
+    while not stop_event.is_set():
+        db = engine_ref()
+        if db is None:
+            return
+        db.expire_keys()
+        next_expiry = db.next_expiry()
+        del db
+        delay = EXPIRE_POLL_INTERVAL
+        if next_expiry is not None:
+            delay = min(max(next_expiry - time.time(), 0), delay)
+        wake_event.wait(delay)
+        wake_event.clear()
+
+def _flush_loop(engine_ref, stop_event, wake_event, interval):
+    """Background flusher body for 'async' durability; holds only a weak reference to the engine."""
+    while not stop_event.is_set():
+        wake_event.wait(interval)
+        wake_event.clear()
+        db = engine_ref()
+        if db is None:
+            return
+        db.flush()
+        del db
+
+def _flush_at_exit(engine_ref):
+    """Flush an 'async' engine still open when the interpreter exits."""
+    db = engine_ref()
+    if db is not None:
+        db.flush()
+
+class DatabaseRegistry:
+    def __init__(self, max_databases=None, memory_budget=None):
+        """
+        Initialize a cache of open databases holding one DatabaseEngine (and so
+        one in-memory store and lock) per file. Idle engines, those without live
+        handles, are evicted least recently used first while more than
+        max_databases are open or their estimated size exceeds memory_budget bytes.
+        Evicted engines are flushed and closed after the registry lock is
+        released, so other databases open meanwhile; a file whose engine is
+        still closing is reopened once the close finished.
+        """
+        self.max_databases = max_databases
+        self.memory_budget = memory_budget
+        self.lock = threading.Lock()
+        self._engines = OrderedDict()
+        # Files whose evicted or discarded engine is being closed, with an event set when it is.
+        self._closing = {}
+
+    def open(self, db_file, in_transaction=False, transaction_store=None, **options):
+        """Return a new handle on the shared engine for a file, loading it on first use."""
+        path = os.path.abspath(db_file)
+        while True:
+            with self.lock:
+                closing = self._closing.get(path)
+                if closing is None:
+                    engine = self._engines.get(path)
+                    if engine is None:
+                        engine = DatabaseEngine(db_file, **options)
+                        self._engines[path] = engine
+                    else:
+                        self._engines.move_to_end(path)
+                    db = SimpleNoSQLDB(db_file, in_transaction, transaction_store, engine=engine)
+                    victims = self._evict()
+                    break
+            # Its last writes must be on disk before the file is loaded again.
+            closing.wait()
+        self._close(victims)
+        return db
+
+    def discard(self, db_file):
+        """Close and forget the engine for a file, if it is open."""
+        path = os.path.abspath(db_file)
+        with self.lock:
+            engine = self._engines.pop(path, None)
+            if engine is None:
+                return
+            self._closing[path] = threading.Event()
+        self._close([(path, engine)])
+
+    def stats(self):
+        """Return DatabaseEngine.stats() of every open database, keyed by database name."""
+        with self.lock:
+            engines = list(self._engines.values())
+        return {engine.name: engine.stats() for engine in engines}
+
+    def open_databases(self):
+        """List the files of the currently open databases, least recently used first."""
+        with self.lock:
+            return list(self._engines)
+
+    def _over_budget(self):
+        if self.max_databases is not None and len(self._engines) > self.max_databases:
+            return True
+        if self.memory_budget is not None:
+            return sum(engine.estimated_size() for engine in self._engines.values()) > self.memory_budget
         return False
 
+    def _evict(self):
+        """
+        Pick idle engines to evict until the registry fits its budget and
+        return them as (path, engine) pairs for _close. Caller must hold the lock.
+        """
+        victims = []
+        for path in list(self._engines):
+            if not self._over_budget():
+                break
+            engine = self._engines[path]
+            if not engine.handles:
+                del self._engines[path]
+                self._closing[path] = threading.Event()
+                victims.append((path, engine))
+        return victims
+
+    def _close(self, victims):
+        """Close engines removed from the registry. Caller must not hold the lock."""
+        try:
+            for _, engine in victims:
+                engine.close()
+        finally:
+            with self.lock:
+                closed = [self._closing.pop(path) for path, _ in victims]
+            for event in closed:
+                event.set()
+
+# Shared by every DatabaseManager unless one is given its own registry.
+default_registry = DatabaseRegistry()
+
 class DatabaseManager:
-    def __init__(self, databases_dir='../data/databases'):
+    def __init__(self, databases_dir='../data/databases', storage_mode='snapshot',
+                 sync_every=1, checkpoint_interval=None, max_open_databases=None,
+                 memory_budget=None, registry=None, storage_format='json', compress=False, lazy=False,
+                 durability='sync', flush_interval=1.0, shard_processes=None, cache_bytes=None,
+                 multiprocess=None, expire_in_background=True):
         """
         Initialize the DatabaseManager with the specified directory for databases.
+        New databases are created in storage_format ('json' or 'binary', the
+        latter optionally zlib-compressed); existing databases keep the format
+        of their file. lazy=True opens binary databases memory-mapped and
+        decodes records on access, and durability ('none', 'async' or 'sync')
+        with flush_interval sets when writes are fsynced, and cache_bytes bounds
+        the per-database cache of values decoded by lazy reads (see DatabaseEngine).
+        The storage options are used when a database is first opened. Open
+        databases are cached in the process-wide registry (or the given one);
+        max_open_databases and memory_budget (bytes) bound that cache. Given
+        without a registry, they get the manager a registry of its own, so
+        that they never change the limits of other managers.
+        Queries on sharded databases fan out to a pool of shard_processes
+        worker processes, or to threads when it is None (see ShardedNoSQLDB).
+        multiprocess makes databases safe to use from several processes at
+        once (see DatabaseEngine); by default it is on wherever the platform
+        supports it, unless durability is 'async'. expire_in_background=False
+        leaves expired keys to explicit expire_keys calls (see DatabaseEngine).
         """
         self.databases_dir = databases_dir
+        self.storage_mode = storage_mode
+        self.sync_every = sync_every
+        self.checkpoint_interval = checkpoint_interval
+        self.format = get_format(storage_format, compress)
+        self.lazy = lazy
+        self.durability = durability
+        self.flush_interval = flush_interval
+        self.shard_processes = shard_processes
+        self.cache_bytes = cache_bytes
+        if multiprocess is None:
+            multiprocess = FLOCK_AVAILABLE and durability != 'async'
+        self.multiprocess = multiprocess
+        self.expire_in_background = expire_in_background
+        if registry is None:
+            if max_open_databases is None and memory_budget is None:
+                registry = default_registry
+            else:
+                registry = DatabaseRegistry(max_open_databases, memory_budget)
+        else:
+            if max_open_databases is not None:
+                registry.max_databases = max_open_databases
+            if memory_budget is not None:
+                registry.memory_budget = memory_budget
+        self.registry = registry
         if not os.path.exists(self.databases_dir):
             os.makedirs(self.databases_dir)
 
-    def create_database(self, db_name):
+    def create_database(self, db_name, shards=None):
         """
-        Create a new database with the given name.
+        Create a new database with the given name. With shards=N (N > 1) the
+        database is hash-partitioned into N files (see ShardedNoSQLDB).
         """
         db_file = self._get_db_file(db_name)
-        if os.path.exists(db_file):
+        shards_dir = self._get_shards_dir(db_name)
+        if os.path.exists(db_file) or os.path.exists(shards_dir):
             raise FileExistsError(f"Database '{db_name}' already exists.")
-        with open(db_file, 'w') as f:
-            json.dump({}, f, indent=4)
+        if shards is not None and shards < 1:
+            raise ValueError("A database needs at least one shard.")
+        if shards is None or shards == 1:
+            with open(db_file, 'wb') as f:
+                f.write(self.format.dumps({}))
+            return
+        os.makedirs(shards_dir)
+        files = shard_file_names(db_name, shards, self.format.extension)
+        for name in files:
+            with open(os.path.join(shards_dir, name), 'wb') as f:
+                f.write(self.format.dumps({}))
+        write_manifest(shards_dir, files)
 
     def delete_database(self, db_name):
         """
         Delete the specified database.
         """
+        shards_dir = self._get_shards_dir(db_name)
+        if os.path.isdir(shards_dir):
+            for name in read_manifest(shards_dir)['files']:
+                self.registry.discard(os.path.join(shards_dir, name))
+            shutil.rmtree(shards_dir)
+            return
         db_file = self._get_db_file(db_name)
         if os.path.exists(db_file):
+            self.registry.discard(db_file)
             os.remove(db_file)
+            for suffix in SIDECAR_SUFFIXES:
+                sidecar_file = f"{db_file}{suffix}"
+                if os.path.exists(sidecar_file):
+                    os.remove(sidecar_file)
         else:
             raise FileNotFoundError(f"Database '{db_name}' does not exist.")
 
@@ -197,19 +1733,139 @@ class DatabaseManager:
         """
         List all existing databases.
         """
-        return [f[:-5] for f in os.listdir(self.databases_dir) if f.endswith('.json')]
+        names = []
+        for f in os.listdir(self.databases_dir):
+            name, extension = os.path.splitext(f)
+            if extension == SHARDS_SUFFIX and not os.path.isdir(os.path.join(self.databases_dir, f)):
+                continue
+            if (extension in EXTENSIONS or extension == SHARDS_SUFFIX) and name not in names:
+                names.append(name)
+        return names
 
     def get_db(self, db_name, in_transaction=False, transaction_store=None):
         """
-        Retrieve a SimpleNoSQLDB instance for the specified database with transaction state.
+        Retrieve a SimpleNoSQLDB handle for the specified database with transaction state.
+        The database is loaded from disk only the first time it is opened.
+        Sharded databases are returned as a ShardedNoSQLDB, which does not
+        support transactions.
         """
+        shards_dir = self._get_shards_dir(db_name)
+        if os.path.isdir(shards_dir):
+            if in_transaction:
+                raise ValueError("Transactions are not supported on sharded databases.")
+            shards = [self._open(os.path.join(shards_dir, name)) for name in read_manifest(shards_dir)['files']]
+            return ShardedNoSQLDB(db_name, shards, self.shard_processes)
         db_file = self._get_db_file(db_name)
         if not os.path.exists(db_file):
             raise FileNotFoundError(f"Database '{db_name}' does not exist.")
-        return SimpleNoSQLDB(db_file, in_transaction, transaction_store)
+        return self._open(db_file, in_transaction, transaction_store)
+
+    def _open(self, db_file, in_transaction=False, transaction_store=None):
+        """Open a handle on a database file through the registry with this manager's storage options."""
+        return self.registry.open(db_file, in_transaction, transaction_store,
+                                  storage_mode=self.storage_mode, sync_every=self.sync_every,
+                                  checkpoint_interval=self.checkpoint_interval, lazy=self.lazy,
+                                  durability=self.durability, flush_interval=self.flush_interval,
+                                  cache_bytes=self.cache_bytes, multiprocess=self.multiprocess,
+                                  expire_in_background=self.expire_in_background)
+
+    def migrate_database(self, db_name, storage_format, compress=False):
+        """
+        Convert a database to another storage format and return its new file path.
+        Pending write-ahead log records are folded in and index definitions are
+        carried over; the file in the old format is removed. Sharded databases
+        are migrated shard by shard and their directory is returned.
+        """
+        target_format = get_format(storage_format, compress)
+        shards_dir = self._get_shards_dir(db_name)
+        if os.path.isdir(shards_dir):
+            targets = []
+            for name in read_manifest(shards_dir)['files']:
+                target = f"{os.path.splitext(name)[0]}{target_format.extension}"
+                self._migrate_file(os.path.join(shards_dir, name), os.path.join(shards_dir, target), target_format)
+                targets.append(target)
+            write_manifest(shards_dir, targets)
+            return shards_dir
+        source_file = self._get_db_file(db_name)
+        if not os.path.exists(source_file):
+            raise FileNotFoundError(f"Database '{db_name}' does not exist.")
+        target_file = os.path.join(self.databases_dir, f"{db_name}{target_format.extension}")
+        self._migrate_file(source_file, target_file, target_format)
+        return target_file
+
+    def _migrate_file(self, source_file, target_file, target_format):
+        """Rewrite one database file in another format, carrying over its index definitions."""
+        # Closing the shared engine checkpoints its log, so the file is complete.
+        self.registry.discard(source_file)
+        engine = DatabaseEngine(source_file)
+        try:
+            data = target_format.dumps(engine.store)
+        finally:
+            engine.close()
+        temp_file = f"{target_file}.tmp"
+        with open(temp_file, 'wb') as f:
+            f.write(data)
+        os.replace(temp_file, target_file)
+        if target_file != source_file:
+            for suffix in ('.indexes', '.ttl', '.changes', '.changes.old'):
+                if os.path.exists(f"{source_file}{suffix}"):
+                    os.replace(f"{source_file}{suffix}", f"{target_file}{suffix}")
+            os.remove(source_file)
+        for suffix in ('.wal', '.lock'):
+            if os.path.exists(f"{source_file}{suffix}"):
+                os.remove(f"{source_file}{suffix}")
+
+    def backup_database(self, db_name, path, compress=False, since=None):
+        """
+        Write a hot backup of a database to path while it stays writable and
+        return the backup's header (see DatabaseEngine.snapshot). since is the
+        chain of earlier backups to take an incremental backup against.
+        """
+        if os.path.isdir(self._get_shards_dir(db_name)):
+            raise ValueError("Backups of sharded databases are not supported; back up each shard's database instead.")
+        return self.get_db(db_name).snapshot(path, compress, since)
+
+    def restore_database(self, db_name, paths, overwrite=False):
+        """
+        Restore a database from a backup chain (a full backup followed by its
+        incremental backups, in order), together with its index definitions
+        and key expiry times, and return the header of the last backup. An existing database is
+        replaced only with overwrite=True.
+        """
+        header, store, expiries = restore_chain(paths)
+        if db_name in self.list_databases():
+            if not overwrite:
+                raise FileExistsError(f"Database '{db_name}' already exists.")
+            self.delete_database(db_name)
+        db_file = os.path.join(self.databases_dir, f"{db_name}{self.format.extension}")
+        temp_file = f"{db_file}.tmp"
+        with open(temp_file, 'wb') as f:
+            f.write(self.format.dumps(store))
+            f.flush()
+            os.fsync(f.fileno())
+        if header.get('indexes'):
+            with open(f"{db_file}.indexes", 'w') as f:
+                json.dump(header['indexes'], f, indent=4)
+        if expiries:
+            with open(f"{db_file}.ttl", 'w') as f:
+                json.dump(expiries, f)
+        os.replace(temp_file, db_file)
+        return header
+
+    def _get_shards_dir(self, db_name):
+        """Get the directory of the specified database if it is (or were) sharded."""
+        return os.path.join(self.databases_dir, f"{db_name}{SHARDS_SUFFIX}")
 
     def _get_db_file(self, db_name):
         """
-        Get the file path for the specified database.
+        Get the file path for the specified database: its existing file in any
+        storage format, otherwise the path it would have in the default format.
         """
-        return os.path.join(self.databases_dir, f"{db_name}.json")
+        default_file = os.path.join(self.databases_dir, f"{db_name}{self.format.extension}")
+        if os.path.exists(default_file):
+            return default_file
+        for extension in EXTENSIONS:
+            db_file = os.path.join(self.databases_dir, f"{db_name}{extension}")
+            if os.path.exists(db_file):
+                return db_file
+        return default_file
@@ -0,0 +1,186 @@
+# src/metrics.py
+
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bounds of the latency histogram buckets, in seconds.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the size histogram buckets (records per transaction).
+SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000)
+
+# name -> (type, help, histogram buckets)
+DEFINITIONS = {
+    'nosql_operations_total': ('counter', 'Database operations by database and operation.', None),
+    'nosql_operation_seconds': ('histogram', 'Time spent per operation, split into lock wait, execution and I/O.',
+                                LATENCY_BUCKETS),
+    'nosql_queries_total': ('counter', 'Queries by plan (index lookup or full scan).', None),
+    'nosql_query_scanned_records_total': ('counter', 'Records examined by queries.', None),
+    'nosql_query_returned_records_total': ('counter', 'Records returned by queries.', None),
+    'nosql_transaction_records': ('histogram', 'Records applied per committed transaction.', SIZE_BUCKETS),
+    'nosql_flushes_total': ('counter', 'Flushes to disk; concurrent writes are grouped into one flush.', None),
+    'nosql_refreshes_total': ('counter', 'Catch-ups with changes persisted by other processes, by kind '
+                              '(log: appended records replayed, reload: rewritten file reloaded).', None),
+    'nosql_expired_keys_total': ('counter', 'Keys deleted by the expirer once their time to live passed.', None),
+    'nosql_persist_bytes_total': ('counter', 'Bytes written to snapshots and write-ahead logs.', None),
+    'nosql_load_seconds': ('histogram', 'Time to open a database from disk.', LATENCY_BUCKETS),
+    'nosql_cache_requests_total': ('counter', 'Lazy reads answered from (hit) or missing in (miss) the value cache.',
+                                   None),
+    'nosql_cache_bytes': ('gauge', 'Bytes held by the value cache of an open database.', None),
+    'nosql_records': ('gauge', 'Records in an open database.', None),
+    'nosql_file_bytes': ('gauge', 'Size of the database file and its write-ahead log.', None),
+}
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    """
+    Process-wide counters, gauges and histograms keyed by metric name and
+    labels. Instrumented code checks `enabled` before doing any work, so a
+    disabled registry costs one attribute lookup per operation.
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, name, labels):
+        if name not in DEFINITIONS:
+            raise KeyError(f"Unknown metric '{name}'.")
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        """Add to a counter."""
+        key = self._key(name, labels)
+        with self.lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        """Set a gauge to a value."""
+        self._set(name, 'gauge', value, labels)
+
+    def set_counter(self, name, value, **labels):
+        """Set a counter to the running total kept by what it counts (e.g. a cache's hits)."""
+        self._set(name, 'counter', value, labels)
+
+    def _set(self, name, kind, value, labels):
+        key = self._key(name, labels)
+        if DEFINITIONS[name][0] != kind:
+            raise ValueError(f"Metric '{name}' is a {DEFINITIONS[name][0]}, not a {kind}.")
+        with self.lock:
+            self._values[key] = value
+
+    def observe(self, name, value, **labels):
+        """Record a value in a histogram."""
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = Histogram(DEFINITIONS[name][2])
+            histogram.observe(value)
+
+    def reset(self):
+        """Forget every recorded value."""
+        with self.lock:
+            self._values.clear()
+
+    def snapshot(self, **labels):
+        """
+        Return the recorded values as a list of JSON-serializable dicts,
+        optionally only those whose labels include the given ones.
+        """
+        wanted = set(labels.items())
+        samples = []
+        with self.lock:
+            for (name, label_items), value in sorted(self._values.items(), key=_sort_key):
+                if not wanted <= set(label_items):
+                    continue
+                sample = {'name': name, 'labels': dict(label_items)}
+                if isinstance(value, Histogram):
+                    sample.update({'count': value.count, 'sum': value.sum})
+                else:
+                    sample['value'] = value
+                samples.append(sample)
+        return samples
+
+    def render_prometheus(self):
+        """Render every recorded value in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            by_name = {}
+            for (name, label_items), value in sorted(self._values.items(), key=_sort_key):
+                by_name.setdefault(name, []).append((label_items, value))
+            for name, series in by_name.items():
+                kind, help_text, _ = DEFINITIONS[name]
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for label_items, value in series:
+                    if not isinstance(value, Histogram):
+                        lines.append(f'{name}{_format_labels(label_items)} {_format_value(value)}')
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(value.buckets + ('+Inf',), value.counts):
+                        cumulative += count
+                        le = bound if bound == '+Inf' else _format_value(bound)
+                        lines.append(f'{name}_bucket{_format_labels(label_items + (("le", le),))} {cumulative}')
+                    lines.append(f'{name}_sum{_format_labels(label_items)} {_format_value(value.sum)}')
+                    lines.append(f'{name}_count{_format_labels(label_items)} {value.count}')
+        return '\n'.join(lines) + '\n'
+
+class OperationTimer:
+    """
+    Context manager wrapping a lock context manager that records how long an
+    operation waited for the lock and how long it then executed.
+    """
+    def __init__(self, metrics, lock_context, db, op):
+        self.metrics = metrics
+        self.lock_context = lock_context
+        self.db = db
+        self.op = op
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self.lock_context.__enter__()
+        self.acquired = time.perf_counter()
+        self.metrics.observe('nosql_operation_seconds', self.acquired - start, db=self.db, op=self.op,
+                             phase='lock_wait')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self.acquired
+        result = self.lock_context.__exit__(exc_type, exc_value, traceback)
+        self.metrics.observe('nosql_operation_seconds', elapsed, db=self.db, op=self.op, phase='execute')
+        self.metrics.inc('nosql_operations_total', db=self.db, op=self.op)
+        return result
+
+def _sort_key(item):
+    (name, label_items), _ = item
+    return name, label_items
+
+def _format_labels(label_items):
+    if not label_items:
+        return ''
+    pairs = []
+    for key, value in label_items:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{key}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+# Shared by every database in the process; disabled until enabled by the application.
+metrics = Metrics()
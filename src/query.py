@@ -0,0 +1,355 @@
+# src/query.py
+
+import heapq
+import json
+import operator as operators
+import re
+from indexes import _as_number
+
+COMPARISON_OPERATORS = ('=', '!=', '>', '<', '>=', '<=')
+OPERATORS = COMPARISON_OPERATORS + ('in', 'prefix', 'exists')
+_TESTS = {
+    '=': operators.eq,
+    '!=': operators.ne,
+    '>': operators.gt,
+    '<': operators.lt,
+    '>=': operators.ge,
+    '<=': operators.le,
+}
+_CONDITION = re.compile(r'^\s*(\S+)\s+(!=|>=|<=|=|>|<|in|prefix|exists)(?:\s+(.*?))?\s*$')
+
+def compare(record_value, operator, value):
+    """
+    Compare a record value with a query value: numerically when both convert
+    to float, otherwise as strings. This is the reference behaviour that
+    compiled predicates and secondary indexes reproduce.
+    """
+    try:
+        record_num = float(record_value)
+        value_num = float(value)
+    except (ValueError, TypeError):
+        return operator in _TESTS and _TESTS[operator](str(record_value), str(value))
+    return operator in _TESTS and _TESTS[operator](record_num, value_num)
+
+def field_getter(path):
+    """
+    Return a function reading a field from a record. Dotted paths such as
+    'address.city' walk nested objects; a missing field reads as None.
+    """
+    parts = path.split('.')
+    if len(parts) == 1:
+        def get(record):
+            return record.get(path) if isinstance(record, dict) else None
+        return get
+
+    def get_nested(record):
+        for part in parts:
+            if not isinstance(record, dict):
+                return None
+            record = record.get(part)
+        return record
+    return get_nested
+
+def condition(field, operator, value=None):
+    """Build the predicate spec of a single condition."""
+    return {'field': field, 'op': operator, 'value': value}
+
+def parse_condition(text):
+    """
+    Parse a condition written as 'field operator value', e.g. 'age >= 30',
+    'address.city = Paris', 'tags in ["a", "b"]' or 'email exists'. The value
+    is read as JSON when possible and as a plain string otherwise.
+    """
+    match = _CONDITION.match(text)
+    if match is None:
+        raise ValueError(f"Invalid condition '{text}': expected 'field operator value' "
+                         f"with an operator in {', '.join(OPERATORS)}.")
+    field, operator, value = match.groups()
+    if value is None or value == '':
+        if operator != 'exists':
+            raise ValueError(f"Condition '{text}' requires a value.")
+        return condition(field, operator, True)
+    try:
+        value = json.loads(value)
+    except json.JSONDecodeError:
+        pass
+    return condition(field, operator, value)
+
+def compile_predicate(spec):
+    """
+    Compile a predicate spec into a function of a record returning a bool.
+    A spec is a condition {'field': path, 'op': operator, 'value': value},
+    {'and': [specs]}, {'or': [specs]}, {'not': spec}, or None to match every
+    record. The operator and value are analysed once here rather than for
+    every record. Raises ValueError for malformed specs.
+    """
+    if spec is None:
+        return lambda record: True
+    if not isinstance(spec, dict):
+        raise ValueError(f"Invalid predicate {spec!r}: expected an object.")
+    if 'and' in spec or 'or' in spec:
+        combinator = 'and' if 'and' in spec else 'or'
+        children = spec[combinator]
+        if not isinstance(children, list) or not children:
+            raise ValueError(f"'{combinator}' requires a non-empty list of predicates.")
+        predicates = [compile_predicate(child) for child in children]
+        if len(predicates) == 1:
+            return predicates[0]
+        if combinator == 'and':
+            def all_match(record):
+                for predicate in predicates:
+                    if not predicate(record):
+                        return False
+                return True
+            return all_match
+
+        def any_match(record):
+            for predicate in predicates:
+                if predicate(record):
+                    return True
+            return False
+        return any_match
+    if 'not' in spec:
+        negated = compile_predicate(spec['not'])
+        return lambda record: not negated(record)
+    return _compile_condition(spec)
+
+def _compile_condition(spec):
+    field = spec.get('field')
+    operator = spec.get('op', spec.get('operator'))
+    value = spec.get('value')
+    if not isinstance(field, str) or not field:
+        raise ValueError(f"Invalid condition {spec!r}: 'field' is required.")
+    if operator not in OPERATORS:
+        raise ValueError(f"Invalid operator {operator!r}. Supported operators: {', '.join(OPERATORS)}.")
+    get = field_getter(field)
+
+    if operator == 'exists':
+        expected = value is None or bool(value)
+        return lambda record: (get(record) is not None) == expected
+
+    if operator == 'prefix':
+        if not isinstance(value, str):
+            raise ValueError(f"'prefix' on field '{field}' requires a string value.")
+        def has_prefix(record):
+            record_value = get(record)
+            return isinstance(record_value, str) and record_value.startswith(value)
+        return has_prefix
+
+    if operator == 'in':
+        if not isinstance(value, list):
+            raise ValueError(f"'in' on field '{field}' requires a list value.")
+        # Same semantics as '=' against each element, answered with set lookups.
+        numbers = set()
+        texts = set()
+        non_numeric_texts = set()
+        for element in value:
+            number = _as_number(element)
+            if number is not None:
+                numbers.add(number)
+            else:
+                non_numeric_texts.add(str(element))
+            texts.add(str(element))
+
+        def is_in(record):
+            record_value = get(record)
+            if record_value is None:
+                return False
+            number = _as_number(record_value)
+            if number is not None:
+                return number in numbers or str(record_value) in non_numeric_texts
+            return str(record_value) in texts
+        return is_in
+
+    if value is None:
+        raise ValueError(f"Operator '{operator}' on field '{field}' requires a value.")
+    test = _TESTS[operator]
+    text = str(value)
+    number = _as_number(value)
+    if number is None:
+        def compare_text(record):
+            record_value = get(record)
+            return record_value is not None and test(str(record_value), text)
+        return compare_text
+
+    def compare_number(record):
+        record_value = get(record)
+        if record_value is None:
+            return False
+        value_type = type(record_value)
+        if value_type is int or value_type is float:
+            return test(float(record_value), number)
+        record_number = _as_number(record_value)
+        if record_number is not None:
+            return test(record_number, number)
+        return test(str(record_value), text)
+    return compare_number
+
+class _Descending:
+    """Sort key wrapper inverting the order of the wrapped key."""
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+def _sort_value(value):
+    """
+    Map a field value to a sort key. Like compare(), values that convert to
+    float order numerically; they come first, then strings, then other
+    values, then missing ones.
+    """
+    if value is None:
+        return (3,)
+    number = _as_number(value)
+    if number is not None:
+        return (0, number) if number == number else (3,)
+    if type(value) is str:
+        return (1, value)
+    return (2, json.dumps(value, sort_keys=True))
+
+def parse_order_by(order_by):
+    """Normalize order_by ('field', '-field' for descending, or a list of those) to [(path, descending)]."""
+    if order_by is None:
+        return []
+    if isinstance(order_by, str):
+        order_by = [order_by]
+    fields = []
+    for entry in order_by:
+        if not isinstance(entry, str) or not entry.lstrip('-'):
+            raise ValueError(f"Invalid order_by entry {entry!r}: expected 'field' or '-field'.")
+        fields.append((entry.lstrip('-'), entry.startswith('-')))
+    return fields
+
+class Query:
+    """
+    A compiled query: a predicate (see compile_predicate), an optional
+    projection of field paths, an ordering and a limit.
+    """
+    def __init__(self, where=None, select=None, order_by=None, limit=None):
+        if limit is not None and limit < 1:
+            raise ValueError("Query limit must be at least 1.")
+        if isinstance(select, str):
+            select = [select]
+        self.where = where
+        self.predicate = compile_predicate(where)
+        self.select = list(select) if select else None
+        self._getters = [(path, field_getter(path)) for path in self.select or ()]
+        self.order_by = parse_order_by(order_by)
+        self._order_getters = [(field_getter(path), descending) for path, descending in self.order_by]
+        self.limit = limit
+
+    def filter(self, items):
+        """Yield the (key, record) pairs whose record matches the predicate."""
+        predicate = self.predicate
+        return ((key, record) for key, record in items if predicate(record))
+
+    def sort_key(self, item):
+        """Return the ordering key of a (key, record) pair: the order_by fields, then the key."""
+        key, record = item
+        parts = []
+        for get, descending in self._order_getters:
+            value = _sort_value(get(record))
+            parts.append(_Descending(value) if descending else value)
+        # The record key breaks ties so results are deterministic.
+        parts.append(key)
+        return parts
+
+    def project(self, record):
+        """Keep only the selected fields of a record, keyed by their paths."""
+        if self.select is None:
+            return record
+        if not isinstance(record, dict):
+            return {}
+        projected = {}
+        for path, get in self._getters:
+            value = get(record)
+            if value is not None:
+                projected[path] = value
+        return projected
+
+    def run(self, matches):
+        """
+        Order, limit and project the (key, record) pairs matching the
+        predicate (see filter) and return the selected (key, projected record)
+        pairs. Ordered queries with a limit keep only the best `limit` matches
+        in a heap instead of sorting every match; unordered queries with a
+        limit return the matches with the smallest keys.
+        """
+        if self.order_by:
+            if self.limit is not None:
+                matches = heapq.nsmallest(self.limit, matches, key=self.sort_key)
+            else:
+                matches = sorted(matches, key=self.sort_key)
+        elif self.limit is not None:
+            matches = heapq.nsmallest(self.limit, matches, key=lambda item: item[0])
+        if self.select is None:
+            return list(matches)
+        return [(key, self.project(record)) for key, record in matches]
+
+def plan(where, indexes):
+    """
+    Choose how to find the candidates of a predicate. Returns (keys, plan):
+    keys is a set of keys that contains every match (to be filtered with the
+    predicate), or None when the store must be scanned. For a conjunction the
+    index with the smallest estimated result is used; a disjunction uses
+    indexes only if every branch can.
+    """
+    choice = _plan(where, indexes)
+    if choice is None:
+        return None, {'plan': 'scan'}
+    estimate, lookup, used = choice
+    return lookup(), {'plan': 'index', 'indexes': used, 'estimate': estimate}
+
+def describe_plan(where, indexes):
+    """Describe the plan() of a predicate without looking up any keys."""
+    choice = _plan(where, indexes)
+    if choice is None:
+        return {'plan': 'scan'}
+    estimate, _, used = choice
+    return {'plan': 'index', 'indexes': used, 'estimate': estimate}
+
+def _plan(spec, indexes):
+    """Return (estimated keys, lookup function, index descriptions) for a spec, or None."""
+    if not isinstance(spec, dict) or not indexes:
+        return None
+    if 'and' in spec:
+        options = [choice for choice in (_plan(child, indexes) for child in spec['and']) if choice is not None]
+        return min(options, key=lambda choice: choice[0]) if options else None
+    if 'or' in spec:
+        options = [_plan(child, indexes) for child in spec['or']]
+        if not options or any(choice is None for choice in options):
+            return None
+        return (sum(choice[0] for choice in options),
+                lambda: set().union(*(choice[1]() for choice in options)),
+                [used for choice in options for used in choice[2]])
+    if 'not' in spec:
+        return None
+    field = spec.get('field')
+    operator = spec.get('op', spec.get('operator'))
+    value = spec.get('value')
+    # Indexes cover top-level fields only.
+    index = indexes.get(field)
+    if index is None or '.' in field:
+        return None
+    description = f"{field} ({index.kind}) {operator}"
+    if operator == 'in' and isinstance(value, list):
+        estimates = [index.estimate('=', element) for element in value]
+        if any(estimate is None for estimate in estimates):
+            return None
+        return (sum(estimates),
+                lambda: set().union(*(index.lookup('=', element) for element in value)),
+                [description])
+    if operator == 'exists' and (value is None or value):
+        return len(index.entries), lambda: set(index.entries), [description]
+    if operator in COMPARISON_OPERATORS or operator == 'prefix':
+        estimate = index.estimate(operator, value)
+        if estimate is None:
+            return None
+        return estimate, lambda: index.lookup(operator, value), [description]
+    return None
@@ -0,0 +1,336 @@
+# src/sharding.py
+
+import heapq
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from operator import itemgetter
+from aggregate import Aggregation
+from query import Query, condition
+
+# A sharded database '<name>' is a directory '<name>.shards' holding its
+# manifest and one database file per shard.
+SHARDS_SUFFIX = '.shards'
+MANIFEST_FILE = 'shards.json'
+
+_pools = {}
+_pools_lock = threading.Lock()
+# Shards opened by a process pool worker: file -> (token, SimpleNoSQLDB).
+_worker_shards = {}
+
+def shard_index(key, shard_count):
+    """Route a key to a shard. crc32 is stable across processes and runs, unlike hash()."""
+    return zlib.crc32(str(key).encode('utf-8')) % shard_count
+
+def shard_file_names(db_name, shard_count, extension):
+    """Return the file names of the shards of a database."""
+    return [f"{db_name}.{index:03d}{extension}" for index in range(shard_count)]
+
+def read_manifest(shards_dir):
+    """Read the manifest of a sharded database: {'shards': count, 'files': [names]}."""
+    with open(os.path.join(shards_dir, MANIFEST_FILE), 'r') as f:
+        return json.load(f)
+
+def write_manifest(shards_dir, files):
+    """Write the manifest of a sharded database."""
+    with open(os.path.join(shards_dir, MANIFEST_FILE), 'w') as f:
+        json.dump({'shards': len(files), 'files': files}, f, indent=4)
+
+def _thread_pool():
+    with _pools_lock:
+        if 'threads' not in _pools:
+            _pools['threads'] = ThreadPoolExecutor(max_workers=os.cpu_count() or 4,
+                                                   thread_name_prefix='nosql-shard')
+        return _pools['threads']
+
+def _process_pool(processes):
+    # Workers are spawned rather than forked: the parent runs flusher and
+    # checkpointer threads whose locks must not be copied mid-operation.
+    with _pools_lock:
+        if processes not in _pools:
+            _pools[processes] = ProcessPoolExecutor(max_workers=processes,
+                                                    mp_context=multiprocessing.get_context('spawn'))
+        return _pools[processes]
+
+def _shard_token(shard):
+    """Identify the state of a shard: its engine, the engine's version and the file's stamp."""
+    engine = shard.engine
+    try:
+        stat = os.stat(engine.db_file)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        stamp = None
+    return (os.getpid(), id(engine), engine.version, stamp, engine.wal.size())
+
+def _call_shard(db_file, lazy, token, method, args):
+    """
+    Process pool task: call a read-only method on a shard opened in this
+    worker. The shard is cached between tasks and reloaded from disk when the
+    parent's token shows it changed. The shard is opened read-only, so the
+    worker never writes to it, not even to delete expired keys.
+    """
+    # main imports this module, so the worker imports main only when it runs.
+    from main import SimpleNoSQLDB
+    cached = _worker_shards.get(db_file)
+    if cached is None or cached[0] != token:
+        cached = _worker_shards[db_file] = (token, SimpleNoSQLDB(db_file, lazy=lazy, read_only=True))
+    return getattr(cached[1], method)(*args)
+
+class ShardedNoSQLDB:
+    """
+    A database hash-partitioned into shards, each a database of its own with
+    its own file, engine and lock. Keys are routed to a shard by hash, so
+    writes to different shards do not contend and each persist rewrites only
+    one shard. Queries and key listings are fanned out to every shard and the
+    results merged: on a thread pool by default, or with processes=N on a
+    pool of N worker processes that load the shards themselves, so scans use
+    several cores. Workers are handed a token of each shard's state and
+    reload a shard only when it changed.
+
+    write_batch is atomic per shard only, and transactions are not supported.
+    """
+    def __init__(self, name, shards, processes=None):
+        """Initialize the database from SimpleNoSQLDB handles on its shards, in shard order."""
+        self.name = name
+        self.shards = shards
+        self.processes = processes
+        self.in_transaction = False
+
+    @property
+    def engines(self):
+        """The engines of the shards."""
+        return [shard.engine for shard in self.shards]
+
+    def shard_for(self, key):
+        """Return the shard holding a key."""
+        return self.shards[shard_index(key, len(self.shards))]
+
+    def _fan_out(self, method, *args):
+        """Call a method on every shard in parallel; returns the results in shard order."""
+        if self.processes:
+            pool = _process_pool(self.processes)
+            futures = []
+            for shard in self.shards:
+                # Workers read the files, so writes still held in memory must reach them first.
+                shard.flush()
+                futures.append(pool.submit(_call_shard, shard.db_file, shard.engine.lazy,
+                                           _shard_token(shard), method, args))
+        else:
+            pool = _thread_pool()
+            futures = [pool.submit(getattr(shard, method), *args) for shard in self.shards]
+        return [future.result() for future in futures]
+
+    def _group(self, operations):
+        """Group batch operations by shard as {shard index: [(position, operation)]}."""
+        groups = {}
+        for position, operation in enumerate(operations):
+            if not isinstance(operation, dict) or 'key' not in operation:
+                error = ValueError(f"Invalid batch operation {operation!r}: expected an object with a 'key'.")
+                error.index = position
+                raise error
+            index = shard_index(operation['key'], len(self.shards))
+            groups.setdefault(index, []).append((position, operation))
+        return groups
+
+    def begin_transaction(self):
+        """Transactions cannot span shards."""
+        raise Exception("Transactions are not supported on sharded databases.")
+
+    def watch(self, since=None, timeout=None, poll_interval=0.5):
+        """Sequence numbers are per database file, so there is no feed across shards."""
+        raise Exception("Change feeds are not supported on sharded databases.")
+
+    def create(self, key, value, ttl=None):
+        """Create a new key-value pair in the database, optionally with a time to live in seconds."""
+        self.shard_for(key).create(key, value, ttl)
+
+    def read(self, key):
+        """Read the value associated with a key."""
+        return self.shard_for(key).read(key)
+
+    def ttl(self, key):
+        """Return the seconds a key has left to live, or None if it never expires."""
+        return self.shard_for(key).ttl(key)
+
+    def update(self, key, value, ttl=None):
+        """Update the value of an existing key, replacing its time to live."""
+        self.shard_for(key).update(key, value, ttl)
+
+    def put(self, key, value, ttl=None):
+        """Create or update a key; returns True if the key was created."""
+        return self.shard_for(key).put(key, value, ttl)
+
+    def delete(self, key):
+        """Delete a key-value pair from the database."""
+        self.shard_for(key).delete(key)
+
+    def write_batch(self, operations):
+        """
+        Apply many operations with one persist per shard (see
+        SimpleNoSQLDB.write_batch). Each shard's part of the batch is atomic;
+        if a shard rejects its part, the parts of earlier shards stay applied.
+        The error's `index` is the failing operation's position in the batch.
+        """
+        groups = self._group(operations)
+        for index in sorted(groups):
+            try:
+                self.shards[index].write_batch([operation for _, operation in groups[index]])
+            except (KeyError, ValueError) as e:
+                if hasattr(e, 'index'):
+                    e.index = groups[index][e.index][0]
+                raise
+        return len(operations)
+
+    def apply_operations(self, operations):
+        """Apply many independent operations (see SimpleNoSQLDB.apply_operations)."""
+        results = [None] * len(operations)
+        for index, group in self._group(operations).items():
+            shard_results = self.shards[index].apply_operations([operation for _, operation in group])
+            for (position, _), result in zip(group, shard_results):
+                results[position] = result
+        return results
+
+    def bulk_create(self, records):
+        """Create many key-value pairs (a dict or (key, value) pairs) with one persist per shard."""
+        items = records.items() if isinstance(records, dict) else records
+        return self.write_batch([{'op': 'create', 'key': key, 'value': value} for key, value in items])
+
+    def list_keys(self):
+        """List all keys in the database, shard by shard."""
+        return [key for keys in self._fan_out('list_keys') for key in keys]
+
+    def keys_page(self, prefix=None, after=None, limit=100):
+        """Return one page of keys in key order as (keys, next_cursor)."""
+        if limit < 1:
+            raise ValueError("Page limit must be at least 1.")
+        keys = list(self.iter_keys(prefix, after, limit + 1))
+        if len(keys) > limit:
+            return keys[:limit], keys[limit - 1]
+        return keys, None
+
+    def iter_keys(self, prefix=None, after=None, limit=None, page_size=1000):
+        """Iterate over keys in key order, merging the shards' ordered keys."""
+        keys = heapq.merge(*(shard.iter_keys(prefix, after, limit, page_size) for shard in self.shards))
+        return itertools.islice(keys, limit)
+
+    def iter_items(self, prefix=None, after=None, limit=None, page_size=1000):
+        """Iterate over (key, value) pairs in key order (see iter_keys)."""
+        items = heapq.merge(*(shard.iter_items(prefix, after, limit, page_size) for shard in self.shards),
+                            key=itemgetter(0))
+        return itertools.islice(items, limit)
+
+    def scan(self, start=None, end=None, reverse=False, after=None, limit=None, page_size=1000):
+        """Iterate over the (key, value) pairs with start <= key < end, merging the shards' scans (see SimpleNoSQLDB.scan)."""
+        items = heapq.merge(*(shard.scan(start, end, reverse, after, limit, page_size) for shard in self.shards),
+                            key=itemgetter(0), reverse=reverse)
+        return itertools.islice(items, limit)
+
+    def scan_prefix(self, prefix, reverse=False, after=None, limit=None, page_size=1000):
+        """Iterate over the (key, value) pairs whose key starts with prefix (see scan)."""
+        items = heapq.merge(*(shard.scan_prefix(prefix, reverse, after, limit, page_size) for shard in self.shards),
+                            key=itemgetter(0), reverse=reverse)
+        return itertools.islice(items, limit)
+
+    def iter_query(self, field, operator, value, after=None, limit=None, page_size=1000):
+        """Iterate over (key, record) pairs matching a query in key order."""
+        return self.iter_find(condition(field, operator, value), after=after, limit=limit, page_size=page_size)
+
+    def iter_find(self, where=None, select=None, after=None, limit=None, page_size=1000):
+        """Iterate over (key, record) pairs matching a predicate in key order (see SimpleNoSQLDB.find)."""
+        items = heapq.merge(*(shard.iter_find(where, select, after, limit, page_size) for shard in self.shards),
+                            key=itemgetter(0))
+        return itertools.islice(items, limit)
+
+    def query(self, field, operator, value):
+        """Return the records where a field satisfies a condition."""
+        return self.find(condition(field, operator, value))
+
+    def find(self, where=None, select=None, order_by=None, limit=None):
+        """
+        Return the records matching a predicate (see SimpleNoSQLDB.find). Every
+        shard returns at most `limit` records, in order, and the partial
+        results are merged.
+        """
+        query = Query(where, select, order_by, limit)
+        if not query.order_by:
+            parts = self._fan_out('find', where, select, None, limit)
+            items = (item for part in parts for item in part.items())
+            if limit is not None:
+                items = heapq.nsmallest(limit, items, key=itemgetter(0))
+            return dict(items)
+        # Shards return whole records so that the merge can read the ordering fields.
+        parts = self._fan_out('find', where, None, order_by, limit)
+        items = heapq.merge(*(part.items() for part in parts), key=query.sort_key)
+        return {key: query.project(record) for key, record in itertools.islice(items, limit)}
+
+    def aggregate(self, aggregates, group_by=None, where=None):
+        """
+        Compute aggregates (see SimpleNoSQLDB.aggregate): every shard
+        aggregates its records, in worker processes when the database has
+        them, and the partial results are merged.
+        """
+        aggregation = Aggregation(aggregates, group_by)
+        partials = self._fan_out('partial_aggregate', aggregates, group_by, where)
+        return aggregation.result(aggregation.merge(partials))
+
+    def explain(self, where=None):
+        """Describe how each shard would evaluate a predicate."""
+        return {'plan': 'sharded', 'shards': [shard.explain(where) for shard in self.shards]}
+
+    def create_index(self, field, kind='hash'):
+        """Declare a secondary index on a top-level field of every shard."""
+        for shard in self.shards:
+            shard.create_index(field, kind)
+
+    def drop_index(self, field):
+        """Remove the secondary index on a field from every shard."""
+        for shard in self.shards:
+            shard.drop_index(field)
+
+    def list_indexes(self):
+        """Return a mapping of indexed field to index kind."""
+        return self.shards[0].list_indexes()
+
+    def checkpoint(self):
+        """Checkpoint every shard."""
+        for shard in self.shards:
+            shard.checkpoint()
+
+    def expire_keys(self):
+        """Delete the expired keys of every shard; returns how many."""
+        return sum(shard.expire_keys() for shard in self.shards)
+
+    def flush(self):
+        """Persist every committed write of every shard."""
+        for shard in self.shards:
+            shard.flush()
+
+    def stats(self):
+        """Return a summary of the database, adding up the shards' statistics."""
+        shard_stats = [shard.stats() for shard in self.shards]
+        first = shard_stats[0]
+        return {
+            'shards': len(self.shards),
+            'processes': self.processes,
+            'records': sum(stats['records'] for stats in shard_stats),
+            'file_bytes': sum(stats['file_bytes'] for stats in shard_stats),
+            'wal_bytes': sum(stats['wal_bytes'] for stats in shard_stats),
+            'format': first['format'],
+            'storage_mode': first['storage_mode'],
+            'durability': first['durability'],
+            'unflushed_writes': sum(stats['unflushed_writes'] for stats in shard_stats),
+            'expiring_keys': sum(stats['expiring_keys'] for stats in shard_stats),
+            'expired_keys': sum(stats['expired_keys'] for stats in shard_stats),
+            'lazy': first['lazy'],
+            'indexes': first['indexes'],
+            'records_per_shard': [stats['records'] for stats in shard_stats],
+        }
+
+    def close(self):
+        """Close the shards opened by this handle."""
+        for shard in self.shards:
+            shard.close()
@@ -0,0 +1,334 @@
+# src/storage.py
+
+import json
+import mmap
+import os
+import struct
+import zlib
+from collections.abc import MutableMapping
+from cache import MISSING
+
+# Binary layout ('.ndb'), all integers little-endian:
+#   header   MAGIC, format version (u8), flags (u8), 2 reserved bytes
+#   records  key length (u32), value length (u32), UTF-8 key, compact JSON value;
+#            the top bit of the value length marks a zlib-compressed value
+#   index    open-addressing hash table of record offsets (0 marks an empty
+#            slot), slot = crc32(key) & (slots - 1), linear probing; offsets
+#            are u32, or u64 when FLAG_WIDE_OFFSETS is set
+#   trailer  index offset (u64), slot count (u64), record count (u64), MAGIC
+MAGIC = b'NDB1'
+BINARY_VERSION = 1
+# Values are compressed when written (and when that makes them smaller).
+FLAG_COMPRESSED = 0x01
+FLAG_WIDE_OFFSETS = 0x02
+COMPRESSED_VALUE = 0x80000000
+HEADER = struct.Struct('<4sBBxx')
+RECORD = struct.Struct('<II')
+TRAILER = struct.Struct('<QQQ4s')
+
+class JSONFormat:
+    """Pretty-printed JSON object of all records (the original format)."""
+    name = 'json'
+    extension = '.json'
+
+    def load(self, path):
+        """Read every record of a database file into a dict."""
+        with open(path, 'r') as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                return {}
+
+    def dumps(self, store):
+        """Serialize a store to the bytes of a database file."""
+        return json.dumps(store, indent=4).encode('utf-8')
+
+    def open_lazy(self, path, cache=None):
+        """JSON files have no record index, so they are always loaded in full."""
+        return self.load(path)
+
+class BinaryFormat:
+    """Length-prefixed records followed by a hash index of record offsets."""
+    name = 'binary'
+    extension = '.ndb'
+
+    def __init__(self, compress=False):
+        self.compress = compress
+
+    def load(self, path):
+        """Read every record of a database file into a dict."""
+        with open(path, 'rb') as f:
+            data = f.read()
+        if not data:
+            return {}
+        _, index_offset, _, _ = read_layout(data)
+        keys = []
+        values = []
+        offset = HEADER.size
+        while offset < index_offset:
+            key_length, value_length = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+            keys.append(data[offset:offset + key_length].decode('utf-8'))
+            offset += key_length
+            values.append(value_bytes(data, offset, value_length))
+            offset += value_length & ~COMPRESSED_VALUE
+        # Decoding all values as one JSON array is much faster than one json.loads per value.
+        decoded = json.loads(b'[' + b','.join(values) + b']') if values else []
+        return dict(zip(keys, decoded))
+
+    def open_lazy(self, path, cache=None):
+        """Open a database file without reading its records (see LazyStore)."""
+        return LazyStore(path, cache)
+
+    def dumps(self, store):
+        """Serialize a store to the bytes of a database file."""
+        chunks = [None]
+        offset = HEADER.size
+        offsets = []
+        for key, value in store.items():
+            key_bytes = key.encode('utf-8')
+            value_bytes = json.dumps(value, separators=(',', ':')).encode('utf-8')
+            value_length = len(value_bytes)
+            if self.compress:
+                compressed = zlib.compress(value_bytes)
+                if len(compressed) < value_length:
+                    value_bytes = compressed
+                    value_length = len(compressed) | COMPRESSED_VALUE
+            offsets.append((key_bytes, offset))
+            chunks.append(RECORD.pack(len(key_bytes), value_length))
+            chunks.append(key_bytes)
+            chunks.append(value_bytes)
+            offset += RECORD.size + len(key_bytes) + len(value_bytes)
+        flags = FLAG_COMPRESSED if self.compress else 0
+        if offset > 0xFFFFFFFF:
+            flags |= FLAG_WIDE_OFFSETS
+        chunks[0] = HEADER.pack(MAGIC, BINARY_VERSION, flags)
+        slot_count = index_slot_count(len(offsets))
+        slots = [0] * slot_count
+        mask = slot_count - 1
+        for key_bytes, record_offset in offsets:
+            slot = zlib.crc32(key_bytes) & mask
+            while slots[slot]:
+                slot = (slot + 1) & mask
+            slots[slot] = record_offset
+        chunks.append(struct.pack(f"<{slot_count}{slot_code(flags)}", *slots))
+        chunks.append(TRAILER.pack(offset, slot_count, len(offsets), MAGIC))
+        return b''.join(chunks)
+
+class LazyStore(MutableMapping):
+    """
+    A dict-like view of a binary database file. The file is memory-mapped and
+    records are found through its on-disk hash index and decoded only when
+    accessed, so opening a database costs O(1) whatever its size. Writes are
+    kept in memory on top of the mapped file until the file is rewritten.
+
+    An optional ValueCache keeps values decoded by key lookups, so hot keys
+    are not decoded again on every read. Sequential scans (items, values)
+    bypass it. Writes and deletes invalidate the cached value of their key.
+    """
+    def __init__(self, path, cache=None):
+        self.path = path
+        self.cache = cache
+        self._overrides = {}
+        self._deleted = set()
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        if size:
+            flags, self._index_offset, self._slot_count, self._length = read_layout(self._data)
+            self._slot = struct.Struct('<' + slot_code(flags))
+        else:
+            self._index_offset = self._slot_count = self._length = 0
+
+    def _find(self, key):
+        """Return the offset of a key's record in the file, or None if the file does not contain it."""
+        if not self._slot_count or not isinstance(key, str):
+            return None
+        key_bytes = key.encode('utf-8')
+        mask = self._slot_count - 1
+        slot = zlib.crc32(key_bytes) & mask
+        while True:
+            offset, = self._slot.unpack_from(self._data, self._index_offset + slot * self._slot.size)
+            if not offset:
+                return None
+            key_length = RECORD.unpack_from(self._data, offset)[0]
+            start = offset + RECORD.size
+            if key_length == len(key_bytes) and self._data[start:start + key_length] == key_bytes:
+                return offset
+            slot = (slot + 1) & mask
+
+    def _encoded(self, offset):
+        """Return the (decompressed) JSON bytes of the value of the record at an offset."""
+        key_length, value_length = RECORD.unpack_from(self._data, offset)
+        return value_bytes(self._data, offset + RECORD.size + key_length, value_length)
+
+    def _decode(self, offset):
+        """Decode the value of the record at an offset."""
+        return json.loads(self._encoded(offset))
+
+    def _records(self):
+        """Iterate over (key, offset) of the records in the file, in file order."""
+        offset = HEADER.size
+        while offset < self._index_offset:
+            key_length, value_length = RECORD.unpack_from(self._data, offset)
+            start = offset + RECORD.size
+            yield self._data[start:start + key_length].decode('utf-8'), offset
+            offset = start + key_length + (value_length & ~COMPRESSED_VALUE)
+
+    def __getitem__(self, key):
+        cache = self.cache
+        # Read before the overrides, so that a write racing this lookup
+        # invalidates the value decoded here.
+        generation = cache.generation if cache is not None else None
+        value = self._overrides.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if key in self._deleted:
+            raise KeyError(key)
+        if cache is not None:
+            value = cache.get(key)
+            if value is not MISSING:
+                return value
+        offset = self._find(key)
+        if offset is None:
+            raise KeyError(key)
+        if cache is None:
+            return self._decode(offset)
+        encoded = self._encoded(offset)
+        value = json.loads(encoded)
+        cache.put(key, value, len(encoded), generation)
+        return value
+
+    def __contains__(self, key):
+        if key in self._overrides:
+            return True
+        return key not in self._deleted and self._find(key) is not None
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self._length += 1
+        self._overrides[key] = value
+        self._deleted.discard(key)
+        if self.cache is not None:
+            self.cache.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._deleted.add(key)
+        self._overrides.pop(key, None)
+        self._length -= 1
+        if self.cache is not None:
+            self.cache.discard(key)
+
+    def __len__(self):
+        return self._length
+
+    def copy(self):
+        """
+        Return a point-in-time copy: it shares the mapped file, which is never
+        modified in place, and copies only the writes held in memory.
+        """
+        clone = object.__new__(LazyStore)
+        clone.__dict__.update(self.__dict__)
+        clone._overrides = dict(self._overrides)
+        clone._deleted = set(self._deleted)
+        clone.cache = None
+        return clone
+
+    def __iter__(self):
+        for key, _ in self._records():
+            if key not in self._deleted:
+                yield key
+        for key in list(self._overrides):
+            if self._find(key) is None:
+                yield key
+
+    def items(self):
+        """Iterate over (key, value) pairs, decoding file records sequentially."""
+        for key, offset in self._records():
+            if key in self._deleted:
+                continue
+            value = self._overrides.get(key, _MISSING)
+            yield key, self._decode(offset) if value is _MISSING else value
+        for key, value in list(self._overrides.items()):
+            if self._find(key) is None:
+                yield key, value
+
+    def values(self):
+        for _, value in self.items():
+            yield value
+
+_MISSING = object()
+
+FORMATS = {JSONFormat.name: JSONFormat, BinaryFormat.name: BinaryFormat}
+EXTENSIONS = {cls.extension: cls for cls in FORMATS.values()}
+
+def get_format(name, compress=False):
+    """Create a storage format by name; compress only applies to the binary format."""
+    if name not in FORMATS:
+        raise ValueError(f"Unknown storage format '{name}'. Supported formats: {', '.join(FORMATS)}.")
+    if name == BinaryFormat.name:
+        return BinaryFormat(compress)
+    return JSONFormat()
+
+def format_for_file(path):
+    """Pick the storage format of a database file from its extension (and header flags)."""
+    extension = os.path.splitext(path)[1]
+    if extension == BinaryFormat.extension:
+        compress = False
+        if os.path.exists(path) and os.path.getsize(path) >= HEADER.size:
+            with open(path, 'rb') as f:
+                compress = bool(read_header(f.read(HEADER.size)) & FLAG_COMPRESSED)
+        return BinaryFormat(compress)
+    return JSONFormat()
+
+def fsync_directory(path):
+    """
+    Flush a directory to stable storage so that files created, renamed or
+    removed in it survive a crash. A no-op where directories cannot be opened.
+    """
+    try:
+        fd = os.open(path or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def index_slot_count(record_count):
+    """Size the hash index to a power of two with a load factor of at most one half."""
+    slot_count = 1
+    while slot_count < record_count * 2:
+        slot_count *= 2
+    return slot_count
+
+def slot_code(flags):
+    """Return the struct code of the index slots of a binary file with the given flags."""
+    return 'Q' if flags & FLAG_WIDE_OFFSETS else 'I'
+
+def value_bytes(data, offset, value_length):
+    """Return the JSON bytes of a record value, decompressing it if needed."""
+    if value_length & COMPRESSED_VALUE:
+        return zlib.decompress(data[offset:offset + (value_length & ~COMPRESSED_VALUE)])
+    return data[offset:offset + value_length]
+
+def read_header(data):
+    """Validate a binary header and return its flags."""
+    magic, version, flags = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError('Not a binary database file.')
+    if version != BINARY_VERSION:
+        raise ValueError(f'Unsupported binary database version {version}.')
+    return flags
+
+def read_layout(data):
+    """Return (flags, index offset, slot count, record count) of binary database contents."""
+    flags = read_header(data)
+    index_offset, slot_count, record_count, magic = TRAILER.unpack_from(data, len(data) - TRAILER.size)
+    if magic != MAGIC:
+        raise ValueError('Truncated binary database file.')
+    return flags, index_offset, slot_count, record_count
@@ -0,0 +1,166 @@
+# src/transactions.py
+
+import threading
+import time
+import uuid
+
+# get() sweeps abandoned transactions at most this often (seconds), or every timeout if shorter.
+CLEANUP_INTERVAL = 60
+
+class TransactionOverlay:
+    """
+    The pending write set of a transaction, layered over the committed store.
+    Reads check the overlay first and fall through to the store, so beginning
+    a transaction is O(1) and memory grows only with the keys it touches.
+    """
+    def __init__(self, puts=None, deletes=None, expires=None):
+        self.puts = dict(puts or {})
+        self.deletes = set(deletes or ())
+        # Expiry times (Unix time) of the written keys given a time to live.
+        self.expires = dict(expires or {})
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild an overlay from the plain dict produced by to_dict()."""
+        if isinstance(data, cls):
+            return data
+        return cls(data.get('puts'), data.get('deletes'), data.get('expires'))
+
+    def to_dict(self):
+        """Return a JSON-serializable representation of the pending writes."""
+        return {'puts': self.puts, 'deletes': sorted(self.deletes), 'expires': self.expires}
+
+    def __len__(self):
+        return len(self.puts) + len(self.deletes)
+
+    def touches(self, key):
+        """Check whether the transaction has written or deleted a key."""
+        return key in self.puts or key in self.deletes
+
+    def contains(self, store, key):
+        """Check whether a key exists in the transaction's view of the store."""
+        if key in self.puts:
+            return True
+        return key not in self.deletes and key in store
+
+    def get(self, store, key, default=None):
+        """Read a key from the transaction's view of the store."""
+        if key in self.puts:
+            return self.puts[key]
+        if key in self.deletes:
+            return default
+        return store.get(key, default)
+
+    def put(self, key, value, expires=None):
+        """Record a pending write of a key, expiring at Unix time `expires` if given."""
+        self.deletes.discard(key)
+        self.puts[key] = value
+        if expires is None:
+            self.expires.pop(key, None)
+        else:
+            self.expires[key] = expires
+
+    def delete(self, key):
+        """Record a pending deletion of a key."""
+        self.puts.pop(key, None)
+        self.expires.pop(key, None)
+        self.deletes.add(key)
+
+    def keys(self, store):
+        """List the keys visible to the transaction, committed keys first."""
+        keys = [key for key in store if key not in self.deletes]
+        keys.extend(key for key in self.puts if key not in store)
+        return keys
+
+    def items(self, store):
+        """Iterate over the (key, value) pairs visible to the transaction."""
+        for key, value in store.items():
+            if key in self.puts:
+                yield key, self.puts[key]
+            elif key not in self.deletes:
+                yield key, value
+        for key, value in self.puts.items():
+            if key not in store:
+                yield key, value
+
+    def records(self, store):
+        """Build the log records that apply this transaction to the committed store."""
+        records = [{'op': 'set', 'key': key, 'value': value} for key, value in self.puts.items()]
+        for record in records:
+            if record['key'] in self.expires:
+                record['expires'] = self.expires[record['key']]
+        records.extend({'op': 'del', 'key': key} for key in self.deletes if key in store)
+        return records
+
+class ServerTransaction:
+    """A transaction held on the server on behalf of a client session."""
+    def __init__(self, db_name):
+        self.db_name = db_name
+        self.overlay = TransactionOverlay()
+        self.last_used = time.monotonic()
+
+class TransactionManager:
+    def __init__(self, timeout=900):
+        """
+        Initialize a registry of server-side transactions keyed by transaction id.
+        Transactions idle for longer than `timeout` seconds are considered
+        abandoned and discarded (rolled back). The registry lives in this
+        process's memory: every request of a transaction must reach the same
+        process, so a web app using it must run as a single worker process.
+        """
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self._transactions = {}
+        self._next_cleanup = time.monotonic() + min(timeout, CLEANUP_INTERVAL)
+
+    def begin(self, db_name):
+        """Start a transaction on a database and return its id."""
+        txn_id = uuid.uuid4().hex
+        with self.lock:
+            self._cleanup()
+            self._transactions[txn_id] = ServerTransaction(db_name)
+        return txn_id
+
+    def get(self, txn_id):
+        """
+        Return the live transaction with the given id, or None if it is unknown
+        or expired. Every request looks up its transaction (if any), so this is
+        also where abandoned transactions are swept, at most every CLEANUP_INTERVAL.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now >= self._next_cleanup:
+                self._cleanup()
+            if not txn_id:
+                return None
+            transaction = self._transactions.get(txn_id)
+            if transaction is None:
+                return None
+            if now - transaction.last_used > self.timeout:
+                del self._transactions[txn_id]
+                return None
+            transaction.last_used = now
+            return transaction
+
+    def end(self, txn_id):
+        """Forget a transaction after it was committed or rolled back."""
+        with self.lock:
+            self._transactions.pop(txn_id, None)
+
+    def cleanup(self):
+        """Discard abandoned transactions and return how many were removed."""
+        with self.lock:
+            return self._cleanup()
+
+    def _cleanup(self):
+        now = time.monotonic()
+        self._next_cleanup = now + min(self.timeout, CLEANUP_INTERVAL)
+        deadline = now - self.timeout
+        expired = [txn_id for txn_id, transaction in self._transactions.items()
+                   if transaction.last_used < deadline]
+        for txn_id in expired:
+            del self._transactions[txn_id]
+        return len(expired)
+
+    def __len__(self):
+        return len(self._transactions)
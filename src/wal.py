@@ -0,0 +1,168 @@
+# src/wal.py
+
+import json
+import os
+from storage import fsync_directory
+
+class WriteAheadLog:
+    def __init__(self, path, sync_every=1):
+        """
+        Initialize an append-only log at the specified path.
+        sync_every controls fsync batching: the log is fsynced after every
+        `sync_every` appended records (0 disables explicit fsync).
+        """
+        self.path = path
+        self.sync_every = sync_every
+        self._file = None
+        self._unsynced = 0
+        self._created = False
+
+    def _open(self):
+        """Open the log file for appending if it is not already open."""
+        if self._file is None:
+            self._created = not os.path.exists(self.path)
+            self._file = open(self.path, 'a', encoding='utf-8')
+        return self._file
+
+    def append(self, records):
+        """Append a list of records, one compact JSON document per line; returns the bytes written."""
+        f = self._open()
+        data = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records)
+        f.write(data)
+        f.flush()
+        self._unsynced += len(records)
+        if self.sync_every and self._unsynced >= self.sync_every:
+            self.sync()
+        # json.dumps escapes non-ASCII characters, so every character is one byte.
+        return len(data)
+
+    def sync(self):
+        """Force any appended records to stable storage."""
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+            if self._created:
+                # A new log is only found after a crash once its directory entry is durable.
+                fsync_directory(os.path.dirname(os.path.abspath(self.path)))
+                self._created = False
+
+    def replay(self, store, expiries=None, repair=True):
+        """
+        Apply every record in the log to the given store, and to the dict of
+        key expiry times if given.
+        A torn trailing record (e.g. from a crash mid-append) is discarded and,
+        with repair, the log is truncated back to the last complete record.
+        Returns the number of records applied.
+        """
+        if not os.path.exists(self.path):
+            return 0
+        applied = 0
+        good_offset = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                apply_record(store, record, expiries)
+                applied += 1
+                good_offset += len(line)
+        if repair and good_offset != os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(good_offset)
+        return applied
+
+    def read_from(self, offset):
+        """
+        Read the complete records appended after a byte offset, without
+        modifying the log; returns (records, offset after the last of them).
+        Used to catch up with records appended by another process.
+        """
+        records = []
+        if not os.path.exists(self.path):
+            return records, offset
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+                offset += len(line)
+        return records, offset
+
+    def truncate(self, offset):
+        """Cut the log back to a byte offset, e.g. to drop a torn record left by a crashed process."""
+        if self.size() > offset:
+            with open(self.path, 'r+b') as f:
+                f.truncate(offset)
+
+    def size(self):
+        """Return the current size of the log in bytes."""
+        if self._file is not None:
+            # Other processes may append too, so ask the file rather than our own position.
+            return os.fstat(self._file.fileno()).st_size
+        if os.path.exists(self.path):
+            return os.path.getsize(self.path)
+        return 0
+
+    def reset(self):
+        """Discard all records, typically after they were checkpointed into a snapshot."""
+        self.close()
+        with open(self.path, 'w', encoding='utf-8'):
+            pass
+
+    def reopen_if_replaced(self):
+        """
+        Close the open file if the log at path was removed or replaced since it
+        was opened, e.g. by another process folding it into a snapshot, so that
+        the next append opens the current log instead of an unlinked file.
+        """
+        if self._file is None:
+            return
+        try:
+            current = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            current = None
+        if current != os.fstat(self._file.fileno()).st_ino:
+            self.close()
+
+    def close(self):
+        """Sync and close the underlying file."""
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+def apply_record(store, record, expiries=None):
+    """
+    Apply a single log record to an in-memory store. 'set' records carry
+    'expires', a Unix time, for keys with a time to live; if an expiries
+    dict is given it is kept up to date.
+    """
+    for sub_record in expand_record(record):
+        key = sub_record['key']
+        if sub_record['op'] == 'set':
+            store[key] = sub_record['value']
+        else:
+            store.pop(key, None)
+        if expiries is not None:
+            if sub_record.get('expires') is not None:
+                expiries[key] = sub_record['expires']
+            else:
+                expiries.pop(key, None)
+
+def expand_record(record):
+    """Yield the 'set' and 'del' records of a log record, unpacking batches."""
+    op = record['op']
+    if op in ('set', 'del'):
+        yield record
+    elif op == 'batch':
+        for sub_record in record['ops']:
+            yield from expand_record(sub_record)
+    else:
+        raise ValueError(f"Unknown log record operation '{op}'.")
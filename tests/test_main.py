@@ -0,0 +1,1189 @@
+import asyncio
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+
+import subprocess
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from main import SimpleNoSQLDB, DatabaseEngine, DatabaseManager, DatabaseRegistry
+from transactions import TransactionManager
+from async_db import AsyncDatabaseManager
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    path = tmp_path / 'test.json'
+    path.write_text('{}')
+    return str(path)
+
+
+def test_wal_mode_appends_instead_of_rewriting(db_file):
+    db = SimpleNoSQLDB(db_file, storage_mode='wal')
+    db.create('a', {'n': 1})
+    db.update('a', {'n': 2})
+    db.create('b', {'n': 3})
+    db.delete('b')
+    with open(db_file) as f:
+        assert json.load(f) == {}
+    with open(db_file + '.wal') as f:
+        assert len(f.readlines()) == 4
+
+    reopened = SimpleNoSQLDB(db_file, storage_mode='wal')
+    assert reopened.read('a') == {'n': 2}
+    assert reopened.read('b') is None
+
+
+def test_wal_recovery_discards_torn_record(db_file):
+    db = SimpleNoSQLDB(db_file, storage_mode='wal')
+    db.create('a', 1)
+    db.wal.close()
+    with open(db_file + '.wal', 'a') as f:
+        f.write('{"op":"set","key":"b"')
+
+    reopened = SimpleNoSQLDB(db_file, storage_mode='wal')
+    assert reopened.list_keys() == ['a']
+    reopened.create('c', 3)
+    assert SimpleNoSQLDB(db_file, storage_mode='wal').list_keys() == ['a', 'c']
+
+
+def test_wal_checkpoint_and_transaction_commit(db_file):
+    db = SimpleNoSQLDB(db_file, storage_mode='wal')
+    db.create('a', 1)
+    db.begin_transaction()
+    db.create('b', 2)
+    db.delete('a')
+    db.commit()
+    db.checkpoint()
+    assert os.path.getsize(db_file + '.wal') == 0
+    with open(db_file) as f:
+        assert json.load(f) == {'b': 2}
+
+
+def test_background_checkpointer_compacts_the_wal(db_file):
+    db = SimpleNoSQLDB(db_file, storage_mode='wal', checkpoint_interval=0.05)
+    db.create('a', 1)
+    deadline = time.time() + 5
+    while os.path.getsize(db_file + '.wal') and time.time() < deadline:
+        time.sleep(0.02)
+    assert os.path.getsize(db_file + '.wal') == 0
+    with open(db_file) as f:
+        assert json.load(f) == {'a': 1}
+    # The checkpointer released its locks: writes still go through.
+    writer = threading.Thread(target=db.create, args=('b', 2), daemon=True)
+    writer.start()
+    writer.join(5)
+    assert not writer.is_alive()
+
+
+def test_snapshot_mode_folds_in_leftover_wal(db_file):
+    SimpleNoSQLDB(db_file, storage_mode='wal').create('a', 1)
+    db = SimpleNoSQLDB(db_file)
+    assert db.read('a') == 1
+    db.create('b', 2)
+    assert not os.path.exists(db_file + '.wal')
+    assert SimpleNoSQLDB(db_file).list_keys() == ['a', 'b']
+
+
+def _scan(db, field, operator, value):
+    return {k: v for k, v in db.store.items()
+            if isinstance(v, dict) and v.get(field) is not None and db._compare(v[field], operator, value)}
+
+
+@pytest.mark.parametrize('kind', ['hash', 'sorted', 'column'])
+def test_index_lookups_match_full_scan(db_file, kind):
+    if kind == 'column':
+        pytest.importorskip('numpy')
+    db = SimpleNoSQLDB(db_file)
+    values = [30, 25, '25', 'abc', 'Abd', True, 2.5, None, [1], 'True', 30.0, float('nan')]
+    for i, value in enumerate(values):
+        db.create(f'k{i}', {'f': value})
+    db.create('plain', 'not a record')
+    db.create_index('f', kind)
+    operators = ['=', '!='] if kind == 'hash' else ['=', '!=', '>', '<', '>=', '<=']
+    for operator in operators:
+        for value in [30, '25', 'abc', 'True', True, 2.5, 0, 'zzz']:
+            assert db.query('f', operator, value) == _scan(db, 'f', operator, value)
+
+
+def test_column_index_vectorizes_numeric_queries_and_aggregates(db_file, monkeypatch):
+    pytest.importorskip('numpy')
+    db = SimpleNoSQLDB(db_file)
+    db.bulk_create({f'k{i:02d}': {'n': i} for i in range(40)})
+    db.create('text', {'n': 'many'})
+    db.create_index('n', 'column')
+    assert db.explain({'field': 'n', 'op': '<', 'value': 5}) == {'plan': 'index', 'indexes': ['n (column) <'], 'estimate': 5}
+    assert db.explain({'field': 'n', 'op': '<', 'value': 'abc'})['plan'] == 'scan'
+    assert sorted(db.query('n', '>=', 38)) == ['k38', 'k39', 'text']
+
+    # Writes update the column in place; freed slots are reused, new keys grow it.
+    db.delete('k05')
+    db.update('k06', {'n': -1})
+    db.update('k07', {'n': '7.5'})
+    db.update('text', {'n': 100})
+    db.bulk_create({f'new{i}': {'n': 1000 + i} for i in range(30)})
+    assert sorted(db.query('n', '<', 7.6)) == ['k00', 'k01', 'k02', 'k03', 'k04', 'k06', 'k07']
+    assert db.aggregate('count(n), sum(n), min(n), max(n)') == {
+        'count(n)': 70, 'sum(n)': sum(range(40)) - 18 - 1 + 7.5 + 100 + sum(range(1000, 1030)), 'min(n)': -1, 'max(n)': 1029}
+    index = db.indexes['n']
+    assert len(index._keys) == 70 and not index._free
+
+    # Without NumPy a declared column index is opened as a sorted one and cannot be declared anew.
+    monkeypatch.setattr('indexes.numpy', None)
+    monkeypatch.setattr('indexes.NUMPY_AVAILABLE', False)
+    reopened = SimpleNoSQLDB(db_file)
+    assert reopened.explain({'field': 'n', 'op': '>', 'value': 1028})['indexes'] == ['n (sorted) >']
+    assert list(reopened.query('n', '>', 1028)) == ['new29']
+    with pytest.raises(ValueError):
+        reopened.create_index('m', 'column')
+
+
+def test_index_maintained_and_persisted(db_file):
+    db = SimpleNoSQLDB(db_file)
+    db.create('a', {'age': 30})
+    db.create_index('age', 'sorted')
+    db.create('b', {'age': 40})
+    db.update('a', {'age': 50})
+    db.begin_transaction()
+    db.create('c', {'age': 60})
+    db.delete('b')
+    db.commit()
+    assert set(db.query('age', '>', 45)) == {'a', 'c'}
+
+    reopened = SimpleNoSQLDB(db_file)
+    assert reopened.list_indexes() == {'age': 'sorted'}
+    assert set(reopened.indexes['age'].lookup('>=', 50)) == {'a', 'c'}
+    reopened.drop_index('age')
+    assert SimpleNoSQLDB(db_file).list_indexes() == {}
+
+
+def test_transaction_overlay_isolation_and_commit(db_file):
+    db = SimpleNoSQLDB(db_file)
+    db.create('a', {'age': 30})
+    db.create('b', {'age': 40})
+    db.create_index('age', 'sorted')
+    db.begin_transaction()
+    assert len(db.transaction_store) == 0
+    db.update('a', {'age': 50})
+    db.delete('b')
+    db.create('c', {'age': 45})
+    assert db.read('a') == {'age': 50}
+    assert db.read('b') is None
+    assert db.list_keys() == ['a', 'c']
+    assert db.query('age', '>', 35) == {'a': {'age': 50}, 'c': {'age': 45}}
+    assert db.store == {'a': {'age': 30}, 'b': {'age': 40}}
+    with pytest.raises(KeyError):
+        db.update('b', {})
+
+    db.commit()
+    assert SimpleNoSQLDB(db_file).store == {'a': {'age': 50}, 'c': {'age': 45}}
+    assert set(db.query('age', '<', 46)) == {'c'}
+
+
+def test_transaction_restored_from_pending_writes(db_file):
+    db = SimpleNoSQLDB(db_file)
+    db.create('a', 1)
+    db.begin_transaction()
+    db.delete('a')
+    db.create('b', 2)
+    pending = json.loads(json.dumps(db.transaction_store.to_dict()))
+
+    resumed = SimpleNoSQLDB(db_file, in_transaction=True, transaction_store=pending)
+    assert resumed.list_keys() == ['b']
+    resumed.rollback()
+    assert resumed.list_keys() == ['a']
+
+
+def test_manager_shares_one_engine_per_database(tmp_path):
+    registry = DatabaseRegistry()
+    manager = DatabaseManager(str(tmp_path), registry=registry)
+    manager.create_database('users')
+    first = manager.get_db('users')
+    second = manager.get_db('users', in_transaction=True)
+    assert first.engine is second.engine
+    assert first.lock is second.lock
+
+    second.create('a', 1)
+    assert first.read('a') is None
+    second.commit()
+    assert first.read('a') == 1
+
+    # Served from memory: changes made behind the registry's back are not re-read.
+    with open(manager._get_db_file('users'), 'w') as f:
+        json.dump({}, f)
+    assert manager.get_db('users').read('a') == 1
+
+
+def test_registry_evicts_idle_databases_lru(tmp_path):
+    registry = DatabaseRegistry(max_databases=2)
+    manager = DatabaseManager(str(tmp_path), registry=registry)
+    for name in ('a', 'b', 'c'):
+        manager.create_database(name)
+    held = manager.get_db('a')
+    manager.get_db('b')
+    manager.get_db('c')
+    open_files = [os.path.basename(path) for path in registry.open_databases()]
+    assert open_files == ['a.json', 'c.json']
+    assert held.engine is manager.get_db('a').engine
+
+    manager.delete_database('c')
+    assert [os.path.basename(path) for path in registry.open_databases()] == ['a.json']
+
+
+def test_managers_with_limits_keep_them_to_themselves(tmp_path):
+    from main import default_registry
+    small = DatabaseManager(str(tmp_path), max_open_databases=1)
+    large = DatabaseManager(str(tmp_path), memory_budget=10 ** 9)
+    assert small.registry is not large.registry and default_registry.max_databases is None
+    assert DatabaseManager(str(tmp_path)).registry is default_registry
+    for name in ('a', 'b'):
+        small.create_database(name)
+        small.get_db(name)
+        large.get_db(name)
+    assert len(small.registry.open_databases()) == 1 and len(large.registry.open_databases()) == 2
+    assert small.registry.memory_budget is None and large.registry.max_databases is None
+
+
+def test_registry_closes_evicted_databases_outside_its_lock(tmp_path):
+    registry = DatabaseRegistry(max_databases=1)
+    manager = DatabaseManager(str(tmp_path), registry=registry, durability='async', flush_interval=60)
+    manager.create_database('a')
+    manager.create_database('b')
+    manager.get_db('b').put('k', 1)
+    engine = manager.get_db('b').engine
+    closing, release = threading.Event(), threading.Event()
+    original_close = engine.close
+
+    def slow_close():
+        closing.set()
+        release.wait(5)
+        original_close()
+    engine.close = slow_close
+
+    evicting = threading.Thread(target=manager.get_db, args=('a',))
+    evicting.start()
+    assert closing.wait(5)
+    # The registry stays usable while b flushes, but b is reopened only once it closed.
+    assert [os.path.basename(path) for path in registry.open_databases()] == ['a.json']
+    reopened = []
+    reopening = threading.Thread(target=lambda: reopened.append(manager.get_db('b')))
+    reopening.start()
+    reopening.join(0.2)
+    assert reopening.is_alive()
+    release.set()
+    evicting.join()
+    reopening.join()
+    assert reopened[0].read('k') == 1
+
+
+def test_transaction_manager_shares_overlay_and_expires(db_file, monkeypatch):
+    manager = TransactionManager(timeout=60)
+    txn_id = manager.begin('test')
+    overlay = manager.get(txn_id).overlay
+    SimpleNoSQLDB(db_file, in_transaction=True, transaction_store=overlay).create('a', 1)
+    assert manager.get(txn_id).overlay.puts == {'a': 1}
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 61)
+    assert manager.get(txn_id) is None
+    assert len(manager) == 0
+
+    # Abandoned transactions are swept by lookups too, not only when another one begins.
+    abandoned = [manager.begin('test') for _ in range(3)]
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 122)
+    assert manager.get(None) is None and len(manager) == 0
+    assert manager.get(abandoned[0]) is None
+
+
+def test_put_creates_or_updates(db_file):
+    db = SimpleNoSQLDB(db_file)
+    assert db.put('a', 1) is True
+    assert db.put('a', 2) is False
+    assert SimpleNoSQLDB(db_file).read('a') == 2
+
+
+def test_write_batch_is_atomic_and_persists_once(db_file, monkeypatch):
+    db = SimpleNoSQLDB(db_file)
+    db.create('a', 1)
+    saves = []
+    original_save = db.engine._save_data
+
+    def counting_save():
+        saves.append(1)
+        return original_save()
+    monkeypatch.setattr(db.engine, '_save_data', counting_save)
+
+    with pytest.raises(KeyError):
+        db.write_batch([{'op': 'create', 'key': 'b', 'value': 2},
+                        {'op': 'delete', 'key': 'b'},
+                        {'op': 'update', 'key': 'b', 'value': 3}])
+    assert db.list_keys() == ['a'] and saves == []
+
+    applied = db.write_batch([{'op': 'delete', 'key': 'a'},
+                              {'op': 'create', 'key': 'a', 'value': 10},
+                              {'op': 'put', 'key': 'c', 'value': 3},
+                              {'op': 'create', 'key': 'tmp', 'value': 0},
+                              {'op': 'delete', 'key': 'tmp'}])
+    assert applied == 5 and len(saves) == 1
+    assert SimpleNoSQLDB(db_file).store == {'a': 10, 'c': 3}
+
+    assert db.bulk_create({'d': 4, 'e': 5}) == 2
+    with pytest.raises(ValueError):
+        db.write_batch([{'op': 'upsert', 'key': 'x'}])
+
+
+def test_non_string_keys_are_rejected_before_any_write(db_file):
+    db = SimpleNoSQLDB(db_file)
+    db.create('a', 1)
+    with pytest.raises(ValueError):
+        db.write_batch([{'op': 'put', 'key': 'b', 'value': 2},
+                        {'op': 'put', 'key': 3, 'value': 3}])
+    for write in (db.create, db.update, db.put):
+        with pytest.raises(ValueError):
+            write(('t', 1), 1)
+    assert db.list_keys() == ['a']
+    db.put('c', 3)
+    assert list(db.iter_keys()) == ['a', 'c']
+    assert SimpleNoSQLDB(db_file).store == {'a': 1, 'c': 3}
+
+
+def test_paginated_iteration_is_ordered_and_stable(db_file):
+    db = SimpleNoSQLDB(db_file)
+    db.bulk_create({f'user:{i:02d}': {'n': i} for i in range(10)})
+    db.create('other', {'n': 100})
+
+    keys, cursor = db.keys_page(prefix='user:', limit=4)
+    assert keys == ['user:00', 'user:01', 'user:02', 'user:03'] and cursor == 'user:03'
+    db.delete('user:02')
+    db.create('user:035', {'n': 35})
+    keys, cursor = db.keys_page(prefix='user:', after=cursor, limit=4)
+    assert keys == ['user:035', 'user:04', 'user:05', 'user:06']
+    keys, cursor = db.keys_page(prefix='user:', after='user:06', limit=4)
+    assert keys == ['user:07', 'user:08', 'user:09'] and cursor is None
+
+    assert list(db.iter_keys(page_size=3))[-2:] == ['user:08', 'user:09']
+    assert next(db.iter_items(after='user:08')) == ('user:09', {'n': 9})
+    assert [k for k, _ in db.iter_query('n', '>=', 7, page_size=2)] == ['other', 'user:035', 'user:07', 'user:08', 'user:09']
+    assert [k for k, _ in db.iter_query('n', '>=', 7, after='user:07', limit=1)] == ['user:08']
+
+
+def test_reads_do_not_wait_for_persistence(db_file, monkeypatch):
+    db = SimpleNoSQLDB(db_file, storage_mode='wal')
+    db.create('a', {'n': 1})
+    in_io = threading.Event()
+    release_io = threading.Event()
+    original_append = db.wal.append
+
+    def slow_append(records):
+        in_io.set()
+        release_io.wait(5)
+        original_append(records)
+    monkeypatch.setattr(db.wal, 'append', slow_append)
+
+    writer = threading.Thread(target=db.create, args=('b', {'n': 2}))
+    writer.start()
+    assert in_io.wait(5)
+    # The write is applied in memory while its log append is still in progress.
+    assert db.read('b') == {'n': 2}
+    assert set(db.query('n', '>', 0)) == {'a', 'b'}
+    assert db.keys_page(limit=10) == (['a', 'b'], None)
+    release_io.set()
+    writer.join()
+    assert SimpleNoSQLDB(db_file, storage_mode='wal').read('b') == {'n': 2}
+
+
+@pytest.mark.parametrize('multiprocess', [False, True])
+def test_concurrent_writers_share_flushes(db_file, monkeypatch, multiprocess):
+    db = SimpleNoSQLDB(db_file, multiprocess=multiprocess)
+    saves = []
+    original_save = db.engine._save_data
+
+    def slow_save():
+        saves.append(1)
+        time.sleep(0.05)
+        return original_save()
+    monkeypatch.setattr(db.engine, '_save_data', slow_save)
+
+    writers = [threading.Thread(target=db.create, args=(f'k{i}', i)) for i in range(20)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    # Every write is durable once it returns, yet writers queued behind a
+    # flush were covered by the next one instead of rewriting the file each.
+    assert len(SimpleNoSQLDB(db_file, multiprocess=multiprocess).store) == 20
+    assert len(saves) < 10
+
+
+@pytest.mark.parametrize('storage_mode', ['snapshot', 'wal'])
+def test_async_durability_flushes_in_background(db_file, storage_mode):
+    with pytest.raises(ValueError):
+        DatabaseEngine(db_file, durability='eventually')
+    engine = DatabaseEngine(db_file, storage_mode, durability='async', flush_interval=60, flush_writes=3)
+    db = SimpleNoSQLDB(db_file, engine=engine)
+    db.create('a', 1)
+    db.create('b', 2)
+    assert SimpleNoSQLDB(db_file).store == {} and engine.stats()['unflushed_writes'] == 2
+    # Reaching flush_writes wakes the flusher without waiting for the interval.
+    db.create('c', 3)
+    deadline = time.time() + 5
+    while engine.stats()['unflushed_writes'] and time.time() < deadline:
+        time.sleep(0.01)
+    assert SimpleNoSQLDB(db_file, storage_mode=storage_mode).store == {'a': 1, 'b': 2, 'c': 3}
+    db.delete('a')
+    engine.close()
+    assert SimpleNoSQLDB(db_file, storage_mode=storage_mode).store == {'b': 2, 'c': 3}
+
+
+def test_async_facade_batches_concurrent_writes(tmp_path, monkeypatch):
+    manager = AsyncDatabaseManager(str(tmp_path), registry=DatabaseRegistry())
+
+    async def scenario():
+        await manager.create_database('people')
+        db = await manager.get_db('people')
+        batches = []
+        original_apply = db.db.apply_operations
+
+        def counting_apply(operations):
+            batches.append(len(operations))
+            return original_apply(operations)
+        monkeypatch.setattr(db.db, 'apply_operations', counting_apply)
+        read_threads = []
+        original_read = db.db.read
+
+        def recording_read(key):
+            read_threads.append(threading.current_thread())
+            return original_read(key)
+        monkeypatch.setattr(db.db, 'read', recording_read)
+
+        await asyncio.gather(*(db.create(f'k{i:03d}', {'n': i}) for i in range(200)))
+        assert sum(batches) == 200 and len(batches) < 200
+        results = await asyncio.gather(db.create('k000', 0), db.put('k000', 1), db.delete('missing'),
+                                       return_exceptions=True)
+        assert isinstance(results[0], KeyError) and results[1] is False and isinstance(results[2], KeyError)
+        assert await db.read('k000') == 1
+        # Reads take the lock, so they run in the executor, off the loop's thread.
+        assert read_threads and threading.current_thread() not in read_threads
+        assert [key async for key in db.iter_keys(prefix='k19', page_size=4)] == [f'k19{i}' for i in range(10)]
+        assert set(await db.query('n', '>=', 198)) == {'k198', 'k199'}
+        await db.close()
+
+    asyncio.run(scenario())
+    reopened = DatabaseManager(str(tmp_path), registry=DatabaseRegistry()).get_db('people')
+    assert len(reopened.list_keys()) == 200
+
+
+@pytest.mark.parametrize('processes', [None, 2])
+def test_sharded_database_routes_and_merges(tmp_path, processes):
+    manager = DatabaseManager(str(tmp_path), registry=DatabaseRegistry(), shard_processes=processes)
+    manager.create_database('people', shards=3)
+    assert manager.list_databases() == ['people']
+    db = manager.get_db('people')
+    db.bulk_create({f'k{i:02d}': {'n': i, 'even': i % 2 == 0} for i in range(30)})
+    assert all(shard.list_keys() for shard in db.shards)
+    assert db.read('k07') == {'n': 7, 'even': False}
+    assert sorted(db.list_keys()) == [f'k{i:02d}' for i in range(30)]
+    assert db.keys_page(after='k25', limit=3) == (['k26', 'k27', 'k28'], 'k28')
+
+    db.put('k03', {'n': 100, 'even': False})
+    odd = {'field': 'even', 'op': '=', 'value': False}
+    assert list(db.find(odd, select=['n'], order_by='-n', limit=2).items()) == [('k03', {'n': 100}), ('k29', {'n': 29})]
+    assert list(db.find(odd, limit=3)) == ['k01', 'k03', 'k05']
+    assert [key for key, _ in db.iter_find(odd, after='k20', limit=3)] == ['k21', 'k23', 'k25']
+    unchanged = [{'op': 'put', 'key': key, 'value': db.read(key)} for key in ('k10', 'k11', 'k12', 'k13')]
+    with pytest.raises(KeyError) as failure:
+        db.write_batch(unchanged[:3] + [{'op': 'update', 'key': 'missing', 'value': 0}] + unchanged[3:])
+    assert failure.value.index == 3
+    with pytest.raises(ValueError):
+        manager.get_db('people', in_transaction=True)
+
+    # Every write landed in the shard file its key routes to.
+    reopened = DatabaseManager(str(tmp_path), registry=DatabaseRegistry()).get_db('people')
+    assert reopened.read('k03') == {'n': 100, 'even': False} and reopened.stats()['records'] == 30
+    manager.delete_database('people')
+    assert manager.list_databases() == []
+
+
+def test_shard_worker_processes_never_write_expiring_shards(tmp_path):
+    manager = DatabaseManager(str(tmp_path), registry=DatabaseRegistry(), storage_mode='wal', shard_processes=2)
+    manager.create_database('sessions', shards=2)
+    db = manager.get_db('sessions')
+    db.bulk_create({f's{i}': i for i in range(10)})
+    assert len(db.find()) == 10  # starts the worker processes
+    for i in range(10):
+        db.put(f's{i}', i, ttl=0.5)
+    # Workers open the shards, expiring keys included, to answer the query.
+    assert len(db.find()) == 10
+    db.bulk_create({f'kept{i}': i for i in range(10)})
+    wal_files = sorted(str(shard.wal.path) for shard in db.shards)
+    time.sleep(1)
+    assert len(db.find()) == 10
+    assert all(os.path.exists(path) for path in wal_files)
+    reopened = DatabaseManager(str(tmp_path), registry=DatabaseRegistry()).get_db('sessions')
+    assert sorted(reopened.list_keys()) == sorted(f'kept{i}' for i in range(10))
+    with pytest.raises(ValueError):
+        SimpleNoSQLDB(db.shards[0].db_file, read_only=True).create('new', 1)
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_binary_format_round_trip(tmp_path, compress):
+    manager = DatabaseManager(str(tmp_path), registry=DatabaseRegistry(), storage_format='binary', compress=compress)
+    manager.create_database('bin')
+    db = manager.get_db('bin')
+    records = {'a': {'n': 1, 's': 'é'}, 'b': [1, 2.5, None], 'ключ': 'value', 'd': True}
+    db.bulk_create(records)
+    db.delete('d')
+    assert manager.list_databases() == ['bin']
+    assert (tmp_path / 'bin.ndb').exists()
+
+    reopened = SimpleNoSQLDB(str(tmp_path / 'bin.ndb'))
+    assert dict(reopened.store) == {key: value for key, value in records.items() if key != 'd'}
+
+
+def test_migrate_database_between_formats(tmp_path):
+    manager = DatabaseManager(str(tmp_path), registry=DatabaseRegistry())
+    manager.create_database('users')
+    db = manager.get_db('users')
+    db.bulk_create({f'user{i}': {'name': f'User {i}', 'age': i, 'bio': 'likes databases ' * 4} for i in range(50)})
+    db.create_index('age', 'sorted')
+    json_size = os.path.getsize(str(tmp_path / 'users.json'))
+
+    binary_file = manager.migrate_database('users', 'binary', compress=True)
+    assert binary_file.endswith('users.ndb')
+    assert not (tmp_path / 'users.json').exists()
+    assert os.path.getsize(binary_file) < json_size
+    db = manager.get_db('users')
+    assert db.read('user7')['age'] == 7
+    assert db.list_indexes() == {'age': 'sorted'}
+    assert sorted(db.query('age', '>=', 48)) == ['user48', 'user49']
+
+    json_file = manager.migrate_database('users', 'json')
+    with open(json_file) as f:
+        assert len(json.load(f)) == 50
+    assert manager.list_databases() == ['users']
+
+
+def test_lazy_binary_store_decodes_on_access(tmp_path):
+    manager = DatabaseManager(str(tmp_path), registry=DatabaseRegistry(), storage_format='binary')
+    manager.create_database('lazy')
+    manager.get_db('lazy').bulk_create({f'k{i:03d}': {'n': i} for i in range(200)})
+    db_file = str(tmp_path / 'lazy.ndb')
+    manager.registry.discard(db_file)
+    with open(db_file + '.indexes', 'w') as f:
+        json.dump({'n': 'sorted'}, f)
+    db = SimpleNoSQLDB(db_file, storage_mode='wal', lazy=True)
+    assert type(db.store).__name__ == 'LazyStore'
+    assert db.engine._indexes is None
+    assert db.read('k042') == {'n': 42}
+    assert db.read('missing') is None
+    assert len(db.store) == 200
+
+    db.update('k001', {'n': 1000})
+    db.delete('k002')
+    db.create('new', {'n': 500})
+    assert len(db.store) == 200
+    assert db.keys_page(limit=3) == (['k000', 'k001', 'k003'], 'k003')
+    assert sorted(db.query('n', '>=', 199)) == ['k001', 'k199', 'new']
+
+    reopened = SimpleNoSQLDB(db_file, storage_mode='wal', lazy=True)
+    assert reopened.read('k001') == {'n': 1000}
+    assert reopened.read('k002') is None
+    reopened.checkpoint()
+    assert reopened.store._overrides == {}
+    assert dict(reopened.store) == dict(db.store)
+
+
+def test_value_cache_serves_hot_keys_and_invalidates(tmp_path):
+    manager = DatabaseManager(str(tmp_path), registry=DatabaseRegistry(), storage_format='binary',
+                              lazy=True, cache_bytes=50 * 1000)
+    manager.create_database('hot')
+    db = manager.get_db('hot')
+    db.bulk_create({f'k{i:03d}': {'n': i, 'pad': 'x' * 300} for i in range(300)})
+    cache = db.engine.cache
+    assert db.read('k001')['n'] == 1 and db.read('k001')['n'] == 1
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+    # Keys read once (a sweep over cold data) do not push out a key read twice.
+    for i in range(100, 300):
+        db.read(f'k{i:03d}')
+    stats = cache.stats()
+    assert stats['bytes'] <= 50 * 1000 and stats['evictions'] > 0
+    assert db.read('k001')['n'] == 1 and cache.stats()['hits'] == 2
+
+    db.update('k001', {'n': -1})
+    db.delete('k150')
+    assert db.read('k001') == {'n': -1} and db.read('k150') is None
+    db.begin_transaction()
+    db.put('k002', {'n': -2})
+    assert db.read('k002') == {'n': -2}
+    db.rollback()
+    assert db.read('k002')['n'] == 2
+    db.begin_transaction()
+    db.put('k002', {'n': -2})
+    db.commit()
+    # The file is rewritten and remapped with the cache kept; nothing stale survives.
+    assert type(db.store).__name__ == 'LazyStore' and db.store._overrides == {}
+    assert db.read('k001') == {'n': -1} and db.read('k002') == {'n': -2} and db.read('k150') is None
+
+
+@pytest.mark.parametrize('storage_format', ['json', 'binary'])
+def test_hot_backup_incremental_chain_and_restore(tmp_path, storage_format):
+    manager = DatabaseManager(str(tmp_path / 'dbs'), registry=DatabaseRegistry(),
+                              storage_format=storage_format, lazy=True)
+    manager.create_database('live')
+    db = manager.get_db('live')
+    db.bulk_create({f'k{i:03d}': {'n': i} for i in range(200)})
+    db.create_index('n', 'sorted')
+    full = str(tmp_path / 'full.bak')
+    header = manager.backup_database('live', full, compress=True)
+    assert header['kind'] == 'full' and header['records'] == 200
+
+    # Writers keep going during the backup; it holds the state of one version.
+    stop = threading.Event()
+    def write():
+        i = 0
+        while not stop.is_set():
+            db.put(f'w{i % 50}', {'n': i})
+            i += 1
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        during = str(tmp_path / 'during.bak')
+        manager.backup_database('live', during)
+    finally:
+        stop.set()
+        writer.join()
+
+    db.update('k001', {'n': -1})
+    db.delete('k002')
+    incremental = str(tmp_path / 'incr.bak')
+    header = manager.backup_database('live', incremental, since=[full])
+    assert header['kind'] == 'incremental' and header['deleted'] == 1
+    assert header['records'] == 1 + sum(1 for key in db.list_keys() if key.startswith('w'))
+
+    restored = manager.restore_database('copy', [full, incremental])
+    copy = manager.get_db('copy')
+    assert dict(copy.iter_items()) == dict(db.iter_items())
+    assert copy.list_indexes() == {'n': 'sorted'} and restored['id'] == header['id']
+    assert manager.restore_database('copy', [during], overwrite=True)['kind'] == 'full'
+    with pytest.raises(FileExistsError):
+        manager.restore_database('copy', [full])
+
+    # Chains must start with a full backup and link up; truncated backups are refused.
+    with pytest.raises(ValueError):
+        manager.restore_database('bad', [incremental])
+    with pytest.raises(ValueError):
+        manager.restore_database('bad', [during, incremental])
+    with open(during, 'rb') as f:
+        data = f.read()
+    with open(during, 'wb') as f:
+        f.write(data[:len(data) // 2])
+    with pytest.raises(ValueError):
+        manager.restore_database('bad', [during])
+    # So are compressed ones cut short or damaged, rather than failing in gzip.
+    with open(full, 'rb') as f:
+        data = f.read()
+    for damaged in (data[:len(data) // 2], data[:len(data) // 2] + bytes(64) + data[len(data) // 2 + 64:]):
+        with open(full, 'wb') as f:
+            f.write(damaged)
+        with pytest.raises(ValueError, match='truncated or corrupt'):
+            manager.restore_database('bad', [full])
+    assert 'bad' not in manager.list_databases()
+
+
+@pytest.mark.parametrize('storage_mode', ['snapshot', 'wal'])
+def test_processes_sharing_a_database_see_each_others_writes(tmp_path, storage_mode):
+    # Managers with their own registries stand for separate processes.
+    data_dir = tmp_path / 'data' / 'databases'
+    first, second = (DatabaseManager(str(data_dir), registry=DatabaseRegistry(), storage_mode=storage_mode)
+                     for _ in range(2))
+    first.create_database('shared')
+    a, b = first.get_db('shared'), second.get_db('shared')
+    a.create('k1', 1)
+    store = a.store
+    b.create('k2', 2)
+    assert a.read('k2') == 2
+    # In 'wal' mode only the appended records are replayed; snapshots are reloaded.
+    assert (a.store is store) == (storage_mode == 'wal')
+    with pytest.raises(KeyError):
+        a.create('k2', 'stale')
+    a.update('k2', 3)
+    b.create_index('n')
+    assert b.read('k2') == 3 and a.list_indexes() == {'n': 'hash'}
+
+    # A command-line write while the database is open is not lost by later writes.
+    cli = os.path.join(os.path.dirname(__file__), '..', 'src', 'cli.py')
+    os.makedirs(tmp_path / 'run')
+    subprocess.run([sys.executable, cli, '--storage-mode', storage_mode, 'create', 'shared', 'k3', '{"n": 3}'],
+                   cwd=tmp_path / 'run', check=True, capture_output=True)
+    a.put('k4', 4)
+    b.checkpoint()
+    assert a.find({'field': 'n', 'op': '=', 'value': 3}) == {'k3': {'n': 3}}
+    a.close()
+    b.close()
+    reopened = SimpleNoSQLDB(str(data_dir / 'shared.json'))
+    assert dict(reopened.iter_items()) == {'k1': 1, 'k2': 3, 'k3': {'n': 3}, 'k4': 4}
+
+
+def test_processes_mixing_storage_modes_keep_every_write(tmp_path):
+    # A 'wal' process (the web app) and a 'snapshot' one (the CLI default) share a database.
+    data_dir = tmp_path / 'data' / 'databases'
+    wal, snapshot = (DatabaseManager(str(data_dir), registry=DatabaseRegistry(), storage_mode=mode)
+                     for mode in ('wal', 'snapshot'))
+    wal.create_database('mixed')
+    a = wal.get_db('mixed')
+    a.create('a', 1)
+    a.create('b', 2)
+    # The snapshot write folds the log into the file and removes the log.
+    snapshot.get_db('mixed').create('c', 3)
+    a.create('d', 4)
+    a.update('a', 10)
+    assert os.path.exists(str(data_dir / 'mixed.json.wal'))
+    assert a.read('c') == 3 and snapshot.get_db('mixed').read('d') == 4
+
+    # The same with a command-line process, which writes snapshots by default.
+    cli = os.path.join(os.path.dirname(__file__), '..', 'src', 'cli.py')
+    os.makedirs(tmp_path / 'run')
+    subprocess.run([sys.executable, cli, 'create', 'mixed', 'e', '5'], cwd=tmp_path / 'run', check=True,
+                   capture_output=True)
+    a.create('f', 6)
+    fresh = SimpleNoSQLDB(str(data_dir / 'mixed.json'))
+    assert dict(fresh.iter_items()) == {'a': 10, 'b': 2, 'c': 3, 'd': 4, 'e': 5, 'f': 6}
+
+
+@pytest.mark.parametrize('storage_mode', ['snapshot', 'wal'])
+def test_change_feed_sequences_and_follows_writes(tmp_path, storage_mode):
+    first, second = (DatabaseManager(str(tmp_path), registry=DatabaseRegistry(), storage_mode=storage_mode)
+                     for _ in range(2))
+    first.create_database('feed')
+    db = first.get_db('feed')
+    db.create('before', 0)
+    assert db.enable_change_feed() == 0
+    db.create('a', 1)
+    db.update('a', 2)
+    db.write_batch([{'op': 'put', 'key': 'b', 'value': 3}, {'op': 'delete', 'key': 'before'}])
+    db.begin_transaction()
+    db.put('c', 4)
+    db.delete('a')
+    db.commit()
+    events = list(db.watch(since=0, timeout=0))
+    assert [event['seq'] for event in events] == [1, 2, 3, 4]
+    assert [[(change['op'], change['key']) for change in event['changes']] for event in events] == [
+        [('create', 'a')], [('update', 'a')], [('create', 'b'), ('delete', 'before')],
+        [('create', 'c'), ('delete', 'a')]]
+    assert events[1]['changes'][0]['value'] == 2
+    assert [event['seq'] for event in db.watch(since=2, timeout=0)] == [3, 4]
+
+    # A follower sees new writes, also those of another process, in order.
+    follower = db.watch(timeout=5)
+    received = []
+    thread = threading.Thread(target=lambda: received.extend(itertools.islice(follower, 2)))
+    thread.start()
+    db.put('d', 5)
+    second.get_db('feed').put('e', 6)
+    thread.join(5)
+    assert [(event['seq'], event['changes'][0]['key']) for event in received] == [(5, 'd'), (6, 'e')]
+    assert db.stats()['change_feed'] == 6
+
+    # Consumers that fell behind the retained events must resynchronize.
+    db.engine.feed.max_bytes = 400
+    for i in range(10):
+        db.put('f', i)
+    with pytest.raises(ValueError):
+        db.watch(since=0)
+    with pytest.raises(ValueError):
+        db.watch(since=100)
+    db.disable_change_feed()
+    db.put('g', 7)
+    assert db.stats()['change_feed'] is None
+
+
+def test_keys_expire_after_their_time_to_live(tmp_path):
+    manager = DatabaseManager(str(tmp_path), registry=DatabaseRegistry(), storage_mode='wal')
+    manager.create_database('sessions')
+    db = manager.get_db('sessions')
+    db.create('s1', {'user': 1}, ttl=0.3)
+    db.put('s2', {'user': 2}, ttl=0.3)
+    db.put('s2', {'user': 2})
+    db.write_batch([{'op': 'put', 'key': 's3', 'value': 3, 'ttl': 0.3}, {'op': 'put', 'key': 'long', 'value': 4, 'ttl': 60}])
+    db.begin_transaction()
+    db.put('s4', 5, ttl=0.3)
+    assert 50 < db.ttl('long') <= 60 and db.ttl('s4') > 0
+    db.commit()
+    for ttl in (0, -1, 'soon', True):
+        with pytest.raises(ValueError):
+            db.create('bad', 1, ttl=ttl)
+    assert db.ttl('s2') is None and db.stats()['expiring_keys'] == 4
+
+    # Expired keys read as absent until the expirer deletes them in one batch.
+    time.sleep(0.35)
+    assert db.read('s1') is None and db.list_keys() == ['s2', 'long']
+    assert [key for key, _ in db.scan()] == ['long', 's2'] and db.query('user', '>', 0) == {'s2': {'user': 2}}
+    with pytest.raises(KeyError):
+        db.update('s3', 1)
+    deadline = time.time() + 5
+    while db.stats()['expired_keys'] < 3 and time.time() < deadline:
+        time.sleep(0.05)
+    assert db.stats()['expired_keys'] == 3 and sorted(db.store) == ['long', 's2']
+    assert db.engine.expiries.keys() == {'long'}
+
+    # Expiry times survive a restart, from the log and after a checkpoint, and backups.
+    for checkpoint in (False, True):
+        if checkpoint:
+            db.checkpoint()
+        reopened = DatabaseManager(str(tmp_path), registry=DatabaseRegistry(), storage_mode='wal').get_db('sessions')
+        assert 50 < reopened.ttl('long') <= 60 and reopened.ttl('s2') is None
+    db.snapshot(str(tmp_path / 'backup.jsonl'))
+    manager.restore_database('restored', [str(tmp_path / 'backup.jsonl')])
+    assert 50 < manager.get_db('restored').ttl('long') <= 60
+
+
+def test_cli_import_reports_the_failing_line(tmp_path):
+    manager = DatabaseManager(str(tmp_path / 'data' / 'databases'), registry=DatabaseRegistry())
+    manager.create_database('people')
+    cli = os.path.join(os.path.dirname(__file__), '..', 'src', 'cli.py')
+    os.makedirs(tmp_path / 'run')
+    source = tmp_path / 'people.jsonl'
+    for rows, error in ((['{"key": "a", "value": 1}', '', '{"key": 2, "value": 2}'], 'Line 3: Keys must be strings'),
+                        (['{"key": "b", "value": 1}', '{"key": "b", "value": 2}'], "Line 2: Key 'b' already exists.")):
+        source.write_text('\n'.join(rows) + '\n')
+        result = subprocess.run([sys.executable, cli, 'import', 'people', str(source), '--batch-size', '2'],
+                                cwd=tmp_path / 'run', capture_output=True, text=True)
+        assert result.returncode == 1 and 'Traceback' not in result.stderr
+        assert result.stdout.startswith(error)
+    assert manager.get_db('people').list_keys() == []
+
+
+def test_cli_expire_reports_the_keys_it_deleted(tmp_path):
+    data_dir = tmp_path / 'data' / 'databases'
+    manager = DatabaseManager(str(data_dir), registry=DatabaseRegistry(), expire_in_background=False)
+    manager.create_database('sessions')
+    db = manager.get_db('sessions')
+    db.bulk_create({'long': 0})
+    for i in range(3):
+        db.put(f's{i}', i, ttl=0.2)
+    time.sleep(0.3)
+    assert sorted(db.store) == ['long', 's0', 's1', 's2']
+    cli = os.path.join(os.path.dirname(__file__), '..', 'src', 'cli.py')
+    os.makedirs(tmp_path / 'run')
+    for expected in (3, 0):
+        result = subprocess.run([sys.executable, cli, 'expire', 'sessions'], cwd=tmp_path / 'run', check=True,
+                                capture_output=True, text=True)
+        assert result.stdout.strip() == f"Deleted {expected} expired key(s) from database 'sessions'."
+    assert db.list_keys() == ['long'] and sorted(db.store) == ['long']
+
+
+def test_key_range_and_prefix_scans(tmp_path, monkeypatch):
+    monkeypatch.setattr('indexes.KEY_CHUNK_SIZE', 4)
+    first, second = (DatabaseManager(str(tmp_path), registry=DatabaseRegistry(), storage_format='binary',
+                                     storage_mode='wal', lazy=True, cache_bytes=10 * 1000) for _ in range(2))
+    first.create_database('scan')
+    db = first.get_db('scan')
+    db.bulk_create({f'user:{i:02d}': i for i in range(30)})
+    db.bulk_create({'order:1': 'a', 'user': 'bare', 'user;': 'after'})
+
+    # Listing keys builds the key index without decoding a single value.
+    assert list(db.iter_keys(prefix='user:', limit=3)) == ['user:00', 'user:01', 'user:02']
+    assert db.engine.cache.stats()['misses'] == 0
+    assert list(db.scan('user:05', 'user:08')) == [('user:05', 5), ('user:06', 6), ('user:07', 7)]
+    assert [key for key, _ in db.scan('user:27', reverse=True, limit=2)] == ['user;', 'user:29']
+    assert [key for key, _ in db.scan(end='user', reverse=True)] == ['order:1']
+    assert [value for _, value in db.scan_prefix('user:1')] == list(range(10, 20))
+    assert [value for _, value in db.scan_prefix('user:1', reverse=True, after='user:15')] == [14, 13, 12, 11, 10]
+    assert [value for _, value in db.scan_prefix('user:', after='user:25', page_size=2)] == [26, 27, 28, 29]
+    assert list(db.scan_prefix('user:\U0010FFFF')) == []
+
+    # Writes, transactions and other processes' writes keep the index current.
+    db.delete('user:11')
+    db.create('user:1a', 'x')
+    db.begin_transaction()
+    db.delete('user:12')
+    db.put('user:10', 'changed')
+    db.put('user:1b', 'y')
+    assert [key for key, _ in db.scan_prefix('user:1', reverse=True, limit=4)] == [
+        'user:1b', 'user:1a', 'user:19', 'user:18']
+    assert [value for _, value in db.scan('user:10', 'user:14')] == ['changed', 13]
+    db.rollback()
+    second.get_db('scan').delete('user:13')
+    second.get_db('scan').create('user:0a', 'z')
+    assert [key for key, _ in db.scan('user:09', 'user:15')] == ['user:09', 'user:0a', 'user:10', 'user:12', 'user:14']
+    db.checkpoint()
+    assert [key for key, _ in second.get_db('scan').scan('user:1', 'user:2', reverse=True)][:3] == [
+        'user:1a', 'user:19', 'user:18']
+
+
+def test_aggregates_count_sum_and_group_in_one_pass(tmp_path, monkeypatch):
+    manager = DatabaseManager(str(tmp_path), registry=DatabaseRegistry(), shard_processes=2)
+    manager.create_database('people')
+    db = manager.get_db('people')
+    _people(db)
+    everything = ['count', 'count(email)', 'sum(age)', 'avg(age)', 'min(age)', 'max(age)', 'min(name)']
+    totals = {'count': 6, 'count(email)': 1, 'sum(age)': 167, 'avg(age)': 33.4, 'min(age)': 19, 'max(age)': 52,
+              'min(name)': 'Alice'}
+    assert db.aggregate(everything) == totals
+    assert db.aggregate('count, max(age)', where={'field': 'age', 'op': '<', 'value': 30}) == {'count': 2, 'max(age)': 25}
+    assert db.aggregate(['count', 'avg(age)'], group_by='address.city') == [
+        {'group': 'Berlin', 'count': 1, 'avg(age)': 25.0}, {'group': 'Paris', 'count': 2, 'avg(age)': 35.5},
+        {'group': 'Rome', 'count': 1, 'avg(age)': 52.0}, {'group': None, 'count': 2, 'avg(age)': 19.0}]
+    assert db.aggregate('sum(missing), min(missing)') == {'sum(missing)': None, 'min(missing)': None}
+    for invalid in ([], 'median(age)', 'sum', 'count(a b)'):
+        with pytest.raises(ValueError):
+            db.aggregate(invalid)
+
+    # With indexes on the fields read, no record is read at all.
+    db.create_index('age', 'sorted')
+    db.create_index('email', 'hash')
+    monkeypatch.setattr('aggregate.Aggregation.run', lambda self, records: pytest.fail('records were read'))
+    assert db.aggregate(everything[:-1]) == {name: value for name, value in totals.items() if name != 'min(name)'}
+    db.create_index('name', 'hash')
+    assert db.aggregate('count', group_by='name')[:2] == [{'group': 'Alice', 'count': 1}, {'group': 'Ann', 'count': 1}]
+    monkeypatch.undo()
+
+    # Shards (here in worker processes) aggregate their part; the parts are merged.
+    manager.create_database('sharded', shards=3)
+    sharded = manager.get_db('sharded')
+    _people(sharded)
+    assert sharded.aggregate(everything) == totals
+    assert sharded.aggregate('count', group_by='address.city')[-1] == {'group': None, 'count': 2}
+
+
+@pytest.mark.parametrize('kind', ['hash', 'sorted'])
+def test_grouping_by_an_index_matches_the_scan(db_file, kind):
+    db = SimpleNoSQLDB(db_file)
+    values = [1, 1.0, '1', True, 2, 'inf', float('inf'), 'nan', 'nan', 'NaN', float('nan'), 'x', [1], None]
+    db.bulk_create({f'k{i:02d}': {'g': value} for i, value in enumerate(values)})
+    db.create('none', {})
+    scanned = db.aggregate('count', group_by='g')
+    assert {'group': 'NaN', 'count': 1} in scanned
+    db.create_index('g', kind)
+    assert db.aggregate('count', group_by='g') == scanned
+
+
+def test_metrics_record_operations_and_queries(db_file):
+    from metrics import metrics
+    db = SimpleNoSQLDB(db_file)
+    metrics.reset()
+    db.create('off', 1)
+    assert metrics.snapshot() == []
+
+    metrics.enabled = True
+    try:
+        db.bulk_create({f'k{i}': {'n': i} for i in range(10)})
+        db.read('k1')
+        db.update('k1', {'n': 100})
+        assert len(db.query('n', '>', 7)) == 3
+        db.create_index('n', 'sorted')
+        assert len(db.query('n', '>', 7)) == 3
+        db.begin_transaction()
+        db.delete('k2')
+        db.commit()
+    finally:
+        metrics.enabled = False
+
+    values = {(s['name'], tuple(sorted(s['labels'].items()))): s for s in metrics.snapshot(db='test')}
+    def get(name, **labels):
+        return values[(name, tuple(sorted(dict(labels, db='test').items())))]
+    assert get('nosql_operations_total', op='read')['value'] == 1
+    assert get('nosql_operation_seconds', op='update', phase='io')['count'] == 1
+    assert get('nosql_operation_seconds', op='write_batch', phase='lock_wait')['count'] == 1
+    assert get('nosql_queries_total', plan='scan')['value'] == 1
+    assert get('nosql_queries_total', plan='index')['value'] == 1
+    assert get('nosql_query_scanned_records_total')['value'] == 11 + 3
+    assert get('nosql_query_returned_records_total')['value'] == 6
+    assert get('nosql_transaction_records')['count'] == 1
+    assert get('nosql_persist_bytes_total', kind='snapshot')['value'] > 0
+
+    text = metrics.render_prometheus()
+    assert '# TYPE nosql_operation_seconds histogram' in text
+    assert 'nosql_operations_total{db="test",op="read"} 1' in text
+    assert 'nosql_transaction_records_bucket{db="test",le="+Inf"} 1' in text
+    metrics.reset()
+
+
+def _people(db):
+    db.bulk_create({
+        'ann': {'name': 'Ann', 'age': 31, 'address': {'city': 'Paris'}, 'tags': ['a']},
+        'bob': {'name': 'Bob', 'age': 25, 'address': {'city': 'Berlin'}},
+        'cid': {'name': 'Cid', 'age': '40', 'address': {'city': 'Paris'}, 'email': 'c@x'},
+        'dee': {'name': 'Dee', 'age': 19},
+        'eve': {'name': 'Alice', 'age': 52, 'address': {'city': 'Rome'}},
+        'raw': 'not a record',
+    })
+
+
+@pytest.mark.parametrize('indexed', [False, True])
+def test_find_compound_predicates(db_file, indexed):
+    db = SimpleNoSQLDB(db_file)
+    _people(db)
+    if indexed:
+        db.create_index('age', 'sorted')
+        db.create_index('name', 'hash')
+    assert list(db.find({'field': 'address.city', 'op': '=', 'value': 'Paris'})) == ['ann', 'cid']
+    assert set(db.find({'and': [{'field': 'age', 'op': '>', 'value': 20},
+                                {'field': 'address.city', 'op': '!=', 'value': 'Paris'}]})) == {'bob', 'eve'}
+    assert set(db.find({'or': [{'field': 'name', 'op': '=', 'value': 'Dee'},
+                               {'field': 'age', 'op': '>=', 'value': 40}]})) == {'cid', 'dee', 'eve'}
+    assert set(db.find({'field': 'age', 'op': 'in', 'value': [25, '19', 'x']})) == {'bob', 'dee'}
+    assert set(db.find({'field': 'name', 'op': 'prefix', 'value': 'A'})) == {'ann', 'eve'}
+    assert set(db.find({'field': 'email', 'op': 'exists'})) == {'cid'}
+    assert set(db.find({'not': {'field': 'age', 'op': '<', 'value': 50}})) == {'eve', 'raw'}
+
+    db.begin_transaction()
+    db.update('bob', {'name': 'Bob', 'age': 60})
+    db.delete('eve')
+    assert set(db.find({'field': 'age', 'op': '>', 'value': 45})) == {'bob'}
+    db.rollback()
+
+
+def test_find_evaluates_the_predicate_once_per_record(db_file, monkeypatch):
+    import query
+    calls = []
+    compile_predicate = query.compile_predicate
+    def counting(spec):
+        predicate = compile_predicate(spec)
+        return lambda record: calls.append(record) or predicate(record)
+    monkeypatch.setattr(query, 'compile_predicate', counting)
+    db = SimpleNoSQLDB(db_file)
+    db.bulk_create({f'k{i}': {'n': i} for i in range(10)})
+    assert list(db.find({'field': 'n', 'op': '>=', 'value': 5}, order_by='-n', limit=2)) == ['k9', 'k8']
+    assert len(calls) == 10
+
+    # Paging walks the keys on from the cursor instead of rescanning the store per page.
+    db.bulk_create({f'p{i:03d}': {'n': i} for i in range(200)})
+    calls.clear()
+    even = {'field': 'n', 'op': 'in', 'value': list(range(0, 200, 2))}
+    page = [key for key, _ in db.iter_find(even, after='k9', page_size=7)]
+    assert page == [f'p{i:03d}' for i in range(0, 200, 2)] and len(calls) == 200
+    calls.clear()
+    assert [key for key, _ in db.iter_find(even, after='p010', limit=3, page_size=2)] == ['p012', 'p014', 'p016']
+    assert len(calls) == 6
+
+
+def test_find_projection_order_and_limit(db_file):
+    db = SimpleNoSQLDB(db_file)
+    _people(db)
+    results = db.find({'field': 'age', 'op': 'exists'}, select=['name', 'address.city'], order_by='-age', limit=3)
+    assert list(results.items()) == [
+        ('eve', {'name': 'Alice', 'address.city': 'Rome'}),
+        ('cid', {'name': 'Cid', 'address.city': 'Paris'}),
+        ('ann', {'name': 'Ann', 'address.city': 'Paris'}),
+    ]
+    assert list(db.find(order_by=['address.city', 'name'])) == ['bob', 'ann', 'cid', 'eve', 'dee', 'raw']
+    assert list(db.find({'field': 'age', 'op': '<', 'value': 40}, limit=2)) == ['ann', 'bob']
+    with pytest.raises(ValueError):
+        db.find({'field': 'age', 'op': 'like', 'value': 1})
+
+
+def test_planner_picks_most_selective_index(db_file):
+    db = SimpleNoSQLDB(db_file)
+    db.bulk_create({f'k{i:03d}': {'age': i % 50, 'city': 'Paris' if i == 7 else 'Rome'} for i in range(200)})
+    db.create_index('age', 'sorted')
+    db.create_index('city', 'hash')
+    where = {'and': [{'field': 'age', 'op': '<', 'value': 10}, {'field': 'city', 'op': '=', 'value': 'Paris'}]}
+    assert db.explain(where) == {'plan': 'index', 'indexes': ['city (hash) ='], 'estimate': 1}
+    assert list(db.find(where)) == ['k007']
+    assert db.explain({'or': [where, {'field': 'missing', 'op': '=', 'value': 1}]}) == {'plan': 'scan'}
+    assert db.explain({'field': 'age', 'op': 'in', 'value': [1, 2]})['estimate'] == 8
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    from metrics import metrics
+    # Importing the app creates its default databases directory (relative to
+    # the working directory) and turns metrics on.
+    (tmp_path / 'run').mkdir()
+    monkeypatch.chdir(tmp_path / 'run')
+    monkeypatch.setattr(metrics, 'enabled', metrics.enabled)
+    import app as web
+    manager = DatabaseManager(str(tmp_path / 'data' / 'databases'), registry=DatabaseRegistry())
+    monkeypatch.setattr(web, 'db_manager', manager)
+    manager.create_database('people')
+    return web.app.test_client()
+
+
+def test_api_bulk_names_the_failing_operation(api):
+    ops = [{'op': 'create', 'key': 'a', 'value': 1}, {'op': 'create', 'key': 'b', 'value': 2}]
+    assert api.post('/api/people/_bulk', json=ops).get_json() == {'applied': 2}
+    response = api.post('/api/people/_bulk', json={'ops': [{'op': 'put', 'key': 'c', 'value': 3},
+                                                           {'op': 'update', 'key': 'd', 'value': 4},
+                                                           {'op': 'create', 'key': 'a', 'value': 5}]})
+    assert response.status_code == 409 and response.get_json()['index'] == 1
+    response = api.post('/api/people/_bulk', json=[{'op': 'delete', 'key': 'a'}, {'op': 'upsert', 'key': 'b'}])
+    assert response.status_code == 400 and response.get_json()['index'] == 1
+    assert api.get('/api/people/_keys').get_json()['keys'] == ['a', 'b']
+
+
+def test_api_records_keep_nulls_and_reserve_underscore_keys(api):
+    assert api.put('/api/people/ann', json={'age': 30}).status_code == 201
+    assert api.put('/api/people/ann?ttl=60', json={'age': 31}).status_code == 200
+    response = api.get('/api/people/ann').get_json()
+    assert response['value'] == {'age': 31} and 0 < response['ttl'] <= 60
+    assert api.put('/api/people/nothing', data='null', content_type='application/json').status_code == 201
+    assert api.get('/api/people/nothing').get_json() == {'key': 'nothing', 'value': None}
+    assert api.get('/api/people/missing').status_code == 404
+    assert api.put('/api/people/_meta', json=1).status_code == 400
+    assert api.get('/api/people/_meta').status_code == 400
+    response = api.post('/api/people/_bulk', json=[{'op': 'put', 'key': 'bob', 'value': 1},
+                                                    {'op': 'put', 'key': '_meta', 'value': 2}])
+    assert response.status_code == 400 and response.get_json()['index'] == 1
+    assert api.post('/api/people/_mget', json={'keys': ['ann', 'nothing', 'missing']}).get_json() == {
+        'values': {'ann': {'age': 31}, 'nothing': None, 'missing': None}}
+    for body in ([1], {'keys': ['ann', None]}, {'keys': 'ann'}):
+        response = api.post('/api/people/_mget', json=body)
+        assert response.status_code == 400 and 'error' in response.get_json()
+    assert api.delete('/api/people/nothing').get_json() == {'key': 'nothing', 'deleted': True}
+    assert api.delete('/api/people/nothing').status_code == 404
+    assert api.get('/api/people/_keys').get_json()['keys'] == ['ann']
+    assert api.get('/api/nobody/ann').status_code == 404
+
+
+def test_api_query_pages_and_validates_limit(api):
+    api.post('/api/people/_bulk', json=[{'op': 'create', 'key': f'k{i}', 'value': {'n': i}} for i in range(5)])
+    response = api.get('/api/people/_query?where=n >= 1&limit=2').get_json()
+    assert response == {'results': {'k1': {'n': 1}, 'k2': {'n': 2}}, 'next': 'k2'}
+    response = api.get('/api/people/_query?where=n >= 1&limit=2&after=k2').get_json()
+    assert response == {'results': {'k3': {'n': 3}, 'k4': {'n': 4}}, 'next': None}
+    response = api.post('/api/people/_query', json={'where': {'field': 'n', 'op': '<', 'value': 2},
+                                                     'order_by': '-n', 'select': ['n']})
+    assert response.get_json() == {'results': [{'key': 'k1', 'value': {'n': 1}}, {'key': 'k0', 'value': {'n': 0}}]}
+    for limit in ('0', '-1', 'many'):
+        assert api.get(f'/api/people/_query?where=n >= 1&limit={limit}').status_code == 400
+    assert api.post('/api/people/_query', json={'limit': 0}).status_code == 400
+
+
+def test_web_transactions_apply_on_commit(api, tmp_path):
+    assert api.get('/database/people?action=begin_transaction').status_code == 302
+    response = api.post('/database/people?action=create', data={'key': 'ann', 'value': '{"age": 30}'})
+    assert response.status_code == 302
+    assert api.get('/api/people/ann').status_code == 404
+    api.get('/database/people?action=commit')
+    assert api.get('/api/people/ann').get_json()['value'] == {'age': 30}
+
+    api.get('/database/people?action=begin_transaction')
+    api.post('/database/people?action=create', data={'key': 'bob', 'value': '1'})
+    api.get('/database/people?action=rollback')
+    assert api.get('/api/people/_keys').get_json()['keys'] == ['ann']
+    # Without a transaction, writes from the web UI are refused.
+    api.post('/database/people?action=create', data={'key': 'cid', 'value': '1'})
+    assert api.get('/api/people/cid').status_code == 404
+
+
+def test_metrics_endpoint_exports_cache_requests_as_a_counter(api, tmp_path, monkeypatch):
+    import app as web
+    from metrics import metrics
+    manager = DatabaseManager(str(tmp_path / 'cached'), registry=DatabaseRegistry(), storage_format='binary',
+                              lazy=True, cache_bytes=10 ** 6)
+    monkeypatch.setattr(web, 'db_manager', manager)
+    manager.create_database('people')
+    manager.get_db('people').put('ann', {'age': 30})
+    text = api.get('/metrics').get_data(as_text=True)
+    assert '# TYPE nosql_cache_requests_total counter' in text
+    assert 'nosql_cache_requests_total{db="people",result="miss"}' in text
+    with pytest.raises(ValueError):
+        metrics.set_gauge('nosql_cache_requests_total', 1, db='people', result='hit')